@@ -0,0 +1,309 @@
+"""Índice aproximado (IVF / k-means) para galerias grandes.
+
+Os vetores são particionados por k-means em `nlist` listas; cada lista é um
+FaceMatcher próprio, então a busca calcula a distância aos centróides,
+visita só as `nprobe` listas mais próximas e faz busca exata nelas.
+
+Uso na linha de comando:
+    python backend/ann_index.py build            # lê `encodings` e salva o índice
+    python backend/ann_index.py report           # recall/latência vs busca exata
+    python backend/ann_index.py report --synthetic 100000
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from threading import RLock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from matcher import DEFAULT_THRESHOLD, ENCODING_DIM, UNKNOWN_LABEL, FaceMatcher
+
+DEFAULT_NPROBE = 8
+MIN_TRAIN_SIZE = 1024      # abaixo disso uma lista única (busca exata) é mais rápida
+_ASSIGN_CHUNK = 65536
+
+
+def default_nlist(n: int) -> int:
+    return int(max(1, min(4096, round(4 * np.sqrt(max(n, 1))))))
+
+
+def _assign(vecs: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Centróide mais próximo de cada vetor (em blocos para limitar memória)."""
+    c_sq = np.einsum('ij,ij->i', centroids, centroids)
+    out = np.empty(vecs.shape[0], dtype=np.int32)
+    for start in range(0, vecs.shape[0], _ASSIGN_CHUNK):
+        block = vecs[start:start + _ASSIGN_CHUNK]
+        # |v|^2 é constante por linha, não altera o argmin
+        d = c_sq[None, :] - 2.0 * (block @ centroids.T)
+        out[start:start + block.shape[0]] = d.argmin(axis=1)
+    return out
+
+
+def train_kmeans(vecs: np.ndarray, nlist: int, iters: int = 15, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    sample = vecs
+    if vecs.shape[0] > 256 * nlist:
+        sample = vecs[rng.choice(vecs.shape[0], 256 * nlist, replace=False)]
+    centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist).astype(np.float32)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Lista vazia: reinicia com um ponto aleatório
+        if empty.any():
+            centroids[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """Mesma interface de FaceMatcher (load/add/remove/match/labels)."""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, nlist: Optional[int] = None,
+                 nprobe: int = DEFAULT_NPROBE):
+        self.threshold = threshold
+        self.nprobe = nprobe
+        self._nlist_opt = nlist
+        self._lock = RLock()
+        self._centroids = np.zeros((1, ENCODING_DIM), dtype=np.float32)
+        self._lists: List[FaceMatcher] = [FaceMatcher(threshold)]
+        self._where: Dict[str, int] = {}
+        self.trained_size = 0
+        self.dirty = False
+
+    def __len__(self):
+        return len(self._where)
+
+    @property
+    def nlist(self) -> int:
+        return len(self._lists)
+
+    @property
+    def needs_retrain(self) -> bool:
+        n = len(self._where)
+        if self.trained_size == 0:
+            return n >= MIN_TRAIN_SIZE
+        return self._drifted(n)
+
+    def build(self, names: List[str], vecs: np.ndarray):
+        """Treina os centróides e distribui todos os vetores."""
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        n = len(names)
+        if n >= MIN_TRAIN_SIZE:
+            nlist = min(self._nlist_opt or default_nlist(n), n)
+            centroids = train_kmeans(vecs, nlist)
+            assign = _assign(vecs, centroids)
+        else:
+            centroids = np.zeros((1, ENCODING_DIM), dtype=np.float32)
+            assign = np.zeros(n, dtype=np.int32)
+        lists = []
+        for li in range(centroids.shape[0]):
+            rows = np.flatnonzero(assign == li)
+            m = FaceMatcher(self.threshold, capacity=max(16, 2 * len(rows)))
+            m.load({names[r]: vecs[r] for r in rows})
+            lists.append(m)
+        with self._lock:
+            self._centroids = centroids
+            self._lists = lists
+            self._where = {names[r]: int(assign[r]) for r in range(n)}
+            self.trained_size = n if n >= MIN_TRAIN_SIZE else 0
+            self.dirty = True
+
+    def load(self, encodings: Dict[str, Sequence[float]]):
+        """Sincroniza com a galeria; só retreina se o índice não servir mais."""
+        with self._lock:
+            if self.trained_size and not self._drifted(len(encodings)):
+                for name in [n for n in self._where if n not in encodings]:
+                    self.remove(name)
+                for name, enc in encodings.items():
+                    vec = np.asarray(enc, dtype=np.float32)
+                    if not np.array_equal(self._vector(name), vec):
+                        self.add(name, vec)
+                return
+        self.rebuild(encodings)
+
+    def rebuild(self, encodings: Dict[str, Sequence[float]]):
+        names = list(encodings.keys())
+        vecs = np.asarray([encodings[n] for n in names], dtype=np.float32).reshape(-1, ENCODING_DIM)
+        self.build(names, vecs)
+
+    def _drifted(self, n: int) -> bool:
+        return n > 2 * self.trained_size or n < self.trained_size // 2
+
+    def _vector(self, name: str) -> Optional[np.ndarray]:
+        li = self._where.get(name)
+        if li is None:
+            return None
+        lst = self._lists[li]
+        return lst._matrix[lst._index[name]]
+
+    def add(self, name: str, enc: Sequence[float]):
+        vec = np.asarray(enc, dtype=np.float32).reshape(1, ENCODING_DIM)
+        with self._lock:
+            li = int(_assign(vec, self._centroids)[0])
+            old = self._where.get(name)
+            if old is not None and old != li:
+                self._lists[old].remove(name)
+            self._lists[li].add(name, vec[0])
+            self._where[name] = li
+            self.dirty = True
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            li = self._where.pop(name, None)
+            if li is None:
+                return False
+            self._lists[li].remove(name)
+            self.dirty = True
+            return True
+
+    def match(self, encs: Iterable[Sequence[float]], k: int = 1, threshold: Optional[float] = None,
+              nprobe: Optional[int] = None) -> List[List[Tuple[str, float]]]:
+        thr = self.threshold if threshold is None else threshold
+        q = np.asarray(encs, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        nprobe = self.nprobe if nprobe is None else nprobe
+        out: List[List[Tuple[str, float]]] = []
+        with self._lock:
+            nprobe = max(1, min(nprobe, len(self._lists)))
+            c_d = np.einsum('ij,ij->i', self._centroids, self._centroids)[None, :] - 2.0 * (q @ self._centroids.T)
+            if nprobe < len(self._lists):
+                probes = np.argpartition(c_d, nprobe - 1, axis=1)[:, :nprobe]
+            else:
+                probes = np.tile(np.arange(len(self._lists)), (q.shape[0], 1))
+            for i in range(q.shape[0]):
+                cands: List[Tuple[str, float]] = []
+                for li in probes[i]:
+                    cands.extend(self._lists[li].match(q[i:i + 1], k=k, threshold=thr)[0])
+                cands.sort(key=lambda t: t[1])
+                out.append(cands[:k])
+        return out
+
+    def labels(self, encs: Iterable[Sequence[float]], threshold: Optional[float] = None) -> List[str]:
+        return [m[0][0] if m else UNKNOWN_LABEL for m in self.match(encs, k=1, threshold=threshold)]
+
+    # ----------------- Persistência -----------------
+    def save(self, path: Path):
+        """Grava o índice de forma atômica (arquivo temporário + rename).
+
+        Só a cópia dos arrays acontece sob o lock; a escrita em disco não
+        segura quem está fazendo match.
+        """
+        path = Path(path)
+        with self._lock:
+            names: List[str] = []
+            vecs: List[np.ndarray] = []
+            assign: List[int] = []
+            for li, lst in enumerate(self._lists):
+                n = len(lst)
+                names.extend(lst._names)
+                vecs.append(lst._matrix[:n].copy())
+                assign.extend([li] * n)
+            centroids = self._centroids.copy()
+            meta = {'trained_size': self.trained_size, 'nprobe': self.nprobe}
+            self.dirty = False
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f,
+                         centroids=centroids,
+                         vectors=np.concatenate(vecs) if vecs else np.zeros((0, ENCODING_DIM), np.float32),
+                         assign=np.asarray(assign, dtype=np.int32),
+                         names=np.asarray(names, dtype=str),
+                         meta=np.asarray(json.dumps(meta)))
+            os.replace(tmp, path)
+        except Exception:
+            self.dirty = True
+            raise
+
+    @classmethod
+    def load_file(cls, path: Path, threshold: float = DEFAULT_THRESHOLD, nprobe: Optional[int] = None):
+        data = np.load(str(path))
+        meta = json.loads(str(data['meta']))
+        idx = cls(threshold=threshold, nprobe=nprobe or meta.get('nprobe', DEFAULT_NPROBE))
+        centroids = data['centroids'].astype(np.float32)
+        vectors = data['vectors'].astype(np.float32)
+        assign = data['assign']
+        names = [str(n) for n in data['names']]
+        lists = []
+        for li in range(centroids.shape[0]):
+            rows = np.flatnonzero(assign == li)
+            m = FaceMatcher(threshold, capacity=max(16, 2 * len(rows)))
+            m.load({names[r]: vectors[r] for r in rows})
+            lists.append(m)
+        idx._centroids = centroids
+        idx._lists = lists
+        idx._where = {names[r]: int(assign[r]) for r in range(len(names))}
+        idx.trained_size = int(meta.get('trained_size', 0))
+        return idx
+
+
+def recall_report(index: IVFIndex, exact: FaceMatcher, queries: np.ndarray, k: int = 1,
+                  nprobes: Sequence[int] = (1, 2, 4, 8, 16, 32, 64)) -> Dict[str, object]:
+    """Recall@k e latência por consulta (ms) para cada nprobe vs busca exata."""
+    inf = float('inf')
+    t0 = time.perf_counter()
+    truth = [set(n for n, _ in m) for m in exact.match(queries, k=k, threshold=inf)]
+    exact_ms = (time.perf_counter() - t0) * 1000.0 / max(1, len(queries))
+    rows = []
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            break
+        t0 = time.perf_counter()
+        approx = index.match(queries, k=k, threshold=inf, nprobe=nprobe)
+        ms = (time.perf_counter() - t0) * 1000.0 / max(1, len(queries))
+        hits = sum(len(t & set(n for n, _ in a)) for t, a in zip(truth, approx))
+        rows.append({'nprobe': nprobe, 'recall': hits / max(1, sum(len(t) for t in truth)),
+                     'latency_ms': round(ms, 4), 'speedup': round(exact_ms / ms, 2) if ms else None})
+    return {'size': len(exact), 'nlist': index.nlist, 'k': k, 'queries': len(queries),
+            'exact_latency_ms': round(exact_ms, 4), 'operating_points': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['build', 'report'])
+    parser.add_argument('--path', default=None)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='usa N vetores sintéticos em vez da tabela encodings')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=1)
+    args = parser.parse_args()
+
+    from store import DATA_DIR, load_encodings, make_pool
+    path = Path(args.path) if args.path else DATA_DIR / 'ann_index.npz'
+
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        vecs = rng.normal(0, 0.1, size=(args.synthetic, ENCODING_DIM)).astype(np.float32)
+        names = [f'synthetic_{i}' for i in range(args.synthetic)]
+    else:
+        encodings = load_encodings(make_pool(size=1).connection)
+        names = list(encodings.keys())
+        vecs = np.asarray([encodings[n] for n in names], dtype=np.float32).reshape(-1, ENCODING_DIM)
+
+    t0 = time.perf_counter()
+    index = IVFIndex(nlist=args.nlist)
+    index.build(names, vecs)
+    print(f'índice construído: {len(index)} vetores, {index.nlist} listas, '
+          f'{time.perf_counter() - t0:.2f}s')
+
+    if args.command == 'build':
+        index.save(path)
+        print('salvo em', path)
+        return
+
+    exact = FaceMatcher(capacity=len(names))
+    exact.load(dict(zip(names, vecs)))
+    rng = np.random.default_rng(1)
+    pick = rng.choice(len(names), min(args.queries, len(names)), replace=False)
+    queries = vecs[pick] + rng.normal(0, 0.02, size=(len(pick), ENCODING_DIM)).astype(np.float32)
+    print(json.dumps(recall_report(index, exact, queries, k=args.k), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,47 @@
 import os
-import re
 import json
+import atexit
 import base64
+import hashlib
+import hmac
 import subprocess
+import sys
+import time
 from pathlib import Path
 from threading import Lock
 from typing import Dict, Any, List
 from urllib.parse import quote
 
 from flask import Flask, request, send_from_directory, redirect, session, jsonify
-from flask_socketio import SocketIO, emit
-import mysql.connector
+from flask_socketio import SocketIO, emit, join_room
+from eventlet import tpool
+from eventlet.queue import LightQueue
 from mysql.connector import Error, errorcode
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from detectors import normalize_spec
+from encoding_format import json_column, migrate_json_encodings, pack
+from fanout import FanOut
+from frame_slot import FrameSlot
+from gallery import GalleryCache
+from enrollment import EnrollmentJob, run_enrollment
+from inference import InferencePool, MicroBatcher, assess_sample, recognize_batch, recognize_tracked
+from matcher import DEFAULT_THRESHOLD, UNKNOWN_LABEL
+from metrics import registry as metrics
+from motion import MotionGate
+from resolution import ResolutionController
+from store import (BASE_DIR, DATA_DIR, NODE_TOKEN_FILE, ensure_schema, get_user_by_id, make_pool, node_token,
+                   slugify_filename)
+from supervisor import NodeSupervisor
+from thumbnails import parse_name, remove_photo, store_photo, thumb_urls
+from tracking import FaceTracker
+
 # ----------------- Config -----------------
-BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_DIR = BASE_DIR / 'data'
 FRONTEND_DIR = BASE_DIR / 'frontend'
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 (FRONTEND_DIR / 'static').mkdir(parents=True, exist_ok=True)
 (DATA_DIR / 'faces').mkdir(parents=True, exist_ok=True)
+(DATA_DIR / 'logs').mkdir(parents=True, exist_ok=True)
 
 app = Flask(__name__, static_folder=str(FRONTEND_DIR / 'static'))
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-change-me')
@@ -30,19 +51,238 @@ socketio = SocketIO(app, cors_allowed_origins='*', async_mode='eventlet')
 processes_lock = Lock()
 processing_procs: Dict[str, subprocess.Popen] = {}
 
-DB_CONFIG = {
-    'user': 'ari',
-    'password': 'ari',
-    'host': '127.0.0.1',
-    'port': '3307',
-    'database': 'privateafter_db'  # não usar raise_on_warnings aqui
+# Métricas (METRICS=0 desliga); /metrics exige METRICS_TOKEN se definido
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+metrics.describe('stage_seconds', 'histogram', 'Tempo por estágio dos frames do navegador')
+metrics.describe('node_stage_seconds', 'histogram', 'Tempo por estágio nos nós (enviado pelo node_result)')
+metrics.describe('db_wait_seconds', 'histogram', 'Espera por conexão do pool, por helper')
+metrics.describe('db_query_seconds', 'histogram', 'Tempo com a conexão emprestada, por helper')
+metrics.describe('viewer_ack_seconds', 'histogram', 'Envio ao navegador até o ack do recognition_update')
+metrics.describe('frames_dropped_total', 'counter', 'Frames descartados, por câmera e motivo')
+
+def observe_db(helper: str, wait_s: float, hold_s: float, failed: bool):
+    metrics.observe('db_wait_seconds', wait_s, helper=helper)
+    metrics.observe('db_query_seconds', hold_s, helper=helper)
+    if failed:
+        metrics.inc('db_errors_total', helper=helper)
+
+def observe_stages(out: Dict[str, Any], camera_id: str = 'main'):
+    """Tempos medidos no worker (decode/detect/encode) de um resultado do pool."""
+    for stage in ('decode', 'detect', 'encode'):
+        seconds = out.get(f'{stage}_s')
+        if seconds is not None:
+            metrics.observe('stage_seconds', seconds, camera_id=camera_id, stage=stage)
+
+# Pool único para todos os helpers (espera cooperativa no hub do eventlet)
+db_pool = make_pool(queue_factory=LightQueue, observer=observe_db if metrics.enabled else None)
+
+MATCH_THRESHOLD = float(os.environ.get('MATCH_THRESHOLD', DEFAULT_THRESHOLD))
+
+# Índice aproximado (IVF) opcional para galerias grandes
+ANN_INDEX_ENABLED = os.environ.get('ANN_INDEX', '0') == '1'
+ANN_INDEX_PATH = DATA_DIR / 'ann_index.npz'
+ANN_INDEX_SAVE_INTERVAL = float(os.environ.get('ANN_INDEX_SAVE_INTERVAL', '30'))
+
+# Galeria de rostos conhecidos em memória (evita SELECT a cada frame)
+gallery = GalleryCache(db_pool.connection,
+                       refresh_interval=float(os.environ.get('GALLERY_REFRESH_INTERVAL', '5')),
+                       threshold=MATCH_THRESHOLD)
+
+# Nós de processamento recebem as alterações da galeria pela conexão Socket.IO
+GALLERY_ROOM = 'gallery_nodes'
+NODE_TOKEN = node_token()  # ambiente ou data/node_token
+gallery.log.subscribe(lambda msg: socketio.emit('gallery_delta', msg, to=GALLERY_ROOM))
+
+# Resultados dos nós -> navegadores inscritos por câmera, com coalescência por navegador
+def send_to_viewer(sid: str, payload: Dict[str, Any], on_ack):
+    if not metrics.enabled:
+        socketio.emit('recognition_update', payload, to=sid, callback=on_ack)
+        return
+    sent = time.perf_counter()
+
+    def acked(*args):
+        metrics.observe('viewer_ack_seconds', time.perf_counter() - sent, camera_id=payload.get('camera_id'))
+        on_ack(*args)
+    socketio.emit('recognition_update', payload, to=sid, callback=acked)
+
+viewer_fanout = FanOut(send_to_viewer,
+                       max_in_flight=int(os.environ.get('FANOUT_MAX_IN_FLIGHT', '2')),
+                       thumb_interval=float(os.environ.get('FANOUT_THUMB_INTERVAL_MS', '0')) / 1000.0)
+node_sids = set()  # conexões já autenticadas como nó (via gallery_sync)
+node_status: Dict[str, Dict[str, Any]] = {}
+
+# Um node.py por câmera cadastrada enquanto houver alguém assistindo a multicâmera
+NODE_SUPERVISOR = os.environ.get('NODE_SUPERVISOR', '1') == '1'
+NODE_SCRIPT = BASE_DIR / 'processing_nodes' / 'node.py'
+if NODE_SUPERVISOR and not NODE_TOKEN:
+    # sem NODE_TOKEN: usa/gera data/node_token; supervisionados herdam pelo ambiente
+    # e nós iniciados à mão na mesma máquina leem o arquivo
+    NODE_TOKEN = os.environ['NODE_TOKEN'] = node_token(create=True)
+    print(f"NODE_TOKEN em {NODE_TOKEN_FILE} (outra máquina: NODE_TOKEN=<conteúdo> python node.py ...)")
+
+def node_command(camera_id: str, url: str) -> List[str]:
+    server_url = os.environ.get('NODE_SERVER_URL', f"http://127.0.0.1:{os.environ.get('PORT', '5000')}")
+    return [sys.executable, str(NODE_SCRIPT), '--camera_id', camera_id, '--camera_url', url,
+            '--server_url', server_url, '--send_frame']
+
+node_supervisor = NodeSupervisor(node_command,
+                                 max_nodes=int(os.environ.get('NODE_MAX_PROCS', '0')) or None,
+                                 procs=processing_procs, lock=processes_lock,
+                                 log_dir=DATA_DIR / 'logs')
+
+def sync_supervised_nodes():
+    """Liga os nós das câmeras cadastradas se há inscritos; desliga todos se não há."""
+    if not NODE_SUPERVISOR:
+        return
+    node_supervisor.set_cameras(load_cameras() if viewer_fanout.viewers else {})
+
+def supervise_nodes():
+    while True:
+        node_supervisor.poll()
+        socketio.sleep(1.0)
+
+def start_inference():
+    try:
+        inference_pool.start()
+        print(f"inference ready: {inference_pool.workers} workers, backend "
+              f"{inference_pool.engines[0]['backend']}, {inference_pool.startup_ms} ms")
+    except Exception as e:
+        print("inference start error:", e)
+
+# Índice IVF montado em segundo plano (ANN_INDEX=1); até ficar pronto o match é exato
+ann_index_state = {'state': 'building' if ANN_INDEX_ENABLED else 'disabled', 'build_ms': None, 'error': None}
+
+def build_ann_index():
+    """Carrega (ou treina) o índice fora do hub e troca o matcher exato por ele."""
+    from ann_index import DEFAULT_NPROBE, IVFIndex
+    nprobe = int(os.environ.get('ANN_NPROBE', DEFAULT_NPROBE))
+    t0 = time.perf_counter()
+    try:
+        index = None
+        if ANN_INDEX_PATH.exists():
+            try:
+                index = tpool.execute(IVFIndex.load_file, ANN_INDEX_PATH, threshold=MATCH_THRESHOLD, nprobe=nprobe)
+            except Exception as e:
+                print("ann index load error:", e)
+        if index is None:
+            index = IVFIndex(threshold=MATCH_THRESHOLD, nprobe=nprobe)
+        snapshot = gallery.get()
+        tpool.execute(index.load, snapshot)
+        # cadastros durante o treino: sincroniza o que faltou (galeria é copy-on-write)
+        while gallery.get() is not snapshot:
+            snapshot = gallery.get()
+            tpool.execute(index.load, snapshot)
+        gallery.swap_matcher(index, snapshot)
+        ann_index_state.update(state='ready', build_ms=round((time.perf_counter() - t0) * 1000.0, 1))
+        print(f"ann index ready: {len(index)} encodings, {index.nlist} listas, {ann_index_state['build_ms']} ms")
+    except Exception as e:
+        ann_index_state.update(state='failed', error=str(e))
+        print("ann index build error:", e)
+
+def persist_ann_index():
+    """Retreina se a galeria mudou muito e grava o índice IVF em disco, fora do hub."""
+    index = gallery.matcher
+    if not ANN_INDEX_ENABLED or not getattr(index, 'dirty', False):
+        return
+    try:
+        if index.needs_retrain:
+            snapshot = gallery.get()
+            tpool.execute(index.rebuild, snapshot)
+            # cadastros durante o treino: sincroniza o que faltou (galeria é copy-on-write)
+            while gallery.get() is not snapshot:
+                snapshot = gallery.get()
+                tpool.execute(index.load, snapshot)
+        tpool.execute(index.save, ANN_INDEX_PATH)
+    except Exception as e:
+        print("ann index save error:", e)
+
+def ann_index_saver():
+    """Grava o índice de tempos em tempos se mudou (nunca a cada cadastro/exclusão)."""
+    while True:
+        socketio.sleep(ANN_INDEX_SAVE_INTERVAL)
+        persist_ann_index()
+
+def save_ann_index_at_exit():
+    index = gallery.matcher
+    if ANN_INDEX_ENABLED and getattr(index, 'dirty', False):
+        try:
+            index.save(ANN_INDEX_PATH)
+        except Exception as e:
+            print("ann index save error:", e)
+
+# Detecção/encoding em processos separados; a espera pelo resultado roda
+# numa thread nativa (tpool) para não bloquear o hub do eventlet
+inference_pool = InferencePool(workers=int(os.environ.get('INFERENCE_WORKERS', '0')) or None,
+                               max_queue=int(os.environ.get('INFERENCE_MAX_QUEUE', '16')),
+                               waiter=tpool.execute, sleep=lambda s: socketio.sleep(s))
+
+# Frames de sessões diferentes que chegam dentro da janela viram um único lote
+frame_batcher = MicroBatcher(inference_pool, recognize_batch,
+                             window=float(os.environ.get('INFERENCE_BATCH_WINDOW_MS', '15')) / 1000.0,
+                             max_batch=int(os.environ.get('INFERENCE_MAX_BATCH', '8')),
+                             sleep=lambda s: socketio.sleep(s))
+
+# Cadastro em segundo plano com filtro de qualidade das amostras
+ENROLL_MIN_FACE_PX = int(os.environ.get('ENROLL_MIN_FACE_PX', '80'))
+ENROLL_MIN_SHARPNESS = float(os.environ.get('ENROLL_MIN_SHARPNESS', '40'))
+enrollment_jobs: Dict[str, EnrollmentJob] = {}
+# Página de /api/faces (padrão e máximo por requisição)
+FACES_PAGE_SIZE = int(os.environ.get('FACES_PAGE_SIZE', '60'))
+FACES_PAGE_MAX = 500
+# Fotos/miniaturas com hash no nome nunca mudam: 1 ano de cache (immutable)
+FACES_MAX_AGE = int(os.environ.get('FACES_MAX_AGE', str(365 * 24 * 3600)))
+
+# Detectar-e-rastrear na câmera do navegador: HOG a cada N frames (1 = sempre detectar)
+TRACK_DETECT_EVERY = int(os.environ.get('TRACK_DETECT_EVERY', '1'))
+session_trackers: Dict[str, FaceTracker] = {}
+
+# Resolução de detecção adaptativa por sessão (ajustável via 'stream_settings')
+RESOLUTION_DEFAULTS = {
+    'latency_budget_ms': float(os.environ.get('RES_LATENCY_BUDGET_MS', '80')),
+    'min_scale': float(os.environ.get('RES_MIN_SCALE', '0.25')),
+    'max_scale': float(os.environ.get('RES_MAX_SCALE', '1.0')),
+    'roi': os.environ.get('RES_ROI', '0') == '1',
 }
+session_resolution: Dict[str, ResolutionController] = {}
 
-# ----------------- Helpers -----------------
-def slugify_filename(name: str) -> str:
-    base = re.sub(r'[^a-zA-Z0-9._-]+', '_', name.strip())
-    return base.strip('_') or 'face'
+def resolution_for(sid: str) -> ResolutionController:
+    ctrl = session_resolution.get(sid)
+    if ctrl is None:
+        ctrl = session_resolution[sid] = ResolutionController(**RESOLUTION_DEFAULTS)
+    return ctrl
+
+# Portão de movimento: frames sem mudança reaproveitam o último resultado
+MOTION_DEFAULTS = {
+    'motion_gate': os.environ.get('MOTION_GATE', '1') == '1',
+    'motion_threshold': float(os.environ.get('MOTION_THRESHOLD', '0.01')),
+    'motion_pixel_delta': int(os.environ.get('MOTION_PIXEL_DELTA', '20')),
+    'motion_max_skip': int(os.environ.get('MOTION_MAX_SKIP', '100')),
+}
+session_motion: Dict[str, MotionGate] = {}
+session_last_payload: Dict[str, Dict[str, Any]] = {}
 
+def motion_for(sid: str) -> MotionGate:
+    gate = session_motion.get(sid)
+    if gate is None:
+        gate = session_motion[sid] = MotionGate(**MOTION_DEFAULTS)
+    return gate
+
+def reset_motion_gates():
+    """Galeria mudou: o próximo frame de cada sessão passa pela detecção."""
+    for gate in list(session_motion.values()):
+        gate.reset()
+
+# Slot "último frame vence" por sessão Socket.IO (sid -> FrameSlot)
+frame_slots: Dict[str, FrameSlot] = {}
+
+def monitor_hub_latency(interval: float = 0.1):
+    """Mede o atraso do hub: quanto um sleep curto demora além do pedido."""
+    while True:
+        t0 = time.perf_counter()
+        socketio.sleep(interval)
+        inference_pool.hub_lag.record(max(0.0, time.perf_counter() - t0 - interval))
+
+# ----------------- Helpers -----------------
 def current_user_id():
     return session.get('user_id')
 
@@ -52,97 +292,46 @@ def require_auth_socketio() -> bool:
         return False
     return True
 
-def ensure_schema():
-    # Conecta suprimindo warnings
-    try:
-        conn = mysql.connector.connect(**dict(DB_CONFIG, raise_on_warnings=False))
-    except Error:
-        cfg = dict(DB_CONFIG); cfg.pop('database', None)
-        cfg['raise_on_warnings'] = False
-        conn0 = mysql.connector.connect(**cfg)
-        cur0 = conn0.cursor()
-        cur0.execute("CREATE DATABASE IF NOT EXISTS privateafter_db")
-        conn0.commit(); cur0.close(); conn0.close()
-        conn = mysql.connector.connect(**dict(DB_CONFIG, raise_on_warnings=False))
-
-    cur = conn.cursor()
-    try:
-        cur.execute("SET sql_notes = 0")
-    except Exception:
-        pass
-
-    cur.execute("""CREATE TABLE IF NOT EXISTS users (
-        id INT AUTO_INCREMENT PRIMARY KEY,
-        name VARCHAR(191) NOT NULL,
-        email VARCHAR(191) UNIQUE NOT NULL,
-        password_hash VARCHAR(255) NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )""")
-
-    cur.execute("""CREATE TABLE IF NOT EXISTS encodings (
-        name VARCHAR(191) PRIMARY KEY,
-        encoding JSON NOT NULL,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-    )""")
-
-    cur.execute("SHOW COLUMNS FROM encodings LIKE 'owner_user_id'")
-    if not cur.fetchone():
-        try:
-            cur.execute("ALTER TABLE encodings ADD COLUMN owner_user_id INT NULL")
-        except Error:
-            pass
+def node_authorized(data) -> bool:
+    """Nó com o NODE_TOKEN ou usuário logado; sem NODE_TOKEN configurado, ninguém."""
+    if not NODE_TOKEN:
+        return False
+    if current_user_id():
+        return True
+    token = data.get('token') if isinstance(data, dict) else None
+    return isinstance(token, str) and hmac.compare_digest(token, NODE_TOKEN)
 
-    cur.execute("SHOW COLUMNS FROM encodings LIKE 'photo_filename'")
-    if not cur.fetchone():
-        try:
-            cur.execute("ALTER TABLE encodings ADD COLUMN photo_filename VARCHAR(255) NULL")
-        except Error:
-            pass
-
-    # Tentar adicionar a FK (ignora se já existir)
-    try:
-        cur.execute("""ALTER TABLE encodings
-                       ADD CONSTRAINT fk_enc_user
-                       FOREIGN KEY (owner_user_id) REFERENCES users(id)
-                       ON DELETE SET NULL""")
-    except Error:
-        pass
-
-    cur.execute("""CREATE TABLE IF NOT EXISTS cameras (
-        camera_id VARCHAR(191) PRIMARY KEY,
-        url TEXT NOT NULL,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-    )""")
-
-    conn.commit()
-    try:
-        cur.execute("SET sql_notes = 1")
-    except Exception:
-        pass
-    cur.close(); conn.close()
+def frame_bytes(value) -> bytes:
+    """JPEG de um anexo binário do Socket.IO ou de um data URL (fallback)."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return value
+    if isinstance(value, str) and ',' in value:
+        header, b64 = value.split(',', 1)
+        return base64.b64decode(b64)
+    raise ValueError('frame inválido')
 
 def get_user_by_email(email: str):
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        c = conn.cursor(dictionary=True)
-        c.execute("SELECT id, name, email, password_hash FROM users WHERE email=%s", (email,))
-        row = c.fetchone()
-        c.close(); conn.close()
+        with db_pool.connection('get_user_by_email') as conn:
+            c = conn.cursor(dictionary=True)
+            c.execute("SELECT id, name, email, password_hash FROM users WHERE email=%s", (email,))
+            row = c.fetchone()
+            c.close()
         return row
     except Error as e:
         print("get_user_by_email error:", e)
         return None
 
-def get_user_by_id(user_id: int):
+def photo_filename_for(name: str):
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        c = conn.cursor(dictionary=True)
-        c.execute("SELECT id, name, email FROM users WHERE id=%s", (user_id,))
-        row = c.fetchone()
-        c.close(); conn.close()
-        return row
+        with db_pool.connection('photo_filename_for') as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT photo_filename FROM encodings WHERE name = %s", (name,))
+            row = cur.fetchone()
+            cur.close()
+        return row[0] if row else None
     except Error as e:
-        print("get_user_by_id error:", e)
+        print("photo lookup error:", e)
         return None
 
 def upsert_encoding(name: str, enc: List[float], owner_user_id=None, photo_filename=None):
@@ -151,25 +340,29 @@ def upsert_encoding(name: str, enc: List[float], owner_user_id=None, photo_filen
     try:
         if owner_user_id is not None:
             oid = int(owner_user_id)
-            if get_user_by_id(oid):
+            if get_user_by_id(db_pool.connection, oid):
                 valid_owner_id = oid
     except Exception:
         valid_owner_id = None
 
     def _exec(owner_id):
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        enc_json = json.dumps(enc)
-        cur.execute("""
-            INSERT INTO encodings (name, encoding, owner_user_id, photo_filename)
-            VALUES (%s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-              encoding = VALUES(encoding),
-              owner_user_id = VALUES(owner_user_id),
-              photo_filename = VALUES(photo_filename)
-        """, (name, enc_json, owner_id, photo_filename))
-        conn.commit()
-        cur.close(); conn.close()
+        enc_bin = pack(enc)
+        with db_pool.connection('upsert_encoding') as conn:
+            cur = conn.cursor()
+            # escrita dupla: leitores da coluna JSON continuam funcionando na transição
+            cur.execute("""
+                INSERT INTO encodings (name, encoding_bin, encoding, owner_user_id, photo_filename)
+                VALUES (%s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                  encoding_bin = VALUES(encoding_bin),
+                  encoding = VALUES(encoding),
+                  owner_user_id = VALUES(owner_user_id),
+                  photo_filename = VALUES(photo_filename)
+            """, (name, enc_bin, json_column(enc), owner_id, photo_filename))
+            conn.commit()
+            cur.close()
+        gallery.put(name, enc)
+        reset_motion_gates()
 
     try:
         _exec(valid_owner_id)
@@ -183,49 +376,55 @@ def upsert_encoding(name: str, enc: List[float], owner_user_id=None, photo_filen
         else:
             print("upsert_encoding error:", e)
 
-def load_encodings() -> Dict[str, List[float]]:
-    encodings: Dict[str, List[float]] = {}
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        c = conn.cursor()
-        c.execute("SELECT name, encoding FROM encodings")
-        for name, enc_json in c:
-            try:
-                enc_list = json.loads(enc_json)
-                encodings[name] = enc_list
-            except Exception:
-                pass
-        c.close(); conn.close()
-    except Error as e:
-        print("load_encodings error:", e)
-    return encodings
-
 def load_cameras() -> Dict[str, str]:
     cams: Dict[str, str] = {}
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        c = conn.cursor()
-        c.execute("SELECT camera_id, url FROM cameras")
-        for cid, url in c:
-            cams[cid] = url
-        c.close(); conn.close()
+        with db_pool.connection('load_cameras') as conn:
+            c = conn.cursor()
+            c.execute("SELECT camera_id, url FROM cameras")
+            for cid, url in c:
+                cams[cid] = url
+            c.close()
     except Error as e:
         print("load_cameras error:", e)
     return cams
 
-def save_camera(camera_id: str, url: str):
+def save_camera(camera_id: str, url: str, settings: Dict[str, Any] = None):
+    # settings=None mantém os ajustes já gravados
+    settings_json = json.dumps(settings) if settings is not None else None
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO cameras (camera_id, url) VALUES (%s, %s)
-            ON DUPLICATE KEY UPDATE url = VALUES(url)
-        """, (camera_id, url))
-        conn.commit()
-        cur.close(); conn.close()
+        with db_pool.connection('save_camera') as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO cameras (camera_id, url, settings) VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE url = VALUES(url), settings = COALESCE(VALUES(settings), settings)
+            """, (camera_id, url, settings_json))
+            conn.commit()
+            cur.close()
     except Error as e:
         print("save_camera error:", e)
 
+def delete_camera(camera_id: str) -> bool:
+    try:
+        with db_pool.connection('delete_camera') as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM cameras WHERE camera_id = %s", (camera_id,))
+            deleted = cur.rowcount
+            conn.commit()
+            cur.close()
+        return deleted > 0
+    except Error as e:
+        print("delete_camera error:", e)
+        return False
+
+def migrate_encodings_background():
+    try:
+        n = migrate_json_encodings(db_pool.connection, batch_size=500, pause=0.05, sleep=socketio.sleep)
+        if n:
+            print(f"{n} encodings migrados de JSON para binário")
+    except Error as e:
+        print("encoding migration error:", e)
+
 # ----------------- Routes (API) -----------------
 @app.route('/api/signup', methods=['POST'])
 def api_signup():
@@ -239,12 +438,12 @@ def api_signup():
         return jsonify({'ok': False, 'msg': 'E-mail já cadastrado.'}), 409
     pwd_hash = generate_password_hash(password)
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        cur.execute("INSERT INTO users (name, email, password_hash) VALUES (%s, %s, %s)", (name, email, pwd_hash))
-        conn.commit()
-        user_id = cur.lastrowid
-        cur.close(); conn.close()
+        with db_pool.connection('api_signup') as conn:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO users (name, email, password_hash) VALUES (%s, %s, %s)", (name, email, pwd_hash))
+            conn.commit()
+            user_id = cur.lastrowid
+            cur.close()
         session['user_id'] = user_id
         return jsonify({'ok': True, 'user': {'id': user_id, 'name': name, 'email': email}})
     except Error as e:
@@ -273,7 +472,7 @@ def api_me():
     if not uid:
         return jsonify({'ok': False, 'msg': 'Not authenticated'}), 401
     
-    user = get_user_by_id(uid)
+    user = get_user_by_id(db_pool.connection, uid)
     if not user:
         # Se o usuário não existir mais, limpar a sessão
         session.pop('user_id', None)
@@ -281,29 +480,194 @@ def api_me():
     
     return jsonify({'ok': True, 'user': user})
 
+def escape_like(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def faces_filters(args):
+    """WHERE de /api/faces e /api/faces/summary: owner ('me' ou id) e q (prefixo do nome)."""
+    where, params = [], []
+    owner = (args.get('owner') or '').strip()
+    if owner:
+        where.append("owner_user_id = %s")
+        params.append(current_user_id() if owner == 'me' else int(owner))
+    prefix = args.get('q') or ''
+    if prefix:
+        where.append("name LIKE %s")
+        params.append(escape_like(prefix) + '%')
+    return where, params
+
 @app.route('/api/faces', methods=['GET'])
 def api_faces():
+    """Uma página por vez, em ordem de nome: `after` é o `next_cursor` da página anterior."""
     if not current_user_id():
         return jsonify({'ok': False, 'msg': 'Não autenticado.'}), 401
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        c = conn.cursor()
-        c.execute("SELECT name, photo_filename FROM encodings ORDER BY name ASC")
+        limit = min(max(int(request.args.get('limit', FACES_PAGE_SIZE)), 1), FACES_PAGE_MAX)
+        where, params = faces_filters(request.args)
+    except ValueError:
+        return jsonify({'ok': False, 'msg': 'Parâmetros inválidos.'}), 400
+    after = request.args.get('after')
+    if after:
+        where.append("name > %s")
+        params.append(after)
+    sql = "SELECT name, photo_filename FROM encodings"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY name ASC LIMIT %s"
+    try:
         faces = []
-        for name, photo_filename in c:
-            photo_url = f"/faces/{photo_filename}" if photo_filename else None
-            faces.append({'name': name, 'photo_url': photo_url})
-        c.close(); conn.close()
-        return jsonify({'ok': True, 'faces': faces})
+        with db_pool.connection('api_faces') as conn:
+            c = conn.cursor()
+            c.execute(sql, (*params, limit + 1))
+            for name, photo_filename in c:
+                photo_url = f"/faces/{photo_filename}" if photo_filename else None
+                faces.append({'name': name, 'photo_url': photo_url, 'thumbs': thumb_urls(photo_filename)})
+            c.close()
+        has_more = len(faces) > limit
+        faces = faces[:limit]
+        return jsonify({'ok': True, 'faces': faces, 'has_more': has_more,
+                        'next_cursor': faces[-1]['name'] if has_more else None})
     except Error as e:
         print("faces list error:", e)
         return jsonify({'ok': False, 'faces': []}), 500
 
+@app.route('/api/faces/summary', methods=['GET'])
+def api_faces_summary():
+    """COUNT(*)/MAX(updated_at) com os mesmos filtros; ETag para o cadastro pular o refetch."""
+    if not current_user_id():
+        return jsonify({'ok': False, 'msg': 'Não autenticado.'}), 401
+    try:
+        where, params = faces_filters(request.args)
+    except ValueError:
+        return jsonify({'ok': False, 'msg': 'Parâmetros inválidos.'}), 400
+    sql = "SELECT COUNT(*), MAX(updated_at) FROM encodings"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    try:
+        with db_pool.connection('api_faces_summary') as conn:
+            c = conn.cursor()
+            c.execute(sql, tuple(params))
+            count, max_updated = c.fetchone()
+            c.close()
+    except Error as e:
+        print("faces summary error:", e)
+        return jsonify({'ok': False}), 500
+    updated = max_updated.isoformat() if max_updated else None
+    etag = hashlib.sha1(repr((count, updated, params)).encode()).hexdigest()[:16]
+    resp = jsonify({'ok': True, 'count': count, 'updated_at': updated, 'etag': etag})
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+@app.route('/api/gallery/stats', methods=['GET'])
+def api_gallery_stats():
+    if not current_user_id():
+        return jsonify({'ok': False, 'msg': 'Não autenticado.'}), 401
+    return jsonify({'ok': True, 'gallery': gallery.stats()})
+
+@app.route('/api/db/stats', methods=['GET'])
+def api_db_stats():
+    if not current_user_id():
+        return jsonify({'ok': False, 'msg': 'Não autenticado.'}), 401
+    return jsonify({'ok': True, 'pool': db_pool.stats()})
+
+def collect_gauges():
+    """Profundidade das filas e estado geral, lidos na hora da coleta."""
+    yield 'engine_ready', {}, 1 if inference_pool.ready else 0
+    yield 'inference_in_flight', {}, inference_pool.in_flight
+    yield 'frame_sessions', {}, len(frame_slots)
+    yield 'frame_slots_pending', {}, sum(1 for s in frame_slots.values() if s.pending)
+    yield 'fanout_viewers', {}, len(viewer_fanout.viewers)
+    yield 'fanout_pending', {}, sum(len(v.pending) for v in viewer_fanout.viewers.values())
+    yield 'fanout_in_flight', {}, sum(v.in_flight for v in viewer_fanout.viewers.values())
+    yield 'enrollment_jobs', {}, len(enrollment_jobs)
+    yield 'db_pool_in_use', {}, db_pool.in_use
+    yield 'db_pool_open', {}, db_pool.stats()['open']
+    yield 'hub_lag_seconds', {}, inference_pool.hub_lag.last_ms / 1000.0
+    now = time.time()
+    for cid, st in list(node_status.items()):
+        if st.get('last_seen'):
+            yield 'node_last_seen_seconds', {'camera_id': cid}, round(now - st['last_seen'], 3)
+
+def collect_counters():
+    yield 'inference_submitted_total', {}, inference_pool.submitted
+    yield 'inference_rejected_total', {}, inference_pool.rejected
+    yield 'inference_failed_total', {}, inference_pool.failed
+    yield 'fanout_published_total', {}, viewer_fanout.published
+    yield 'db_pool_checkouts_total', {}, db_pool.checkouts
+    yield 'db_pool_timeouts_total', {}, db_pool.timeouts
+
+metrics.add_collector(collect_gauges, 'gauge')
+metrics.add_collector(collect_counters, 'counter')
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Formato texto do Prometheus; sem sessão, protegido por METRICS_TOKEN (Bearer ou ?token=)."""
+    if not metrics.enabled:
+        return 'metrics disabled\n', 404
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}' \
+            and request.args.get('token') != METRICS_TOKEN:
+        return 'unauthorized\n', 401
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/api/ready', methods=['GET'])
+def api_ready():
+    """Prontidão do motor de reconhecimento (para balanceador/monitoramento; sem login)."""
+    body = {'ok': inference_pool.ready, 'state': inference_pool.state,
+            'backend': inference_pool.engines[0]['backend'] if inference_pool.engines else None,
+            'startup_ms': inference_pool.startup_ms,
+            # informativo: sem o índice o match é exato (mais lento em galerias grandes)
+            'ann_index': ann_index_state}
+    return jsonify(body), 200 if inference_pool.ready else 503
+
+@app.route('/api/inference/stats', methods=['GET'])
+def api_inference_stats():
+    if not current_user_id():
+        return jsonify({'ok': False, 'msg': 'Não autenticado.'}), 401
+    frames = {'sessions': len(frame_slots),
+              'received': sum(s.received for s in frame_slots.values()),
+              'processed': sum(s.processed for s in frame_slots.values()),
+              'dropped': sum(s.dropped for s in frame_slots.values())}
+    return jsonify({'ok': True, 'inference': inference_pool.stats(), 'batching': frame_batcher.stats(),
+                    'frames': frames,
+                    'resolution': {sid: c.stats() for sid, c in session_resolution.items()},
+                    'fanout': viewer_fanout.stats(),
+                    'enrollment': {'active': len(enrollment_jobs)},
+                    'motion': {'gated': sum(g.gated for g in session_motion.values()),
+                               'processed': sum(g.processed for g in session_motion.values())}})
+
+@app.route('/api/nodes', methods=['GET'])
+def api_nodes():
+    """Processos supervisionados + último fps/latência reportado por cada nó."""
+    if not current_user_id():
+        return jsonify({'ok': False, 'msg': 'Não autenticado.'}), 401
+    status = node_supervisor.stats()
+    now = time.time()
+    for cid, reported in node_status.items():
+        node = status['nodes'].setdefault(cid, {'state': 'external'})
+        pipeline = (reported.get('stats') or {}).get('pipeline') or {}
+        node['fps'] = pipeline.get('fps')
+        node['inference_ms'] = (pipeline.get('stages') or {}).get('inference', {}).get('avg_ms')
+        node['last_seen_s'] = round(now - reported['last_seen'], 1) if reported.get('last_seen') else None
+    return jsonify({'ok': True, 'enabled': NODE_SUPERVISOR, **status})
+
 @app.route('/faces/<path:filename>')
 def faces_file(filename):
     faces_dir = DATA_DIR / 'faces'
     faces_dir.mkdir(parents=True, exist_ok=True)
-    return send_from_directory(str(faces_dir), filename)
+    parsed = parse_name(Path(filename).name)
+    if parsed is None:
+        # foto antiga (sem hash no nome): o navegador revalida a cada uso
+        resp = send_from_directory(str(faces_dir), filename, max_age=0)
+        resp.cache_control.no_cache = True
+        return resp
+    # nome muda com o conteúdo: ETag forte pelo hash e cache "para sempre"
+    etag = parsed[1] + (f'-{parsed[2]}' if parsed[2] else '')
+    resp = send_from_directory(str(faces_dir), filename, etag=etag, max_age=FACES_MAX_AGE)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
 
 # ----------------- Routes (HTML) -----------------
 @app.route('/')
@@ -350,34 +714,34 @@ def api_delete_face(face_name):
         return jsonify({'ok': False, 'msg': 'Não autenticado.'}), 401
     
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cur = conn.cursor()
-        
-        # Buscar o rosto antes de deletar para pegar o nome do arquivo da foto
-        cur.execute("SELECT photo_filename FROM encodings WHERE name = %s", (face_name,))
-        result = cur.fetchone()
-        
-        if not result:
-            cur.close(); conn.close()
-            return jsonify({'ok': False, 'msg': 'Rosto não encontrado.'}), 404
-        
-        photo_filename = result[0]
-        
-        # Deletar do banco
-        cur.execute("DELETE FROM encodings WHERE name = %s", (face_name,))
-        deleted_rows = cur.rowcount
-        conn.commit()
-        cur.close(); conn.close()
+        with db_pool.connection('api_delete_face') as conn:
+            cur = conn.cursor()
+
+            # Buscar o rosto antes de deletar para pegar o nome do arquivo da foto
+            cur.execute("SELECT photo_filename FROM encodings WHERE name = %s", (face_name,))
+            result = cur.fetchone()
+
+            if not result:
+                cur.close()
+                return jsonify({'ok': False, 'msg': 'Rosto não encontrado.'}), 404
+
+            photo_filename = result[0]
+
+            # Deletar do banco
+            cur.execute("DELETE FROM encodings WHERE name = %s", (face_name,))
+            deleted_rows = cur.rowcount
+            conn.commit()
+            cur.close()
         
         if deleted_rows == 0:
             return jsonify({'ok': False, 'msg': 'Rosto não encontrado.'}), 404
+        gallery.remove(face_name)
+        reset_motion_gates()
         
-        # Tentar deletar o arquivo de foto se existir
+        # Tentar deletar a foto e as miniaturas, se existirem
         if photo_filename:
             try:
-                photo_path = DATA_DIR / 'faces' / photo_filename
-                if photo_path.exists():
-                    photo_path.unlink()
+                remove_photo(photo_filename, DATA_DIR / 'faces')
             except Exception as e:
                 print(f"Erro ao deletar foto {photo_filename}: {e}")
         
@@ -393,6 +757,19 @@ def api_delete_face(face_name):
 def on_connect():
     emit('server_info', {'status': 'connected', 'authenticated': bool(current_user_id())})
 
+@socketio.on('disconnect')
+def on_disconnect():
+    frame_slots.pop(request.sid, None)
+    session_trackers.pop(request.sid, None)
+    session_resolution.pop(request.sid, None)
+    session_motion.pop(request.sid, None)
+    session_last_payload.pop(request.sid, None)
+    was_viewer = request.sid in viewer_fanout.viewers
+    viewer_fanout.drop(request.sid)
+    node_sids.discard(request.sid)
+    if was_viewer:
+        sync_supervised_nodes()
+
 @socketio.on('register_camera')
 def on_register_camera(data):
     if not require_auth_socketio():
@@ -402,152 +779,315 @@ def on_register_camera(data):
     if not camera_id or not url:
         emit('camera_result', {'ok': False, 'msg': 'camera_id e url são obrigatórios.'})
         return
-    save_camera(camera_id, url)
+    settings = data.get('settings')
+    if isinstance(settings, dict) and settings.get('detector'):
+        try:
+            settings['detector'] = normalize_spec(settings['detector'])
+        except ValueError as e:
+            emit('camera_result', {'ok': False, 'msg': str(e)})
+            return
+    save_camera(camera_id, url, settings if isinstance(settings, dict) else None)
+    if isinstance(settings, dict):
+        # node.py lê os ajustes ao iniciar: reinicia o nó da câmera
+        node_supervisor.remove(camera_id)
+    if NODE_SUPERVISOR and viewer_fanout.viewers:
+        # só esta câmera: inicia o nó (ou reinicia, se a url mudou)
+        node_supervisor.add(camera_id, url)
     emit('camera_result', {'ok': True})
 
+@socketio.on('unregister_camera')
+def on_unregister_camera(data):
+    if not require_auth_socketio():
+        return
+    camera_id = (data.get('camera_id') or '').strip() if isinstance(data, dict) else ''
+    if not camera_id:
+        emit('camera_result', {'ok': False, 'msg': 'camera_id é obrigatório.'})
+        return
+    deleted = delete_camera(camera_id)
+    node_supervisor.remove(camera_id)
+    node_status.pop(camera_id, None)
+    metrics.drop_remote(camera_id)
+    emit('camera_result', {'ok': deleted, 'msg': None if deleted else 'Câmera não encontrada.'})
+
 @socketio.on('submit_face_samples')
 def on_submit_face_samples(data):
     if not require_auth_socketio():
         return
-    # data: {name, samples: [dataURL,...]}
+    # data: {name, samples: [ArrayBuffer JPEG ou dataURL,...]}
     name = (data.get('name') or '').strip()
     samples: List[str] = data.get('samples') or []
     if not name or not samples:
         emit('submit_result', {'ok': False, 'msg': 'Nome e amostras são obrigatórios.'})
         return
 
-    try:
-        import cv2
-        import numpy as np
-        import face_recognition
-    except Exception as e:
-        emit('submit_result', {'ok': False, 'msg': f'Dependências não disponíveis: {e}'})
+    if not inference_pool.ready:
+        emit('submit_result', {'ok': False, 'msg': 'Motor de reconhecimento indisponível no momento.'})
+        return
+    if not inference_pool.have_face_recognition:
+        emit('submit_result', {'ok': False, 'msg': 'Dependências não disponíveis: face_recognition'})
         return
 
-    encs = []
-    first_image_bytes = None
-    for durl in samples:
+    images = []
+    for sample in samples:
         try:
-            header, b64 = durl.split(',', 1)
-            img_bytes = base64.b64decode(b64)
-            if first_image_bytes is None:
-                first_image_bytes = img_bytes
-            np_arr = np.frombuffer(img_bytes, dtype=np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-            if frame is None:
-                continue
-            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            boxes = face_recognition.face_locations(rgb, model='hog')
-            if not boxes:
-                continue
-            enc = face_recognition.face_encodings(rgb, boxes)[0]
-            encs.append(enc.tolist())
+            images.append(frame_bytes(sample))
         except Exception as e:
             print('encoding error:', e)
 
-    if not encs:
-        emit('submit_result', {'ok': False, 'msg': 'Nenhum rosto detectado nas amostras.'})
-        return
-
-    import numpy as np
-    enc_avg = np.mean(np.array(encs), axis=0).tolist()
+    # O handler só enfileira: avaliação/encoding rodam em segundo plano
+    job = EnrollmentJob(name, current_user_id(), request.sid, len(images))
+    enrollment_jobs[job.id] = job
+    socketio.start_background_task(enrollment_task, job, images)
+    emit('enrollment_progress', job.progress())
 
-    # Salvar foto representativa
+def save_enrollment(job: EnrollmentJob, enc_avg: List[float], photo_bytes: bytes):
+    # Salvar foto representativa (nome com hash do conteúdo) e as miniaturas
     faces_dir = DATA_DIR / 'faces'
-    faces_dir.mkdir(parents=True, exist_ok=True)
-    safe_name = slugify_filename(name)
-    photo_filename = f"{safe_name}.jpg"
     try:
-        if first_image_bytes:
-            with open(faces_dir / photo_filename, 'wb') as f:
-                f.write(first_image_bytes)
+        photo_filename = tpool.execute(store_photo, photo_bytes, slugify_filename(job.name), faces_dir)
     except Exception as e:
         print("Erro ao salvar foto:", e)
         photo_filename = None
+    previous = photo_filename_for(job.name)
 
     # Salvar encoding + metadados do dono (validação já acontece em upsert_encoding)
-    upsert_encoding(name, enc_avg, owner_user_id=current_user_id(), photo_filename=photo_filename)
-    emit('submit_result', {'ok': True, 'msg': f'Cadastro salvo para {name}.', 'count': len(encs)})
+    upsert_encoding(job.name, enc_avg, owner_user_id=job.owner_user_id, photo_filename=photo_filename)
+    if previous and previous != photo_filename:
+        try:
+            remove_photo(previous, faces_dir)
+        except Exception as e:
+            print(f"Erro ao deletar foto {previous}: {e}")
+
+def enrollment_task(job: EnrollmentJob, images: List[bytes]):
+    def send(event, payload):
+        socketio.emit(event, payload, to=job.sid)
+
+    try:
+        # amostras em paralelo nos workers; cada resultado gera um enrollment_progress
+        result = run_enrollment(
+            job, images,
+            assess=lambda items: inference_pool.imap(assess_sample, items, ENROLL_MIN_FACE_PX, ENROLL_MIN_SHARPNESS),
+            emit=send, save=save_enrollment)
+    except Exception as e:
+        print('enrollment error:', e)
+        job.status = 'failed'
+        result = {'ok': False, 'job_id': job.id, 'msg': 'Erro ao processar as amostras.'}
+    finally:
+        enrollment_jobs.pop(job.id, None)
+    send('submit_result', result)
+
+def process_tracked_frame(sid: str, img_bytes: bytes):
+    """Modo detectar-e-rastrear: o estado da sessão vai e volta com a tarefa."""
+    tracker = session_trackers.get(sid) or FaceTracker(detect_every=TRACK_DETECT_EVERY)
+    ctrl = resolution_for(sid)
+    out = inference_pool.run(recognize_tracked, img_bytes, tracker, ctrl.plan())
+    if out is None:
+        return None
+    out, tracker = out
+    if out is None:
+        return None
+    observe_stages(out)
+    if out['detect_s'] is not None:
+        ctrl.observe(out['detect_s'], out['boxes'])
+    if out['pending']:
+        with metrics.timer('stage_seconds', camera_id='main', stage='match'):
+            matches = gallery.get_matcher().match(out['encodings'], k=1)
+        for track_id, m in zip(out['pending'], matches):
+            tracker.assign(track_id, m[0][0] if m else UNKNOWN_LABEL, m[0][1] if m else None)
+    session_trackers[sid] = tracker
+    return {'camera_id': 'main', 'results': tracker.results(), 'frame_w': out['w'], 'frame_h': out['h']}
+
+def process_client_frame(sid: str, img_bytes: bytes):
+    """Reconhece um frame do navegador; retorna o payload de recognition_update."""
+    last = session_last_payload.get(sid)
+    gate = motion_for(sid)
+    # decodificação reduzida + diferença rodam fora do hub
+    if not tpool.execute(gate.check, img_bytes) and last is not None:
+        metrics.inc('frames_gated_total', camera_id='main')
+        return last
+    payload = recognize_client_frame(sid, img_bytes)
+    if payload is not None:
+        session_last_payload[sid] = payload
+        gate.commit()
+    return payload
+
+def recognize_client_frame(sid: str, img_bytes: bytes):
+    if TRACK_DETECT_EVERY > 1 and inference_pool.have_face_recognition:
+        return process_tracked_frame(sid, img_bytes)
+    # Detecção + encoding no pool (em micro-lote); None = fila cheia ou JPEG inválido
+    ctrl = resolution_for(sid)
+    out = frame_batcher.run((img_bytes, ctrl.plan()))
+    if out is None:
+        metrics.inc('frames_dropped_total', camera_id='main', reason='pool_full')
+        return None
+    observe_stages(out)
+    ctrl.observe(out['detect_s'], out['boxes'])
+
+    results = []
+    boxes = out['boxes']
+    if out['encodings'] is not None:
+        matches = []
+        if boxes:
+            with metrics.timer('stage_seconds', camera_id='main', stage='match'):
+                matches = gallery.get_matcher().match(out['encodings'], k=1)
+        for (top, right, bottom, left), m in zip(boxes, matches):
+            label = m[0][0] if m else UNKNOWN_LABEL
+            x, y = left, top
+            results.append({'name': label, 'box': [x, y, right - left, bottom - top]})
+    else:
+        # Fallback Haar (sem reconhecimento)
+        for (top, right, bottom, left) in boxes:
+            results.append({'name': UNKNOWN_LABEL, 'box': [left, top, right - left, bottom - top]})
+    return {'camera_id': 'main', 'results': results, 'frame_w': out['w'], 'frame_h': out['h']}
+
+def drain_frame_slot(sid: str, slot: FrameSlot):
+    """Processa sempre o frame mais novo da sessão até o slot esvaziar."""
+    try:
+        while True:
+            item = slot.take()
+            if item is None:
+                return
+            seq, img_bytes = item
+            t0 = time.perf_counter()
+            try:
+                payload = process_client_frame(sid, img_bytes)
+                if payload is not None:
+                    t1 = time.perf_counter()
+                    socketio.emit('recognition_update', payload, to=sid)
+                    now = time.perf_counter()
+                    metrics.observe('stage_seconds', now - t1, camera_id='main', stage='emit')
+                    metrics.observe('stage_seconds', now - t0, camera_id='main', stage='total')
+            except Exception as e:
+                print('client_frame error:', e)
+            finally:
+                # Crédito para o cliente mandar o próximo frame
+                socketio.emit('frame_ack', {'seq': seq, 'credits': 1, 'dropped': slot.dropped}, to=sid)
+    finally:
+        slot.busy = False
+
+def reject_frame(seq, reason: str, **extra):
+    """Devolve o crédito de um frame que não vai ser processado (o cliente espera o ack)."""
+    metrics.inc('frames_dropped_total', camera_id='main', reason=reason)
+    emit('frame_ack', {'seq': seq, 'credits': 1, 'dropped': 0, 'error': reason, **extra})
 
 @socketio.on('client_frame')
 def on_client_frame(data):
+    data = data if isinstance(data, dict) else {}
+    seq = data.get('seq')
     if not require_auth_socketio():
+        reject_frame(seq, 'not_authenticated')
         return
-    durl = data.get('dataURL')
-    if not durl:
+    # `frame`: JPEG como anexo binário; `dataURL`: formato antigo
+    raw = data.get('frame') or data.get('dataURL')
+    if not raw:
+        reject_frame(seq, 'empty')
+        return
+    sid = request.sid
+    if not inference_pool.ready:
+        # motor não carregou: devolve o crédito sem processar
+        reject_frame(seq, 'engine_not_ready', engine=inference_pool.state)
         return
     try:
-        import cv2
-        import numpy as np
-        try:
-            import face_recognition
-            have_fr = True
-        except Exception:
-            have_fr = False
-
-        header, b64 = durl.split(',', 1)
-        img_bytes = base64.b64decode(b64)
-        np_arr = np.frombuffer(img_bytes, dtype=np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        if frame is None:
-            return
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        h, w = frame.shape[:2]
-
-        results = []
-        if have_fr:
-            boxes = face_recognition.face_locations(rgb, model='hog')
-            if boxes:
-                known = load_encodings()
-                names = list(known.keys())
-                vecs = [known[n] for n in names]
-                for (top, right, bottom, left) in boxes:
-                    enc = face_recognition.face_encodings(rgb, [(top, right, bottom, left)])[0]
-                    label = 'Desconhecido'
-                    if names:
-                        import numpy as np
-                        dists = face_recognition.face_distance(np.array(vecs), enc)
-                        if len(dists) > 0:
-                            idx = int(dists.argmin())
-                            if float(dists[idx]) < 0.6:
-                                label = names[idx]
-                    x, y = left, top
-                    results.append({'name': label, 'box': [x, y, right - left, bottom - top]})
-        else:
-            # Fallback com Haar frontal (sem reconhecimento)
-            cv2_base_dir = os.path.dirname(os.path.abspath(cv2.__file__))
-            cascade_path = os.path.join(cv2_base_dir, 'data', 'haarcascade_frontalface_default.xml')
-            face_cascade = cv2.CascadeClassifier(cascade_path)
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            detections = face_cascade.detectMultiScale(gray, 1.3, 5)
-            for (x, y, ww, hh) in detections:
-                results.append({'name': 'Desconhecido', 'box': [int(x), int(y), int(ww), int(hh)]})
-
-        emit('recognition_update', {'camera_id': 'main', 'results': results, 'frame_w': w, 'frame_h': h})
+        img_bytes = frame_bytes(raw)
     except Exception as e:
         print('client_frame error:', e)
+        reject_frame(seq, 'invalid')
+        return
+    slot = frame_slots.setdefault(sid, FrameSlot())
+    metrics.inc('frames_received_total', camera_id='main')
+    if slot.put((seq, img_bytes)):
+        metrics.inc('frames_dropped_total', camera_id='main', reason='superseded')
+    if not slot.busy:
+        slot.busy = True
+        socketio.start_background_task(drain_frame_slot, sid, slot)
+
+@socketio.on('stream_settings')
+def on_stream_settings(data):
+    """Lê/ajusta resolução adaptativa e portão de movimento da câmera do navegador."""
+    if not require_auth_socketio():
+        return
+    ctrl = resolution_for(request.sid)
+    gate = motion_for(request.sid)
+    if isinstance(data, dict) and data:
+        # valores inválidos são ignorados; a resposta traz os ajustes em vigor
+        ctrl.update_settings(data)
+        gate.update_settings(data)
+    emit('stream_settings', {'ok': True, 'settings': {**ctrl.settings(), **gate.settings()},
+                             'stats': {**ctrl.stats(), 'motion': gate.stats()}})
 
 @socketio.on('enable_multicam')
 def on_enable_multicam(data):
     if not require_auth_socketio():
         return
-    # placeholder apenas para compatibilidade
+    data = data if isinstance(data, dict) else {}
+    # sem lista = todas as câmeras, inclusive nós que entrarem depois
+    cameras = data.get('cameras')
+    thumb_ms = data.get('thumb_interval_ms')
+    viewer_fanout.subscribe(request.sid, [str(c) for c in cameras] if cameras else None,
+                            float(thumb_ms) / 1000.0 if thumb_ms is not None else None)
+    sync_supervised_nodes()
     emit('multicam_status', {'ok': True, 'cameras': load_cameras()})
 
 @socketio.on('disable_multicam')
-def on_disable_multicam():
+def on_disable_multicam(data=None):
     if not require_auth_socketio():
         return
+    cameras = data.get('cameras') if isinstance(data, dict) else None
+    viewer_fanout.unsubscribe(request.sid, [str(c) for c in cameras] if cameras else None)
+    sync_supervised_nodes()
     emit('multicam_status', {'ok': True, 'cameras': {}})
 
+@socketio.on('gallery_sync')
+def on_gallery_sync(data):
+    """Nó informa a última versão aplicada; recebe o que falta (ou a galeria inteira)."""
+    if not node_authorized(data):
+        emit('auth_error', {'error': 'not_authenticated'})
+        return
+    data = data if isinstance(data, dict) else {}
+    join_room(GALLERY_ROOM)
+    node_sids.add(request.sid)
+    gallery.get()  # atualiza do banco antes; a cópia é tirada junto com a versão
+    # montar a matriz de uma galeria grande não deve parar o hub
+    msg = tpool.execute(gallery.log.since, data.get('version'), data.get('epoch'), gallery.snapshot)
+    emit('gallery_delta', msg)
+
 @socketio.on('node_result')
 def on_node_result(data):
-    # reservado para nós externos
-    pass
+    """Resultado de um nó: repassa só para quem assiste a câmera; nunca espera navegador."""
+    if not isinstance(data, dict) or not data.get('camera_id'):
+        return
+    if request.sid not in node_sids and not node_authorized(data):
+        return
+    camera_id = str(data['camera_id'])
+    if isinstance(data.get('stats'), dict):
+        stats = data['stats']
+        if 'metrics' in stats:
+            metrics.load_remote(camera_id, stats['metrics'])
+            stats = {k: v for k, v in stats.items() if k != 'metrics'}
+        node_status[camera_id] = {'stats': stats, 'last_seen': time.time()}
+    else:
+        node_status.setdefault(camera_id, {})['last_seen'] = time.time()
+    payload = {k: v for k, v in data.items() if k not in ('stats', 'token')}
+    payload['camera_id'] = camera_id
+    viewer_fanout.publish(camera_id, payload)
 
 # ----------------- Main -----------------
 if __name__ == '__main__':
     ensure_schema()
+    # Motor de reconhecimento: workers carregam e aquecem em segundo plano;
+    # até lá /api/ready responde 'starting' e os frames só devolvem o crédito
+    socketio.start_background_task(start_inference)
+    # Migração online JSON -> binário (lotes pequenos, em segundo plano)
+    socketio.start_background_task(migrate_encodings_background)
+    gallery.load()
+    if ANN_INDEX_ENABLED:
+        socketio.start_background_task(build_ann_index)
+        socketio.start_background_task(ann_index_saver)
+        atexit.register(save_ann_index_at_exit)
+    socketio.start_background_task(monitor_hub_latency)
+    if NODE_SUPERVISOR:
+        socketio.start_background_task(supervise_nodes)
+        atexit.register(node_supervisor.stop_all)
     host = os.environ.get('HOST', '0.0.0.0')
     port = int(os.environ.get('PORT', '5000'))
     socketio.run(app, host=host, port=port)
\ No newline at end of file
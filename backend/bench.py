@@ -0,0 +1,387 @@
+"""Benchmark offline dos caminhos quentes (sem webcam nem rede).
+
+    python backend/bench.py [--frames bench/frames] [--fetch_frames] [--gallery_sizes 1000,10000,100000,1000000]
+                            [--detectors hog,haar] [--mysql 10000] [--compare anterior.json]
+
+Mede cada estágio separadamente: base64 do data URL, `cv2.imdecode`,
+conversão de cor, detecção (por detector), encoding, matching em galerias
+sintéticas de vários tamanhos e serialização do `recognition_update` (JSON e
+pacote Socket.IO). Com `--mysql N` grava N encodings numa tabela temporária
+do MySQL local e mede a carga da galeria. O resultado vai em JSON para
+data/bench/ (com o commit atual), e `--compare` mostra a razão contra outra
+execução.
+
+Frames: os JPEGs de bench/frames (na raiz do projeto) se existirem; senão
+cenas sintéticas (semente fixa) com os retratos de bench/faces colados em
+escalas e posições variadas, para a detecção e o encoding medirem rostos de
+verdade. Os retratos (domínio público) são baixados uma vez com:
+    python backend/bench.py --fetch_frames
+Sem eles as cenas não têm rostos: a detecção não acha caixas e o encoding usa
+caixas fixas (o relatório marca isso em `frames.faces` e `encode.boxes`).
+"""
+import argparse
+import base64
+import glob
+import json
+import os
+import platform
+import subprocess
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import cv2
+import numpy as np
+
+from detectors import make_detector, normalize_spec
+from matcher import ENCODING_DIM, FaceMatcher, UNKNOWN_LABEL
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+FRAMES_DIR = BASE_DIR / 'bench' / 'frames'
+SAMPLES_DIR = BASE_DIR / 'bench' / 'faces'
+# retratos oficiais do governo dos EUA (domínio público), os mesmos dos exemplos do face_recognition
+SAMPLE_FACE_URLS = {
+    'obama.jpg': 'https://raw.githubusercontent.com/ageitgey/face_recognition/master/examples/obama.jpg',
+    'biden.jpg': 'https://raw.githubusercontent.com/ageitgey/face_recognition/master/examples/biden.jpg',
+}
+OUT_DIR = BASE_DIR / 'data' / 'bench'
+DEFAULT_GALLERY_SIZES = (1000, 10000, 100000, 1000000)
+BENCH_TABLE = 'bench_encodings'
+REGRESSION_RATIO = 1.10
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    if not len(ms):
+        return {'n': 0}
+    return {'n': int(len(ms)), 'mean_ms': round(float(ms.mean()), 4), 'p50_ms': round(float(np.percentile(ms, 50)), 4),
+            'p95_ms': round(float(np.percentile(ms, 95)), 4), 'min_ms': round(float(ms.min()), 4),
+            'max_ms': round(float(ms.max()), 4)}
+
+
+def timed(fn: Callable[[Any], Any], items: Iterable[Any], repeat: int = 3) -> Dict[str, Any]:
+    """Uma amostra por item por rodada; a primeira chamada (aquecimento) não conta."""
+    items = list(items)
+    if not items:
+        return {'n': 0}
+    fn(items[0])
+    samples = []
+    for _ in range(repeat):
+        for it in items:
+            t0 = time.perf_counter()
+            fn(it)
+            samples.append(time.perf_counter() - t0)
+    return summarize(samples)
+
+
+def _scene(rng, width: int, height: int) -> np.ndarray:
+    """Fundo com gradiente, ruído e formas (mesmo tamanho/entropia de uma cena real)."""
+    img = np.tile(np.linspace(40, 200, width, dtype=np.uint8), (height, 1))
+    img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    img = cv2.add(img, rng.integers(0, 40, size=img.shape, dtype=np.uint8))
+    for _ in range(4):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(20, 90)), int(rng.integers(30, 120)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.ellipse(img, center, axes, 0, 0, 360, color, -1)
+    return img
+
+
+def synthetic_frames(n: int, width: int = 640, height: int = 480, seed: int = 0,
+                     portraits: Optional[List[np.ndarray]] = None) -> List[bytes]:
+    """JPEGs determinísticos; com `portraits`, cada cena recebe de 1 a 3 deles lado a lado."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(n):
+        img = _scene(rng, width, height)
+        if portraits:
+            k = 1 + i % 3
+            col = width // k
+            for j in range(k):
+                face = portraits[(i + j) % len(portraits)]
+                fh, fw = face.shape[:2]
+                scale = min(float(rng.uniform(0.45, 0.95)) * height / fh, (col - 8) / float(fw))
+                face = cv2.resize(face, (max(1, int(fw * scale)), max(1, int(fh * scale))),
+                                  interpolation=cv2.INTER_AREA)
+                fh, fw = face.shape[:2]
+                x = j * col + int(rng.integers(0, max(1, col - fw)))
+                y = int(rng.integers(0, max(1, height - fh)))
+                img[y:y + fh, x:x + fw] = face
+        _, jpg = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        frames.append(jpg.tobytes())
+    return frames
+
+
+def fetch_samples(samples_dir: Path = SAMPLES_DIR) -> List[Path]:
+    """Baixa os retratos de SAMPLE_FACE_URLS que ainda não existem em `samples_dir`."""
+    from urllib.request import urlretrieve
+    samples_dir.mkdir(parents=True, exist_ok=True)
+    fetched = []
+    for name, url in SAMPLE_FACE_URLS.items():
+        path = samples_dir / name
+        if path.exists():
+            continue
+        tmp = path.with_name(name + '.part')
+        urlretrieve(url, tmp)
+        os.replace(tmp, path)
+        fetched.append(path)
+    return fetched
+
+
+def load_portraits(samples_dir: Path = SAMPLES_DIR) -> List[np.ndarray]:
+    paths = sorted(glob.glob(os.path.join(str(samples_dir), '*.jp*g'))) if samples_dir.is_dir() else []
+    images = [cv2.imread(p, cv2.IMREAD_COLOR) for p in paths]
+    return [img for img in images if img is not None]
+
+
+def load_frames(frames_dir: Optional[Path], n: int, width: int, height: int) -> Dict[str, Any]:
+    paths = sorted(glob.glob(os.path.join(str(frames_dir), '*.jp*g'))) if frames_dir and frames_dir.is_dir() else []
+    if paths:
+        return {'source': str(frames_dir), 'faces': 'real', 'jpegs': [Path(p).read_bytes() for p in paths[:n]]}
+    portraits = load_portraits()
+    if portraits:
+        return {'source': f'synthetic {width}x{height} seed=0 + {len(portraits)} retratos de {SAMPLES_DIR}',
+                'faces': 'composed', 'jpegs': synthetic_frames(n, width, height, portraits=portraits)}
+    print('aviso: frames sem rostos; rode com --fetch_frames para medir detecção/encoding em rostos reais')
+    return {'source': f'synthetic {width}x{height} seed=0', 'faces': 'none',
+            'jpegs': synthetic_frames(n, width, height)}
+
+
+def synthetic_gallery(size: int, seed: int = 0, chunk: int = 100000):
+    """Encodings aleatórios (mesma escala dos do dlib), gerados em blocos para caber em memória."""
+    rng = np.random.default_rng(seed)
+    matrix = np.empty((size, ENCODING_DIM), dtype=np.float32)
+    for start in range(0, size, chunk):
+        end = min(size, start + chunk)
+        matrix[start:end] = rng.standard_normal((end - start, ENCODING_DIM), dtype=np.float32) * 0.1
+    return [f'bench_{i}' for i in range(size)], matrix
+
+
+def bench_frame_stages(jpegs: List[bytes], detector_specs: List[str], repeat: int) -> Dict[str, Any]:
+    stages: Dict[str, Any] = {}
+    data_urls = ['data:image/jpeg;base64,' + base64.b64encode(j).decode('ascii') for j in jpegs]
+    # mesmo caminho de app.frame_bytes para o formato antigo (data URL)
+    stages['base64_decode'] = timed(lambda u: base64.b64decode(u.split(',', 1)[1]), data_urls, repeat)
+    stages['imdecode'] = timed(lambda j: cv2.imdecode(np.frombuffer(j, dtype=np.uint8), cv2.IMREAD_COLOR),
+                               jpegs, repeat)
+    bgrs = [cv2.imdecode(np.frombuffer(j, dtype=np.uint8), cv2.IMREAD_COLOR) for j in jpegs]
+    stages['color_bgr2rgb'] = timed(lambda f: cv2.cvtColor(f, cv2.COLOR_BGR2RGB), bgrs, repeat)
+    stages['color_bgr2gray'] = timed(lambda f: cv2.cvtColor(f, cv2.COLOR_BGR2GRAY), bgrs, repeat)
+    rgbs = [cv2.cvtColor(f, cv2.COLOR_BGR2RGB) for f in bgrs]
+
+    found: Dict[int, List[tuple]] = {}
+    for spec in detector_specs:
+        key = f'detect:{normalize_spec(spec)}'
+        try:
+            det = make_detector(spec)
+        except Exception as e:
+            stages[key] = {'error': str(e)}
+            continue
+        stages[key] = timed(lambda i: det.detect(bgrs[i], rgbs[i]), range(len(bgrs)), repeat)
+        boxes = [det.detect(f, r) for f, r in zip(bgrs, rgbs)]
+        stages[key]['faces'] = sum(len(b) for b in boxes)
+        for i, b in enumerate(boxes):
+            if b and i not in found:
+                found[i] = b
+
+    try:
+        import inference
+        engine = inference.init_engine()
+    except Exception as e:
+        engine = None
+        print('encoding indisponível:', e)
+    if engine is None or engine.fr is None:
+        stages['encode'] = {'error': 'face_recognition indisponível'}
+    else:
+        # sem rostos detectados: caixa fixa no centro (o custo não depende do conteúdo)
+        def boxes_for(i):
+            h, w = rgbs[i].shape[:2]
+            s = min(h, w) // 3
+            return found.get(i) or [(h // 2 - s // 2, w // 2 + s // 2, h // 2 + s // 2, w // 2 - s // 2)]
+        stages['encode'] = timed(lambda i: inference.encode_faces([rgbs[i]], [boxes_for(i)]), range(len(rgbs)),
+                                 repeat)
+        stages['encode']['faces_per_frame'] = round(sum(len(boxes_for(i)) for i in range(len(rgbs))) / len(rgbs), 2)
+        fixed = len(rgbs) - len(found)
+        stages['encode']['boxes'] = f'fixed em {fixed} frames' if fixed else 'detected'
+    return stages
+
+
+def bench_matching(sizes: List[int], queries: int, faces_per_frame: List[int], ann: bool) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    rng = np.random.default_rng(1)
+    for size in sizes:
+        names, matrix = synthetic_gallery(size)
+        row: Dict[str, Any] = {}
+        t0 = time.perf_counter()
+        matcher = FaceMatcher(capacity=size)
+        matcher.load_matrix(names, matrix)
+        row['load_ms'] = round((time.perf_counter() - t0) * 1000.0, 2)
+        for nf in faces_per_frame:
+            # consultas perto de rostos da galeria (como um rosto conhecido)
+            picks = [rng.choice(size, nf) for _ in range(queries)]
+            qs = [matrix[p] + rng.standard_normal((nf, ENCODING_DIM), dtype=np.float32) * 0.02 for p in picks]
+            row[f'faces_{nf}'] = timed(lambda q: matcher.match(q, k=1), qs, repeat=1)
+        if ann:
+            from ann_index import IVFIndex
+            t0 = time.perf_counter()
+            index = IVFIndex()
+            index.build(names, matrix)
+            row['ann_build_ms'] = round((time.perf_counter() - t0) * 1000.0, 2)
+            qs = [matrix[rng.choice(size, 1)] for _ in range(queries)]
+            row['ann_faces_1'] = timed(lambda q: index.match(q, k=1), qs, repeat=1)
+        out[str(size)] = row
+        del matcher, matrix, names
+    return out
+
+
+def bench_serialization(jpegs: List[bytes], faces: int, repeat: int) -> Dict[str, Any]:
+    results = [{'name': UNKNOWN_LABEL if i % 2 else f'pessoa_{i}', 'box': [100 + i * 60, 120, 80, 96]}
+               for i in range(faces)]
+    payload = {'camera_id': 'main', 'results': results, 'frame_w': 640, 'frame_h': 480}
+    stages = {'json_payload': timed(json.dumps, [payload] * 20, repeat)}
+    with_frame = [{**payload, 'frame_b64': 'data:image/jpeg;base64,' + base64.b64encode(j).decode('ascii')}
+                  for j in jpegs]
+    stages['json_payload_frame_b64'] = timed(json.dumps, with_frame, repeat)
+    try:
+        from socketio import packet
+    except ImportError as e:
+        stages['socketio_packet'] = {'error': str(e)}
+        return stages
+    stages['socketio_packet'] = timed(
+        lambda p: packet.Packet(packet.EVENT, data=['recognition_update', p]).encode(), [payload] * 20, repeat)
+    stages['socketio_packet_binary_frame'] = timed(
+        lambda j: packet.Packet(packet.EVENT, data=['recognition_update', {**payload, 'frame': j}]).encode(),
+        jpegs, repeat)
+    return stages
+
+
+def bench_mysql(size: int, repeat: int) -> Dict[str, Any]:
+    """Carga da galeria a partir do MySQL local, numa tabela temporária com o schema de `encodings`."""
+    from encoding_format import fetch_gallery, import_gallery
+    from store import ensure_schema, make_pool
+    ensure_schema()
+    db_pool = make_pool(size=2)
+    names, matrix = synthetic_gallery(size, seed=2)
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        cur.execute(f"CREATE TABLE {BENCH_TABLE} LIKE encodings")
+        conn.commit()
+        cur.close()
+    try:
+        t0 = time.perf_counter()
+        import_gallery(db_pool.connection, names, matrix, table=BENCH_TABLE)
+        insert_s = time.perf_counter() - t0
+        samples = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            loaded, _ = fetch_gallery(db_pool.connection, table=BENCH_TABLE)
+            samples.append(time.perf_counter() - t0)
+        return {'size': size, 'loaded': len(loaded), 'insert_ms': round(insert_s * 1000.0, 2),
+                'insert_rows_per_s': round(size / insert_s, 1) if insert_s else None,
+                'load': summarize(samples)}
+    finally:
+        with db_pool.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+            conn.commit()
+            cur.close()
+
+
+def git_revision() -> Dict[str, Any]:
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BASE_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return {'commit': rev, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+def flatten(report: Dict[str, Any], prefix: str = '') -> Dict[str, float]:
+    """caminho do estágio -> mean_ms (ou *_ms escalar), para comparar execuções."""
+    out: Dict[str, float] = {}
+    for k, v in report.items():
+        path = f'{prefix}{k}'
+        if isinstance(v, dict):
+            if 'mean_ms' in v:
+                out[path] = v['mean_ms']
+            else:
+                out.update(flatten(v, path + '/'))
+        elif k.endswith('_ms') and isinstance(v, (int, float)):
+            out[path] = float(v)
+    return out
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    cur = flatten({k: current[k] for k in ('stages', 'matching', 'mysql') if k in current})
+    base = flatten({k: baseline[k] for k in ('stages', 'matching', 'mysql') if k in baseline})
+    rows = {k: {'baseline_ms': base[k], 'current_ms': cur[k], 'ratio': round(cur[k] / base[k], 3)}
+            for k in sorted(cur.keys() & base.keys()) if base[k] > 0}
+    return {'baseline_commit': baseline.get('meta', {}).get('commit'), 'stages': rows,
+            'regressions': [k for k, r in rows.items() if r['ratio'] > REGRESSION_RATIO]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline de decodificação, detecção, encoding e matching')
+    parser.add_argument('--frames', default=str(FRAMES_DIR), help='diretório de JPEGs (padrão: bench/frames)')
+    parser.add_argument('--fetch_frames', action='store_true',
+                        help=f'baixa os retratos de amostra para {SAMPLES_DIR} antes de medir')
+    parser.add_argument('--n_frames', type=int, default=20)
+    parser.add_argument('--width', type=int, default=640, help='frames sintéticos')
+    parser.add_argument('--height', type=int, default=480, help='frames sintéticos')
+    parser.add_argument('--detectors', default='hog,haar', help='ver detectors.py (ex.: hog,hog:0,haar,dnn)')
+    parser.add_argument('--gallery_sizes', default=','.join(str(s) for s in DEFAULT_GALLERY_SIZES))
+    parser.add_argument('--queries', type=int, default=200, help='consultas por tamanho de galeria')
+    parser.add_argument('--faces', default='1,4', help='rostos por frame nas consultas')
+    parser.add_argument('--ann', action='store_true', help='mede também o índice IVF')
+    parser.add_argument('--mysql', type=int, default=0, metavar='N', help='mede a carga de N encodings do MySQL local')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip', default='', help='estágios a pular: frames,matching,serialization')
+    parser.add_argument('--out', default=None, help='arquivo JSON (padrão: data/bench/bench_<commit>_<hora>.json)')
+    parser.add_argument('--compare', default=None, help='JSON de uma execução anterior')
+    args = parser.parse_args()
+    skip = {s.strip() for s in args.skip.split(',') if s.strip()}
+
+    if args.fetch_frames:
+        for path in fetch_samples():
+            print('baixado', path)
+    frames = load_frames(Path(args.frames) if args.frames else None, args.n_frames, args.width, args.height)
+    report: Dict[str, Any] = {
+        'meta': {**git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+                 'machine': platform.machine(), 'cpu_count': os.cpu_count(), 'args': vars(args)},
+        'frames': {'source': frames['source'], 'faces': frames['faces'], 'count': len(frames['jpegs']),
+                   'avg_bytes': int(sum(len(j) for j in frames['jpegs']) / max(1, len(frames['jpegs'])))},
+    }
+    if 'frames' not in skip:
+        print('estágios por frame...')
+        report['stages'] = bench_frame_stages(frames['jpegs'], [s for s in args.detectors.split(',') if s],
+                                              args.repeat)
+    if 'serialization' not in skip:
+        report.setdefault('stages', {}).update(bench_serialization(frames['jpegs'], 4, args.repeat))
+    if 'matching' not in skip:
+        sizes = [int(s) for s in args.gallery_sizes.split(',') if s]
+        print('matching em galerias de', sizes, '...')
+        report['matching'] = bench_matching(sizes, args.queries, [int(f) for f in args.faces.split(',') if f],
+                                            args.ann)
+    if args.mysql:
+        print(f'carga do MySQL ({args.mysql} encodings)...')
+        report['mysql'] = bench_mysql(args.mysql, args.repeat)
+    if args.compare:
+        report['comparison'] = compare(report, json.loads(Path(args.compare).read_text()))
+
+    if args.out:
+        out = Path(args.out)
+    else:
+        OUT_DIR.mkdir(parents=True, exist_ok=True)
+        out = OUT_DIR / f"bench_{report['meta']['commit'] or 'nogit'}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report.get('comparison') or flatten({k: report[k] for k in ('stages', 'matching', 'mysql')
+                                                         if k in report}), indent=2))
+    print('resultado em', out)
+
+
+if __name__ == '__main__':
+    main()
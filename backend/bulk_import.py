@@ -0,0 +1,248 @@
+"""Importação em massa de um acervo de fotos (uma pasta por pessoa).
+
+    python backend/bulk_import.py /caminho/acervo [--workers 8] [--batch 200]
+
+Cada imagem passa por `inference.assess_sample` no pool de processos, via
+`InferencePool.imap` (mesmo filtro e admissão do cadastro pelo navegador); as aprovadas de cada pessoa
+viram um encoding via `enrollment.robust_average`. Os encodings são gravados
+com `executemany` em lotes e o recorte do rosto vai para data/faces (com as
+miniaturas de `thumbnails.store_photo`).
+O progresso fica num arquivo de estado: rodar de novo continua de onde parou.
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+
+from encoding_format import json_column, pack
+from enrollment import robust_average
+from inference import InferencePool, assess_sample
+from thumbnails import remove_photo, store_photo
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+
+def scan(root: Path, max_images: int = 0) -> Dict[str, List[Path]]:
+    """pessoa (nome da pasta) -> imagens, em ordem estável."""
+    persons: Dict[str, List[Path]] = {}
+    for folder in sorted(p for p in root.iterdir() if p.is_dir()):
+        images = sorted(p for p in folder.rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS and p.is_file())
+        if max_images:
+            images = images[:max_images]
+        if images:
+            persons[folder.name] = images
+    return persons
+
+
+class ImportState:
+    """Pessoas já gravadas (só entram aqui depois do commit do lote)."""
+
+    def __init__(self, path: Path, root: Path):
+        self.path = path
+        self.root = str(root.resolve())
+        self.done: set = set()
+        if path.exists():
+            try:
+                data = json.loads(path.read_text())
+                if data.get('root') == self.root:
+                    self.done = set(data.get('done', []))
+            except (OSError, ValueError) as e:
+                print("import state error:", e)
+
+    def save(self):
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'root': self.root, 'done': sorted(self.done)}))
+        os.replace(tmp, self.path)
+
+
+def face_thumbnail(path: Path, box: Tuple[int, int, int, int], size: int = 256) -> Optional[bytes]:
+    """Recorte quadrado em volta do rosto (com margem), reduzido para `size`."""
+    img = cv2.imread(str(path), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    h, w = img.shape[:2]
+    top, right, bottom, left = box
+    cx, cy = (left + right) / 2.0, (top + bottom) / 2.0
+    half = max(right - left, bottom - top) * 0.9
+    x0, y0 = int(max(0, cx - half)), int(max(0, cy - half))
+    x1, y1 = int(min(w, cx + half)), int(min(h, cy + half))
+    crop = img[y0:y1, x0:x1]
+    if crop.size == 0:
+        return None
+    scale = size / float(max(crop.shape[:2]))
+    if scale < 1.0:
+        crop = cv2.resize(crop, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, jpg = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return jpg.tobytes() if ok else None
+
+
+def read_images(items: List[Tuple[str, Path]]) -> Iterator[bytes]:
+    """Bytes de cada imagem, lidos sob demanda (o `imap` do pool só puxa o que cabe na janela)."""
+    for _, path in items:
+        try:
+            yield path.read_bytes()
+        except OSError as e:
+            print(f"erro lendo {path}: {e}")
+            yield b''  # o worker falha e a imagem conta como 'error'
+
+
+def previous_photos(connection: Callable, names: List[str]) -> Dict[str, str]:
+    """photo_filename atual de cada nome que já existe no banco."""
+    if not names:
+        return {}
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name, photo_filename FROM encodings WHERE name IN (%s)"
+                    % ', '.join(['%s'] * len(names)), tuple(names))
+        rows = cur.fetchall()
+        cur.close()
+    return {name: filename for name, filename in rows if filename}
+
+
+def write_batch(connection: Callable, rows: List[Tuple[str, bytes, Optional[str], Optional[int], Optional[str]]],
+                faces_dir: Optional[Path] = None):
+    """Grava o lote; dono já definido não é trocado e a foto antiga substituída é apagada."""
+    previous = previous_photos(connection, [r[0] for r in rows]) if faces_dir is not None else {}
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.executemany("""
+            INSERT INTO encodings (name, encoding_bin, encoding, owner_user_id, photo_filename)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+              encoding_bin = VALUES(encoding_bin),
+              encoding = VALUES(encoding),
+              owner_user_id = COALESCE(owner_user_id, VALUES(owner_user_id)),
+              photo_filename = COALESCE(VALUES(photo_filename), photo_filename)
+        """, rows)
+        conn.commit()
+        cur.close()
+    for name, _, _, _, photo_filename in rows:
+        old = previous.get(name)
+        if photo_filename and old and old != photo_filename:
+            try:
+                remove_photo(old, faces_dir)
+            except OSError as e:
+                print(f"Erro ao deletar foto {old}: {e}")
+
+
+def run_import(root: Path, connection: Callable, pool: InferencePool, state: ImportState, faces_dir: Path,
+               slugify: Callable[[str], str], owner_user_id: Optional[int] = None, batch_size: int = 200,
+               max_images: int = 0, min_face_px: int = 60, min_sharpness: float = 40.0,
+               thumb_size: int = 256, report_every: float = 10.0) -> Dict[str, Any]:
+    persons = {p: imgs for p, imgs in scan(root, max_images).items() if p not in state.done}
+    items = [(person, path) for person, imgs in persons.items() for path in imgs]
+    stats = {'persons_total': len(persons), 'persons_skipped': len(state.done), 'images_total': len(items),
+             'images': 0, 'accepted': 0, 'rejected': {}, 'imported': 0, 'no_usable_image': 0}
+    print(f"{len(persons)} pessoas / {len(items)} imagens a importar ({len(state.done)} já importadas)")
+
+    t0 = last_report = time.perf_counter()
+    pending: Dict[str, List[Tuple[Path, Dict[str, Any]]]] = {}
+    rows: List[Tuple[str, bytes, Optional[str], Optional[int], Optional[str]]] = []
+    row_names: List[str] = []
+
+    def flush():
+        if not rows:
+            return
+        write_batch(connection, rows, faces_dir)
+        state.done.update(row_names)
+        state.save()
+        stats['imported'] += len(rows)
+        rows.clear()
+        row_names.clear()
+
+    results = pool.imap(assess_sample, read_images(items), min_face_px, min_sharpness)
+    for (person, path), res in zip(items, results):
+        stats['images'] += 1
+        if res is None or not res['ok']:
+            reason = 'error' if res is None else res['reason']
+            stats['rejected'][reason] = stats['rejected'].get(reason, 0) + 1
+            res = None
+        else:
+            stats['accepted'] += 1
+        got = pending.setdefault(person, [])
+        got.append((path, res))
+        if len(got) < len(persons[person]):
+            continue
+
+        # todas as imagens da pessoa avaliadas
+        good = [(p, r) for p, r in pending.pop(person) if r is not None]
+        if not good:
+            stats['no_usable_image'] += 1
+            state.done.add(person)  # nada a gravar; não reavaliar ao retomar
+            continue
+        avg, kept, _ = robust_average([r['encoding'] for _, r in good])
+        best_path, best = max((good[k] for k in kept), key=lambda g: (g[1]['sharpness'] or 0) * g[1]['face_px'])
+        thumb = face_thumbnail(best_path, best['box'], thumb_size)
+        photo_filename = store_photo(thumb, slugify(person), faces_dir) if thumb is not None else None
+        rows.append((person, pack(avg), json_column(avg), owner_user_id, photo_filename))
+        row_names.append(person)
+        if len(rows) >= batch_size:
+            flush()
+
+        now = time.perf_counter()
+        if now - last_report >= report_every:
+            last_report = now
+            el = now - t0
+            print(f"{stats['images']}/{len(items)} imagens, {stats['imported'] + len(rows)} pessoas "
+                  f"- {stats['images'] / el:.1f} img/s")
+    flush()
+    state.save()
+
+    elapsed = time.perf_counter() - t0
+    stats['elapsed_s'] = round(elapsed, 2)
+    stats['images_per_s'] = round(stats['images'] / elapsed, 2) if elapsed else None
+    stats['persons_per_s'] = round(stats['imported'] / elapsed, 2) if elapsed else None
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', help='diretório com uma pasta por pessoa')
+    parser.add_argument('--workers', type=int, default=0, help='processos de encoding (0 = núcleos - 1)')
+    parser.add_argument('--batch', type=int, default=200, help='pessoas por executemany')
+    parser.add_argument('--max_images', type=int, default=10, help='imagens por pessoa (0 = todas)')
+    parser.add_argument('--owner_user_id', type=int, default=None)
+    parser.add_argument('--min_face_px', type=int, default=60)
+    parser.add_argument('--min_sharpness', type=float, default=40.0)
+    parser.add_argument('--thumb_size', type=int, default=256)
+    parser.add_argument('--state', default=None, help='arquivo de progresso (padrão: data/bulk_import_state.json)')
+    parser.add_argument('--restart', action='store_true', help='ignora o progresso salvo')
+    args = parser.parse_args()
+
+    from store import DATA_DIR, ensure_schema, get_user_by_id, make_pool, slugify_filename
+    ensure_schema()
+    db_pool = make_pool(size=2)
+    root = Path(args.root)
+    state_path = Path(args.state) if args.state else DATA_DIR / 'bulk_import_state.json'
+    state = ImportState(state_path, root)
+    if args.restart:
+        state.done = set()
+    owner = args.owner_user_id if args.owner_user_id is not None and get_user_by_id(db_pool.connection, args.owner_user_id) else None
+    faces_dir = DATA_DIR / 'faces'
+    faces_dir.mkdir(parents=True, exist_ok=True)
+
+    workers = args.workers or max(1, (os.cpu_count() or 2) - 1)
+    pool = InferencePool(workers=workers, max_queue=workers * 2)
+    pool.start()
+    if not pool.have_face_recognition:
+        print('face_recognition não disponível nos workers')
+        return
+    try:
+        stats = run_import(root, db_pool.connection, pool, state, faces_dir, slugify_filename,
+                           owner_user_id=owner, batch_size=args.batch, max_images=args.max_images,
+                           min_face_px=args.min_face_px, min_sharpness=args.min_sharpness,
+                           thumb_size=args.thumb_size)
+    except KeyboardInterrupt:
+        print(f"interrompido; progresso salvo em {state_path}")
+        return
+    finally:
+        pool.shutdown()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
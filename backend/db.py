@@ -0,0 +1,166 @@
+import queue
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+
+import mysql.connector
+from mysql.connector import Error
+
+
+class PoolTimeout(Error):
+    """Nenhuma conexão livre dentro do timeout do pool."""
+
+
+class ConnectionPool:
+    """Pool limitado de conexões MySQL.
+
+    `queue_factory` define a fila usada para as conexões livres: no servidor
+    (eventlet) use `eventlet.queue.LightQueue` para que a espera ceda o hub;
+    nos nós (threads) o `queue.Queue` padrão serve.
+    `observer(nome, espera_s, uso_s, falhou)` recebe cada empréstimo; o nome
+    é o passado em `connection(nome)` ('db' se nenhum).
+    """
+
+    def __init__(self, config: Dict[str, Any], size: int = 8, timeout: float = 5.0,
+                 health_check_interval: float = 30.0,
+                 queue_factory: Callable = queue.Queue,
+                 observer: Optional[Callable[[str, float, float, bool], None]] = None):
+        self.config = dict(config)
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue_factory()
+        self._lock = Lock()
+        self._created = 0
+        self.observer = observer
+        # métricas
+        self.checkouts = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.in_use = 0
+
+    def _new_connection(self):
+        conn = mysql.connector.connect(**self.config)
+        return [conn, time.monotonic()]
+
+    def _healthy(self, entry) -> bool:
+        conn, last_used = entry
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, entry):
+        with self._lock:
+            self._created -= 1
+            self.discarded += 1
+        try:
+            entry[0].close()
+        except Exception:
+            pass
+
+    def _acquire(self):
+        start = time.monotonic()
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:  # eventlet.queue reutiliza queue.Empty
+                entry = None
+
+            if entry is None:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        entry = self._new_connection()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                else:
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(msg=f"pool esgotado ({self.size} conexões em uso)")
+                    try:
+                        # espera curta: uma conexão descartada libera vaga para criar outra
+                        entry = self._idle.get(timeout=min(remaining, 0.1))
+                    except queue.Empty:
+                        continue
+
+            if not self._healthy(entry):
+                self._discard(entry)
+                continue
+
+            waited = time.monotonic() - start
+            with self._lock:
+                self.checkouts += 1
+                self.in_use += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            return entry
+
+    def _release(self, entry, broken: bool):
+        with self._lock:
+            self.in_use -= 1
+        if not broken:
+            try:
+                # descarta transação pendente antes de devolver (sem ida ao servidor se não há)
+                if entry[0].in_transaction:
+                    entry[0].rollback()
+            except Exception:
+                broken = True
+        if broken:
+            self._discard(entry)
+            return
+        entry[1] = time.monotonic()
+        self._idle.put(entry)
+
+    @contextmanager
+    def connection(self, name: Optional[str] = None):
+        """Empresta uma conexão; sempre devolvida, mesmo com exceção.
+
+        `name` identifica quem pediu nas métricas do `observer`.
+        """
+        name = name or 'db'
+        t0 = time.perf_counter()
+        try:
+            entry = self._acquire()
+        except Error:
+            if self.observer is not None:
+                self.observer(name, time.perf_counter() - t0, 0.0, True)
+            raise
+        t1 = time.perf_counter()
+        broken = failed = False
+        try:
+            yield entry[0]
+        except Error as e:
+            # erros de protocolo/conexão inutilizam a conexão
+            failed = True
+            broken = isinstance(e, (mysql.connector.errors.OperationalError,
+                                    mysql.connector.errors.InterfaceError))
+            raise
+        finally:
+            self._release(entry, broken)
+            if self.observer is not None:
+                self.observer(name, t1 - t0, time.perf_counter() - t1, failed)
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        return {
+            'size': self.size,
+            'open': self._created,
+            'in_use': self.in_use,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'discarded': self.discarded,
+            'wait_avg_ms': round(1000.0 * self.wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+            'wait_max_ms': round(1000.0 * self.wait_max, 3),
+        }
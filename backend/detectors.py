@@ -0,0 +1,231 @@
+"""Detectores de rosto intercambiáveis (todos em CPU).
+
+O detector é escolhido por um texto curto, que cabe em `cameras.settings`,
+na CLI do nó e no plano enviado aos workers:
+
+    hog        HOG do dlib (face_recognition) com 1 upsample, como o face_locations
+               padrão; 'hog:0' é mais rápido e perde rostos pequenos
+    haar       cascade frontal do OpenCV; 'haar:3' muda o minNeighbors
+    dnn        SSD res10 do OpenCV; 'dnn:0.7' muda a confiança mínima
+
+O DNN lê `deploy.prototxt` e `res10_300x300_ssd_iter_140000.caffemodel` de
+models/face_dnn na raiz do projeto (ou de FACE_DNN_DIR). Os arquivos não
+estão no repositório; baixe uma vez com:
+    python backend/detectors.py --fetch_dnn
+
+Calibração em JPEGs de uma câmera (o nó faz o mesmo com `--calibrate`):
+    python backend/detectors.py caminho/para/frames --recall 0.9
+"""
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+
+Box = Tuple[int, int, int, int]  # (top, right, bottom, left)
+
+BACKENDS = ('hog', 'haar', 'dnn')
+DEFAULT_DETECTOR = os.environ.get('DETECTOR', 'hog')
+CALIBRATION_CANDIDATES = ('haar', 'dnn', 'hog:0', 'hog')
+DNN_DIR = Path(os.environ.get('FACE_DNN_DIR', Path(__file__).resolve().parent.parent / 'models' / 'face_dnn'))
+DNN_PROTO = 'deploy.prototxt'
+DNN_WEIGHTS = 'res10_300x300_ssd_iter_140000.caffemodel'
+DNN_URLS = {
+    DNN_PROTO: 'https://raw.githubusercontent.com/opencv/opencv/4.x/samples/dnn/face_detector/deploy.prototxt',
+    DNN_WEIGHTS: ('https://raw.githubusercontent.com/opencv/opencv_3rdparty/'
+                  'dnn_samples_face_detector_20170830/res10_300x300_ssd_iter_140000.caffemodel'),
+}
+
+
+def parse_spec(spec: Optional[str]) -> Tuple[str, Optional[float]]:
+    """'hog:1' -> ('hog', 1.0); levanta ValueError para backend desconhecido."""
+    name, _, arg = (spec or DEFAULT_DETECTOR).strip().lower().partition(':')
+    if name not in BACKENDS:
+        raise ValueError(f'detector desconhecido: {spec} (use {", ".join(BACKENDS)})')
+    return name, float(arg) if arg else None
+
+
+def normalize_spec(spec: Optional[str]) -> str:
+    name, arg = parse_spec(spec)
+    if name == 'hog' and arg == 1:
+        arg = None  # 'hog' já faz 1 upsample
+    return name if arg is None else f'{name}:{arg:g}'
+
+
+class HogDetector:
+    def __init__(self, upsample: int = 0):
+        import face_recognition
+        self._fr = face_recognition
+        self.upsample = int(upsample)
+
+    def detect(self, img, rgb=None) -> List[Box]:
+        if rgb is None:
+            rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return [tuple(int(v) for v in b) for b in
+                self._fr.face_locations(rgb, number_of_times_to_upsample=self.upsample, model='hog')]
+
+
+class HaarDetector:
+    def __init__(self, min_neighbors: int = 5, scale_factor: float = 1.3):
+        path = os.path.join(os.path.dirname(os.path.abspath(cv2.__file__)),
+                            'data', 'haarcascade_frontalface_default.xml')
+        self._cascade = cv2.CascadeClassifier(path)
+        if self._cascade.empty():
+            raise FileNotFoundError(f'cascade Haar não encontrado em {path}')
+        self.min_neighbors = int(min_neighbors)
+        self.scale_factor = scale_factor
+
+    def detect(self, img, rgb=None) -> List[Box]:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        dets = self._cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors)
+        return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in dets]
+
+
+class DnnDetector:
+    def __init__(self, confidence: float = 0.5, model_dir: Path = DNN_DIR, input_size: int = 300):
+        proto, weights = Path(model_dir) / DNN_PROTO, Path(model_dir) / DNN_WEIGHTS
+        if not proto.exists() or not weights.exists():
+            raise FileNotFoundError(f'modelo DNN ausente em {model_dir} ({DNN_PROTO}, {DNN_WEIGHTS}); '
+                                    f'baixe com: python backend/detectors.py --fetch_dnn')
+        self._net = cv2.dnn.readNetFromCaffe(str(proto), str(weights))
+        self._lock = Lock()  # a mesma Net não pode rodar em duas threads
+        self.confidence = confidence
+        self.input_size = input_size
+
+    def detect(self, img, rgb=None) -> List[Box]:
+        h, w = img.shape[:2]
+        size = (self.input_size, self.input_size)
+        blob = cv2.dnn.blobFromImage(cv2.resize(img, size), 1.0, size, (104.0, 177.0, 123.0))
+        with self._lock:
+            self._net.setInput(blob)
+            det = self._net.forward()  # 1 x 1 x N x [_, _, conf, x0, y0, x1, y1]
+        boxes = []
+        for i in range(det.shape[2]):
+            if det[0, 0, i, 2] < self.confidence:
+                continue
+            x0, y0, x1, y1 = det[0, 0, i, 3:7]
+            left, top = max(0, int(x0 * w)), max(0, int(y0 * h))
+            right, bottom = min(w, int(x1 * w)), min(h, int(y1 * h))
+            if right > left and bottom > top:
+                boxes.append((top, right, bottom, left))
+        return boxes
+
+
+def make_detector(spec: Optional[str]):
+    name, arg = parse_spec(spec)
+    if name == 'hog':
+        return HogDetector(upsample=int(arg) if arg is not None else 1)
+    if name == 'haar':
+        return HaarDetector(min_neighbors=int(arg or 5))
+    return DnnDetector(confidence=arg if arg is not None else 0.5)
+
+
+def fetch_dnn(model_dir: Path = DNN_DIR) -> List[Path]:
+    """Baixa os arquivos do DNN que ainda não existem em `model_dir`."""
+    from urllib.request import urlretrieve
+    model_dir = Path(model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    fetched = []
+    for name, url in DNN_URLS.items():
+        path = model_dir / name
+        if path.exists():
+            continue
+        tmp = path.with_name(name + '.part')
+        urlretrieve(url, tmp)
+        os.replace(tmp, path)
+        fetched.append(path)
+    return fetched
+
+
+def _iou(a: Box, b: Box) -> float:
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area = (a[1] - a[3]) * (a[2] - a[0]) + (b[1] - b[3]) * (b[2] - b[0]) - inter
+    return inter / area if area > 0 else 0.0
+
+
+def _matched(reference: Sequence[Box], found: Sequence[Box], min_iou: float) -> int:
+    """Rostos da referência encontrados (pareamento guloso por IoU)."""
+    free = list(found)
+    hits = 0
+    for ref in reference:
+        best = max(free, key=lambda b: _iou(ref, b), default=None)
+        if best is not None and _iou(ref, best) >= min_iou:
+            free.remove(best)
+            hits += 1
+    return hits
+
+
+def calibrate(frames: List[Any], candidates: Sequence[str] = CALIBRATION_CANDIDATES,
+              reference: str = 'hog', recall_target: float = 0.9, min_iou: float = 0.3,
+              detectors: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Mede cada detector nos frames (BGR) e escolhe o mais rápido com recall >= alvo.
+
+    O recall é medido contra `reference` (o mais sensível, não o mais rápido);
+    sem nenhum candidato no alvo fica o de maior recall. `detectors` permite
+    reaproveitar instâncias já carregadas (spec -> detector).
+    """
+    detectors = detectors if detectors is not None else {}
+
+    def get(spec):
+        if spec not in detectors:
+            detectors[spec] = make_detector(spec)
+        return detectors[spec]
+
+    ref = get(reference)
+    truth = [ref.detect(f) for f in frames]
+    faces = sum(len(t) for t in truth)
+    results = []
+    for spec in candidates:
+        try:
+            det = get(spec)
+        except Exception as e:
+            results.append({'detector': spec, 'error': str(e)})
+            continue
+        det.detect(frames[0])  # aquecimento fora da medida
+        found, t0 = [], time.perf_counter()
+        for f in frames:
+            found.append(det.detect(f))
+        ms = (time.perf_counter() - t0) * 1000.0 / len(frames)
+        hits = sum(_matched(t, fo, min_iou) for t, fo in zip(truth, found))
+        results.append({'detector': spec, 'ms_per_frame': round(ms, 2),
+                        'recall': round(hits / faces, 3) if faces else None,
+                        'detections': sum(len(fo) for fo in found)})
+    usable = [r for r in results if 'error' not in r]
+    meets = [r for r in usable if r['recall'] is None or r['recall'] >= recall_target]
+    if meets:
+        chosen = min(meets, key=lambda r: r['ms_per_frame'])
+    else:
+        chosen = max(usable, key=lambda r: (r['recall'], -r['ms_per_frame']), default=None)
+    return {'frames': len(frames), 'reference': reference, 'reference_faces': faces,
+            'recall_target': recall_target, 'chosen': chosen['detector'] if chosen else None,
+            'results': results}
+
+
+if __name__ == '__main__':
+    import argparse
+    import glob
+    import json
+
+    parser = argparse.ArgumentParser(description='Calibra o detector de rostos em frames de uma câmera')
+    parser.add_argument('frames', nargs='?', help='diretório com JPEGs capturados da câmera')
+    parser.add_argument('--fetch_dnn', action='store_true', help=f'baixa o modelo DNN para {DNN_DIR}')
+    parser.add_argument('--candidates', default=','.join(CALIBRATION_CANDIDATES))
+    parser.add_argument('--reference', default='hog')
+    parser.add_argument('--recall', type=float, default=0.9)
+    args = parser.parse_args()
+    if args.fetch_dnn:
+        for p in fetch_dnn():
+            print(f'baixado: {p}')
+        raise SystemExit(0)
+    if not args.frames:
+        parser.error('informe o diretório de frames (ou --fetch_dnn)')
+    imgs = [cv2.imread(p) for p in sorted(glob.glob(os.path.join(args.frames, '*.jp*g')))]
+    imgs = [i for i in imgs if i is not None]
+    if not imgs:
+        raise SystemExit('nenhuma imagem encontrada')
+    print(json.dumps(calibrate(imgs, [c for c in args.candidates.split(',') if c], args.reference,
+                               args.recall), indent=2))
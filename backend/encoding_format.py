@@ -0,0 +1,208 @@
+"""Formato binário dos encodings e arquivo de galeria mapeável em memória.
+
+Coluna `encoding_bin`: 1 byte de versão + 128 float32 little-endian (513 bytes),
+lida direto com `np.frombuffer`. A coluna JSON antiga (`encoding`) continua
+sendo aceita pelos leitores e, até o fim da transição, também é gravada em
+toda escrita (ENCODING_JSON_DUAL_WRITE=0 desliga depois que nenhum leitor
+depende mais dela).
+
+Uso na linha de comando:
+    python backend/encoding_format.py migrate              # JSON -> binário, em lotes
+    python backend/encoding_format.py export data/gallery.bin
+    python backend/encoding_format.py import data/gallery.bin
+"""
+import argparse
+import json
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
+
+ENCODING_DIM = 128
+FORMAT_F32 = 1
+_F32 = np.dtype('<f4')
+
+GALLERY_MAGIC = b'PAGAL001'
+# magic, N, dim, offset da matriz, offset dos nomes, tamanho dos nomes
+_HEADER = struct.Struct('<8sIIQQQ')
+_ALIGN = 64
+JSON_DUAL_WRITE = os.environ.get('ENCODING_JSON_DUAL_WRITE', '1') == '1'
+
+
+def pack(enc) -> bytes:
+    """Vetor -> bytes para a coluna `encoding_bin`."""
+    vec = np.asarray(enc, dtype=_F32).reshape(ENCODING_DIM)
+    return bytes((FORMAT_F32,)) + vec.tobytes()
+
+
+def json_column(enc) -> Optional[str]:
+    """Valor da coluna JSON legada durante a escrita dupla; None depois dela."""
+    if not JSON_DUAL_WRITE:
+        return None
+    return json.dumps([float(v) for v in np.asarray(enc, dtype=np.float32).reshape(ENCODING_DIM)])
+
+
+def unpack(value: Union[bytes, bytearray, memoryview, str, None]) -> Optional[np.ndarray]:
+    """Aceita o formato binário ou o JSON legado; devolve float32 (128,)."""
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        buf = memoryview(value)
+        if len(buf) == 1 + ENCODING_DIM * 4 and buf[0] == FORMAT_F32:
+            return np.frombuffer(buf, dtype=_F32, offset=1)
+        # JSON vindo como bytes (alguns drivers devolvem JSON assim)
+        value = bytes(buf).decode('utf-8')
+    return np.asarray(json.loads(value), dtype=np.float32)
+
+
+def row_encoding(enc_bin, enc_json) -> np.ndarray:
+    """Escolhe a coluna binária quando presente; senão cai no JSON."""
+    if enc_bin is not None:
+        return unpack(enc_bin)
+    if enc_json is None:
+        raise ValueError("linha sem encoding")
+    return unpack(enc_json)
+
+
+# ----------------- Migração online -----------------
+def migrate_json_encodings(connection: Callable, batch_size: int = 500, pause: float = 0.0,
+                           sleep: Callable = time.sleep) -> int:
+    """Preenche `encoding_bin` das linhas que só têm JSON, em lotes curtos.
+
+    O JSON fica onde está (leitores antigos) e o UPDATE só vale se a linha
+    continua sem binário, para não sobrescrever um cadastro feito durante a
+    migração com o valor antigo. Cada lote é uma transação pequena, então o servidor pode continuar
+    lendo/gravando durante a migração (no eventlet passe `sleep=socketio.sleep`).
+    Retorna o número de linhas convertidas.
+    """
+    total = 0
+    last_name = ''
+    while True:
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT name, encoding FROM encodings "
+                        "WHERE encoding_bin IS NULL AND encoding IS NOT NULL AND name > %s "
+                        "ORDER BY name LIMIT %s", (last_name, batch_size))
+            rows = cur.fetchall()
+            params = []
+            for name, enc_json in rows:
+                try:
+                    params.append((pack(unpack(enc_json)), name))
+                except Exception as e:
+                    print(f"migração: encoding inválido para {name}: {e}")
+            if params:
+                cur.executemany("UPDATE encodings SET encoding_bin = %s "
+                                "WHERE name = %s AND encoding_bin IS NULL", params)
+                conn.commit()
+            cur.close()
+        total += len(params)
+        if len(rows) < batch_size:
+            return total
+        last_name = rows[-1][0]
+        if pause:
+            sleep(pause)
+
+
+# ----------------- Arquivo de galeria -----------------
+def _align(n: int) -> int:
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def export_gallery_file(path: Path, names: List[str], matrix: np.ndarray):
+    """Grava nomes + matriz float32 num único arquivo (matriz alinhada, mmap-ável)."""
+    path = Path(path)
+    matrix = np.ascontiguousarray(matrix, dtype=_F32).reshape(-1, ENCODING_DIM)
+    names_blob = json.dumps(names, ensure_ascii=False).encode('utf-8')
+    matrix_offset = _align(_HEADER.size)
+    names_offset = matrix_offset + matrix.nbytes
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(GALLERY_MAGIC, len(names), ENCODING_DIM, matrix_offset, names_offset, len(names_blob)))
+        f.write(b'\0' * (matrix_offset - _HEADER.size))
+        f.write(matrix.tobytes())
+        f.write(names_blob)
+    tmp.replace(path)
+
+
+def load_gallery_file(path: Path) -> Tuple[List[str], np.ndarray]:
+    """Abre o arquivo de galeria; a matriz volta como np.memmap somente leitura."""
+    with open(path, 'rb') as f:
+        magic, n, dim, matrix_offset, names_offset, names_len = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != GALLERY_MAGIC or dim != ENCODING_DIM:
+            raise ValueError(f"arquivo de galeria inválido: {path}")
+        f.seek(names_offset)
+        names = json.loads(f.read(names_len).decode('utf-8'))
+    if n == 0:
+        return names, np.zeros((0, ENCODING_DIM), dtype=_F32)
+    matrix = np.memmap(path, dtype=_F32, mode='r', offset=matrix_offset, shape=(n, ENCODING_DIM))
+    return names, matrix
+
+
+def fetch_gallery(connection: Callable, table: str = 'encodings') -> Tuple[List[str], np.ndarray]:
+    names: List[str] = []
+    vecs: List[np.ndarray] = []
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT name, encoding_bin, encoding FROM {table} ORDER BY name")
+        for name, enc_bin, enc_json in cur:
+            try:
+                vec = row_encoding(enc_bin, enc_json)
+            except Exception:
+                continue
+            names.append(name)
+            vecs.append(vec)
+        cur.close()
+    matrix = np.vstack(vecs) if vecs else np.zeros((0, ENCODING_DIM), dtype=_F32)
+    return names, matrix
+
+
+def import_gallery(connection: Callable, names: List[str], matrix: np.ndarray, batch_size: int = 1000,
+                   table: str = 'encodings') -> int:
+    """Upsert em lotes (executemany) de uma galeria inteira."""
+    total = 0
+    for start in range(0, len(names), batch_size):
+        params = [(names[i], pack(matrix[i]), json_column(matrix[i]))
+                  for i in range(start, min(start + batch_size, len(names)))]
+        with connection() as conn:
+            cur = conn.cursor()
+            cur.executemany(f"""
+                INSERT INTO {table} (name, encoding_bin, encoding) VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE encoding_bin = VALUES(encoding_bin), encoding = VALUES(encoding)
+            """, params)
+            conn.commit()
+            cur.close()
+        total += len(params)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['migrate', 'export', 'import'])
+    parser.add_argument('path', nargs='?', default=None)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    from store import DATA_DIR, ensure_schema, make_pool
+    ensure_schema()
+    db_pool = make_pool(size=2)
+    path = Path(args.path) if args.path else DATA_DIR / 'gallery.bin'
+    t0 = time.perf_counter()
+    if args.command == 'migrate':
+        n = migrate_json_encodings(db_pool.connection, batch_size=args.batch)
+        print(f"{n} linhas migradas para encoding_bin")
+    elif args.command == 'export':
+        names, matrix = fetch_gallery(db_pool.connection)
+        export_gallery_file(path, names, matrix)
+        print(f"{len(names)} encodings exportados para {path}")
+    else:
+        names, matrix = load_gallery_file(path)
+        n = import_gallery(db_pool.connection, names, matrix, batch_size=args.batch)
+        print(f"{n} encodings importados de {path}")
+    print(f"tempo: {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Cadastro em segundo plano: amostras avaliadas em paralelo, progresso por evento.
+
+Cada amostra passa por `inference.assess_sample` (nitidez, um único rosto,
+tamanho mínimo) no pool de processos; as aprovadas ainda passam por rejeição
+de outliers antes da média, para que uma amostra de outra pessoa ou mal
+alinhada não puxe o encoding final.
+"""
+import time
+import uuid
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# distância ao medoide acima da qual a amostra é descartada mesmo com poucas amostras
+OUTLIER_MAX_DISTANCE = 0.45
+
+
+def robust_average(encs: Sequence[Sequence[float]], max_distance: float = OUTLIER_MAX_DISTANCE,
+                   mad_k: float = 3.0) -> Tuple[np.ndarray, List[int], List[int]]:
+    """Média sem outliers: (média, índices mantidos, índices rejeitados).
+
+    Referência é o medoide (a amostra mais próxima das demais); sai quem passa
+    de `max_distance` ou de mediana + `mad_k` * MAD das distâncias a ele.
+    """
+    x = np.asarray(encs, dtype=np.float32).reshape(len(encs), -1)
+    if len(x) <= 2:
+        return x.mean(axis=0), list(range(len(x))), []
+    sq = np.einsum('ij,ij->i', x, x)
+    d = np.sqrt(np.maximum(sq[:, None] + sq[None, :] - 2.0 * (x @ x.T), 0.0))
+    medoid = int(np.argmin(d.sum(axis=1)))
+    dist = d[medoid]
+    med = float(np.median(dist))
+    mad = float(np.median(np.abs(dist - med)))
+    limit = min(max_distance, med + mad_k * mad) if mad > 0 else max_distance
+    kept = [i for i in range(len(x)) if dist[i] <= limit]
+    rejected = [i for i in range(len(x)) if dist[i] > limit]
+    return x[kept].mean(axis=0), kept, rejected
+
+
+class EnrollmentJob:
+    def __init__(self, name: str, owner_user_id, sid: str, total: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.owner_user_id = owner_user_id
+        self.sid = sid
+        self.total = total
+        self.done = 0
+        self.accepted = 0
+        self.rejected: Counter = Counter()
+        self.status = 'queued'
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    def progress(self) -> Dict[str, Any]:
+        end = self.finished_at or time.monotonic()
+        return {'job_id': self.id, 'name': self.name, 'status': self.status, 'done': self.done,
+                'total': self.total, 'accepted': self.accepted, 'rejected': dict(self.rejected),
+                'elapsed_ms': round((end - self.started_at) * 1000.0, 1)}
+
+
+def run_enrollment(job: EnrollmentJob, samples: List[bytes], assess: Callable,
+                   emit: Callable[[str, Dict[str, Any]], None],
+                   save: Callable[[EnrollmentJob, List[float], bytes], None]) -> Dict[str, Any]:
+    """Executa o job; `assess(samples)` devolve os resultados de `assess_sample` em ordem
+    (ex.: InferencePool.imap), `emit(evento, dados)` envia ao navegador e
+    `save(job, encoding, foto)` grava o cadastro. Retorna o payload de `submit_result`."""
+    job.status = 'running'
+    emit('enrollment_progress', job.progress())
+    good: List[Tuple[List[float], float, int]] = []  # (encoding, qualidade, índice da amostra)
+    for i, res in enumerate(assess(samples)):
+        job.done += 1
+        if res is None:
+            job.rejected['error'] += 1
+        elif not res['ok']:
+            job.rejected[res['reason']] += 1
+        else:
+            job.accepted += 1
+            good.append((res['encoding'], (res['sharpness'] or 0.0) * (res['face_px'] or 0), i))
+        emit('enrollment_progress', job.progress())
+
+    if not good:
+        job.status = 'failed'
+        job.finished_at = time.monotonic()
+        emit('enrollment_progress', job.progress())
+        reasons = ', '.join(f'{k}: {v}' for k, v in job.rejected.items())
+        return {'ok': False, 'job_id': job.id,
+                'msg': f'Nenhuma amostra aproveitável ({reasons}).' if reasons else 'Nenhum rosto detectado nas amostras.'}
+
+    avg, kept, outliers = robust_average([g[0] for g in good])
+    if outliers:
+        job.rejected['outlier'] += len(outliers)
+        job.accepted -= len(outliers)
+    # foto representativa: a amostra mantida mais nítida/maior
+    best = max((good[k] for k in kept), key=lambda g: g[1])
+    job.status = 'saving'
+    emit('enrollment_progress', job.progress())
+    save(job, avg.tolist(), samples[best[2]])
+    job.status = 'done'
+    job.finished_at = time.monotonic()
+    emit('enrollment_progress', job.progress())
+    return {'ok': True, 'job_id': job.id, 'msg': f'Cadastro salvo para {job.name}.',
+            'count': len(kept), 'rejected': dict(job.rejected)}
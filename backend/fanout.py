@@ -0,0 +1,137 @@
+"""Distribuição dos resultados dos nós para os navegadores inscritos.
+
+Cada câmera tem uma sala (conjunto de sids); cada navegador tem um canal com
+no máximo `max_in_flight` atualizações sem ack e, enquanto isso, só a mais
+nova por câmera fica pendente. Um navegador lento perde atualizações
+intermediárias em vez de atrasar os outros ou os nós.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+ALL_CAMERAS = '*'
+
+
+class ViewerChannel:
+    def __init__(self, sid: str, thumb_interval: float = 0.0):
+        self.sid = sid
+        self.thumb_interval = thumb_interval
+        self.cameras: Set[str] = set()
+        self.pending: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.in_flight = 0
+        self.sent_at = 0.0
+        self._last_thumb: Dict[str, float] = {}
+        # métricas
+        self.delivered = 0
+        self.coalesced = 0
+        self.thumbs_skipped = 0
+
+    def offer(self, camera_id: str, payload: Dict[str, Any], now: float):
+        """Guarda a atualização; substitui a pendente da mesma câmera."""
+        has_frame = 'frame' in payload or 'frame_b64' in payload
+        if has_frame and self.thumb_interval > 0:
+            last = self._last_thumb.get(camera_id)
+            if last is not None and now - last < self.thumb_interval:
+                payload = {k: v for k, v in payload.items() if k not in ('frame', 'frame_b64')}
+                has_frame = False
+                self.thumbs_skipped += 1
+            else:
+                self._last_thumb[camera_id] = now
+        old = self.pending.pop(camera_id, None)
+        if old is not None:
+            self.coalesced += 1
+            if not has_frame:
+                # o frame ainda não entregue continua valendo
+                for k in ('frame', 'frame_b64'):
+                    if k in old:
+                        payload = {**payload, k: old[k]}
+        self.pending[camera_id] = payload
+
+    def stats(self) -> Dict[str, Any]:
+        return {'cameras': sorted(self.cameras), 'pending': len(self.pending), 'in_flight': self.in_flight,
+                'delivered': self.delivered, 'coalesced': self.coalesced, 'thumbs_skipped': self.thumbs_skipped}
+
+
+class FanOut:
+    """`send(sid, payload, on_ack)` não pode bloquear (ex.: socketio.emit com callback)."""
+
+    def __init__(self, send: Callable[[str, Dict[str, Any], Callable[..., None]], None],
+                 max_in_flight: int = 2, thumb_interval: float = 0.0, ack_timeout: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self._send = send
+        self.max_in_flight = max(1, max_in_flight)
+        self.thumb_interval = thumb_interval
+        self.ack_timeout = ack_timeout
+        self._clock = clock
+        self.viewers: Dict[str, ViewerChannel] = {}
+        self.rooms: Dict[str, Set[str]] = {}
+        self.published = 0
+
+    def subscribe(self, sid: str, cameras: Optional[Iterable[str]] = None,
+                  thumb_interval: Optional[float] = None) -> ViewerChannel:
+        """Inscreve nas câmeras dadas (None = todas, inclusive as que aparecerem depois)."""
+        viewer = self.viewers.get(sid)
+        if viewer is None:
+            viewer = self.viewers[sid] = ViewerChannel(sid, self.thumb_interval)
+        if thumb_interval is not None:
+            viewer.thumb_interval = thumb_interval
+        for cam in ([ALL_CAMERAS] if cameras is None else cameras):
+            viewer.cameras.add(cam)
+            self.rooms.setdefault(cam, set()).add(sid)
+        return viewer
+
+    def unsubscribe(self, sid: str, cameras: Optional[Iterable[str]] = None):
+        viewer = self.viewers.get(sid)
+        if viewer is None:
+            return
+        for cam in list(viewer.cameras if cameras is None else cameras):
+            viewer.cameras.discard(cam)
+            viewer.pending.pop(cam, None)
+            room = self.rooms.get(cam)
+            if room is not None:
+                room.discard(sid)
+                if not room:
+                    del self.rooms[cam]
+        if not viewer.cameras:
+            del self.viewers[sid]
+
+    def drop(self, sid: str):
+        self.unsubscribe(sid)
+
+    def publish(self, camera_id: str, payload: Dict[str, Any]) -> int:
+        """Entrega aos inscritos da câmera; retorna quantos navegadores receberam."""
+        self.published += 1
+        now = self._clock()
+        sids = self.rooms.get(camera_id, set()) | self.rooms.get(ALL_CAMERAS, set())
+        for sid in sids:
+            viewer = self.viewers.get(sid)
+            if viewer is None:
+                continue
+            if viewer.in_flight and now - viewer.sent_at > self.ack_timeout:
+                # ack perdido (ou cliente sem suporte a ack): libera o canal
+                viewer.in_flight = 0
+            viewer.offer(camera_id, payload, now)
+            self._pump(viewer)
+        return len(sids)
+
+    def _pump(self, viewer: ViewerChannel):
+        while viewer.pending and viewer.in_flight < self.max_in_flight:
+            _, payload = viewer.pending.popitem(last=False)
+            viewer.in_flight += 1
+            viewer.sent_at = self._clock()
+            viewer.delivered += 1
+            self._send(viewer.sid, payload, lambda *_, sid=viewer.sid: self._acked(sid))
+
+    def _acked(self, sid: str):
+        viewer = self.viewers.get(sid)
+        if viewer is None:
+            return
+        viewer.in_flight = max(0, viewer.in_flight - 1)
+        self._pump(viewer)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'viewers': len(self.viewers), 'rooms': {cam: len(s) for cam, s in self.rooms.items()},
+                'published': self.published,
+                'delivered': sum(v.delivered for v in self.viewers.values()),
+                'coalesced': sum(v.coalesced for v in self.viewers.values()),
+                'thumbs_skipped': sum(v.thumbs_skipped for v in self.viewers.values())}
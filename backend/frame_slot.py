@@ -0,0 +1,56 @@
+from threading import Condition
+from typing import Any, Dict, Optional
+
+
+class FrameSlot:
+    """Slot de um único frame: o mais novo substitui o pendente.
+
+    `put`/`take` nunca bloqueiam (seguros no hub do eventlet); `get` bloqueia
+    com timeout e serve para consumidores em threads (nós de processamento).
+    """
+
+    def __init__(self):
+        self._cond = Condition()
+        self._item: Any = None
+        self._has_item = False
+        self.busy = False  # há um consumidor drenando este slot
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> bool:
+        return self._has_item
+
+    def put(self, item: Any) -> bool:
+        """Guarda o frame; retorna True se um frame pendente foi descartado."""
+        with self._cond:
+            replaced = self._has_item
+            if replaced:
+                self.dropped += 1
+            self._item = item
+            self._has_item = True
+            self.received += 1
+            self._cond.notify()
+            return replaced
+
+    def take(self) -> Optional[Any]:
+        with self._cond:
+            if not self._has_item:
+                return None
+            item, self._item, self._has_item = self._item, None, False
+            self.processed += 1
+            return item
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        with self._cond:
+            if not self._has_item:
+                self._cond.wait(timeout)
+            if not self._has_item:
+                return None
+            item, self._item, self._has_item = self._item, None, False
+            self.processed += 1
+            return item
+
+    def stats(self) -> Dict[str, int]:
+        return {'received': self.received, 'processed': self.processed, 'dropped': self.dropped}
@@ -0,0 +1,195 @@
+import time
+from threading import Lock
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from mysql.connector import Error
+
+from encoding_format import row_encoding
+from gallery_sync import GalleryLog
+from matcher import DEFAULT_THRESHOLD, FaceMatcher
+
+
+class GalleryCache:
+    """Cache em memória (por processo) dos encodings conhecidos.
+
+    Carrega a tabela `encodings` uma vez e depois só consulta
+    `COUNT(*)`/`MAX(updated_at)` a cada `refresh_interval` segundos para
+    detectar alterações feitas fora deste processo. Toda alteração entra no
+    `log` versionado que alimenta os nós de processamento.
+    """
+
+    def __init__(self, connection: Callable, refresh_interval: float = 5.0,
+                 threshold: float = DEFAULT_THRESHOLD, matcher=None):
+        # fábrica de context manager que empresta uma conexão (ex.: ConnectionPool.connection)
+        self._connection = connection
+        self._lock = Lock()
+        self.refresh_interval = refresh_interval
+        # FaceMatcher (exato) por padrão; aceita também um IVFIndex
+        self.matcher = matcher if matcher is not None else FaceMatcher(threshold=threshold)
+        # Copy-on-write: leitores recebem sempre um dict que não muda mais
+        self._encodings: Dict[str, np.ndarray] = {}
+        self._loaded = False
+        self._last_check = 0.0
+        self._max_updated = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.incremental_refreshes = 0
+        self.log = GalleryLog()
+
+    def load(self) -> Dict[str, np.ndarray]:
+        """Recarrega toda a galeria do banco."""
+        encodings: Dict[str, np.ndarray] = {}
+        max_updated = None
+        try:
+            with self._connection('gallery_load') as conn:
+                c = conn.cursor()
+                c.execute("SELECT name, encoding_bin, encoding, updated_at FROM encodings")
+                for name, enc_bin, enc_json, updated_at in c:
+                    try:
+                        encodings[name] = row_encoding(enc_bin, enc_json)
+                    except Exception:
+                        continue
+                    if updated_at is not None and (max_updated is None or updated_at > max_updated):
+                        max_updated = updated_at
+                c.close()
+        except Error as e:
+            print("gallery load error:", e)
+            return self._encodings
+
+        with self._lock:
+            previous, was_loaded = self._encodings, self._loaded
+            self._encodings = encodings
+            self.matcher.load(encodings)
+            self._max_updated = max_updated
+            self._loaded = True
+            self._last_check = time.monotonic()
+            self.reloads += 1
+        if was_loaded:
+            # recarga completa: só a diferença vai para os nós
+            changes = [('delete', n, None) for n in previous if n not in encodings]
+            changes += [('upsert', n, e) for n, e in encodings.items()
+                        if n not in previous or previous[n].tobytes() != e.tobytes()]
+            self.log.record(changes)
+        else:
+            self.log.reset()
+        return encodings
+
+    def _refresh(self):
+        """Aplica linhas alteradas desde o último `updated_at` visto."""
+        try:
+            with self._connection('gallery_refresh') as conn:
+                c = conn.cursor()
+                c.execute("SELECT COUNT(*), MAX(updated_at) FROM encodings")
+                count, max_updated = c.fetchone()
+                changed = []
+                if max_updated is not None and (self._max_updated is None or max_updated > self._max_updated):
+                    # TIMESTAMP tem resolução de segundos: usa >= e reaplica linhas repetidas
+                    if self._max_updated is None:
+                        c.execute("SELECT name, encoding_bin, encoding, updated_at FROM encodings")
+                    else:
+                        c.execute("SELECT name, encoding_bin, encoding, updated_at FROM encodings "
+                                  "WHERE updated_at >= %s", (self._max_updated,))
+                    changed = c.fetchall()
+                c.close()
+        except Error as e:
+            print("gallery refresh error:", e)
+            with self._lock:
+                self._last_check = time.monotonic()
+            return
+
+        applied = []
+        with self._lock:
+            self._last_check = time.monotonic()
+            if changed:
+                encodings = dict(self._encodings)
+                for name, enc_bin, enc_json, updated_at in changed:
+                    try:
+                        enc = row_encoding(enc_bin, enc_json)
+                    except Exception:
+                        continue
+                    previous = encodings.get(name)
+                    encodings[name] = enc
+                    self.matcher.add(name, enc)
+                    # linhas repetidas pelo `>=` não geram nova versão
+                    if previous is None or previous.tobytes() != enc.tobytes():
+                        applied.append(('upsert', name, enc))
+                self._encodings = encodings
+                self._max_updated = max_updated
+                self.incremental_refreshes += 1
+            in_sync = len(self._encodings) == count
+        self.log.record(applied)
+
+        # Remoções externas não aparecem em updated_at; só a contagem as revela
+        if not in_sync:
+            self.load()
+
+    def _ensure_fresh(self):
+        if not self._loaded:
+            self.misses += 1
+            self.load()
+        elif time.monotonic() - self._last_check >= self.refresh_interval:
+            self.misses += 1
+            self._refresh()
+        else:
+            self.hits += 1
+
+    def get(self) -> Dict[str, np.ndarray]:
+        """Retorna a galeria atual (não modificar o dict retornado)."""
+        self._ensure_fresh()
+        return self._encodings
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """Galeria em memória como está, sem checar o banco (não modificar)."""
+        return self._encodings
+
+    def get_matcher(self):
+        """Retorna o FaceMatcher sincronizado com a galeria."""
+        self._ensure_fresh()
+        return self.matcher
+
+    def put(self, name: str, enc):
+        enc = np.asarray(enc, dtype=np.float32)
+        with self._lock:
+            encodings = dict(self._encodings)
+            encodings[name] = enc
+            self._encodings = encodings
+            self.matcher.add(name, enc)
+        self.log.record([('upsert', name, enc)])
+
+    def remove(self, name: str):
+        with self._lock:
+            if name not in self._encodings:
+                return
+            encodings = dict(self._encodings)
+            encodings.pop(name, None)
+            self._encodings = encodings
+            self.matcher.remove(name)
+        self.log.record([('delete', name, None)])
+
+    def swap_matcher(self, matcher, synced_with: Dict[str, np.ndarray]):
+        """Troca o matcher por um já carregado com `synced_with` (ex.: IVF montado em segundo plano).
+
+        Alterações que chegaram depois dessa cópia são aplicadas antes da troca.
+        """
+        with self._lock:
+            if self._encodings is not synced_with:
+                matcher.load(self._encodings)
+            self.matcher = matcher
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def stats(self) -> Dict[str, Optional[object]]:
+        return {
+            'size': len(self._encodings),
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'incremental_refreshes': self.incremental_refreshes,
+            'refresh_interval': self.refresh_interval,
+            'threshold': self.matcher.threshold,
+            'sync': self.log.stats(),
+        }
@@ -0,0 +1,149 @@
+"""Sincronização incremental da galeria servidor -> nós de processamento.
+
+O servidor numera cada alteração (`version`) e guarda as últimas num log em
+memória; `epoch` muda a cada início do servidor. Um nó manda a última versão
+que aplicou e recebe só as alterações seguintes, ou a galeria inteira quando
+ficou para trás do log (ou o epoch é outro).
+
+Mensagem `gallery_delta`:
+    {'epoch', 'version', 'base', 'changes': [{'op': 'upsert'|'delete', 'name', 'encoding'}]}
+    {'epoch', 'version', 'full': True, 'names': [...], 'matrix': bytes float32 N x 128}
+    {'epoch', 'version', 'resync': True}   (galeria recarregada; o nó pede sync)
+`base` é a versão que o nó precisa ter para aplicar `changes`; encodings vão
+no formato de `encoding_format.pack` (anexo binário do Socket.IO).
+"""
+import uuid
+from collections import deque
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from encoding_format import ENCODING_DIM, pack, unpack
+
+
+class GalleryLog:
+    """Log versionado de alterações (lado do servidor)."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.floor = 0  # menor versão a partir da qual o log ainda emenda
+        self._entries: deque = deque(maxlen=max_entries)
+        self._lock = Lock()
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None]):
+        self._listeners.append(callback)
+
+    def record(self, changes: List[Tuple[str, str, Optional[Any]]]):
+        """Registra [(op, nome, encoding|None)] como versões consecutivas e avisa os ouvintes."""
+        if not changes:
+            return
+        with self._lock:
+            base = self.version
+            out = []
+            for op, name, enc in changes:
+                self.version += 1
+                entry = (self.version, op, name, pack(enc) if enc is not None else None)
+                if len(self._entries) == self._entries.maxlen:
+                    self.floor = self._entries[0][0]
+                self._entries.append(entry)
+                out.append(entry)
+            msg = {'epoch': self.epoch, 'version': self.version, 'base': base,
+                   'changes': [_change(e) for e in out]}
+        self._notify(msg)
+
+    def reset(self):
+        """Galeria recarregada por inteiro: descarta o log e manda os nós ressincronizarem."""
+        with self._lock:
+            self.version += 1
+            self.floor = self.version
+            self._entries.clear()
+            msg = {'epoch': self.epoch, 'version': self.version, 'resync': True}
+        self._notify(msg)
+
+    def _notify(self, msg: Dict[str, Any]):
+        for cb in list(self._listeners):
+            try:
+                cb(msg)
+            except Exception as e:
+                print("gallery listener error:", e)
+
+    def since(self, version: Optional[int], epoch: Optional[str],
+              snapshot: Callable[[], Dict[str, np.ndarray]]) -> Dict[str, Any]:
+        """Alterações depois de `version`, ou a galeria inteira se não der para emendar.
+
+        `snapshot` é lido sob o lock do log, junto com a versão: a galeria troca
+        antes de `record`, então a cópia já tem tudo até essa versão. Deve só
+        devolver o dict atual (sem I/O nem `record`).
+        """
+        with self._lock:
+            if epoch == self.epoch and version is not None and self.floor <= version <= self.version:
+                return {'epoch': self.epoch, 'version': self.version, 'base': version,
+                        'changes': [_change(e) for e in self._entries if e[0] > version]}
+            current = self.version
+            encodings = snapshot()
+        names = list(encodings.keys())
+        matrix = np.zeros((len(names), ENCODING_DIM), dtype='<f4')
+        for i, name in enumerate(names):
+            matrix[i] = encodings[name]
+        return {'epoch': self.epoch, 'version': current, 'full': True,
+                'names': names, 'matrix': matrix.tobytes()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {'epoch': self.epoch, 'version': self.version, 'floor': self.floor,
+                'entries': len(self._entries)}
+
+
+def _change(entry) -> Dict[str, Any]:
+    _, op, name, enc = entry
+    return {'op': op, 'name': name, 'encoding': enc}
+
+
+class GalleryReplica:
+    """Cópia da galeria num nó: aplica deltas no matcher sem parar o reconhecimento."""
+
+    def __init__(self, matcher, on_change: Optional[Callable[[], None]] = None):
+        self.matcher = matcher
+        self.on_change = on_change
+        self.epoch: Optional[str] = None
+        self.version: Optional[int] = None
+        self.applied = 0
+        self.full_syncs = 0
+        self._lock = Lock()
+
+    def sync_request(self) -> Dict[str, Any]:
+        return {'epoch': self.epoch, 'version': self.version}
+
+    def apply(self, msg: Dict[str, Any]) -> bool:
+        """Aplica uma mensagem `gallery_delta`; False = houve buraco, pedir sync de novo."""
+        with self._lock:
+            if msg.get('full'):
+                names = list(msg.get('names') or [])
+                matrix = np.frombuffer(msg.get('matrix') or b'', dtype='<f4').reshape(-1, ENCODING_DIM)
+                self.matcher.load_matrix(names, matrix)
+                self.epoch, self.version = msg['epoch'], msg['version']
+                self.full_syncs += 1
+            else:
+                if msg.get('epoch') != self.epoch or self.version is None:
+                    return False
+                if msg['version'] <= self.version:
+                    return True  # já aplicado (chegou junto com um snapshot)
+                if msg.get('resync') or msg.get('base', self.version) > self.version:
+                    return False
+                skip = self.version - msg.get('base', self.version)
+                for change in msg.get('changes', [])[skip:]:
+                    if change['op'] == 'delete':
+                        self.matcher.remove(change['name'])
+                    else:
+                        self.matcher.add(change['name'], unpack(change['encoding']))
+                    self.applied += 1
+                self.version = msg['version']
+        if self.on_change is not None:
+            self.on_change()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {'epoch': self.epoch, 'version': self.version, 'applied': self.applied,
+                'full_syncs': self.full_syncs, 'size': len(self.matcher)}
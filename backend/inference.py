@@ -0,0 +1,593 @@
+"""Pool de processos para detecção/encoding fora do hub do eventlet.
+
+As funções `recognize_batch`/`recognize_frame` e `assess_sample` rodam nos
+workers; o servidor só faz o matching (a galeria fica no processo principal).
+
+Throughput do encoding em lote:
+    python backend/inference.py caminho/para/jpegs --batch_sizes 1,2,4,8
+"""
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from detectors import DEFAULT_DETECTOR, make_detector, normalize_spec
+from resolution import apply_plan, to_source
+
+
+class RecognitionEngine:
+    """Modelos de um processo: carregados e aquecidos uma vez, reusados em todo frame.
+
+    Resolve o backend (dlib via face_recognition ou só Haar), guarda as
+    referências aos landmarks e ao encoder, mantém os detectores já
+    carregados (um por especificação, ver detectors.py) e roda uma inferência
+    de aquecimento para o primeiro frame real não pagar a carga.
+    """
+
+    def __init__(self):
+        self.cv2 = None
+        self.np = None
+        self.fr = None
+        self.dlib = None
+        self.api = None          # face_recognition.api (pose_predictor_5_point, face_encoder)
+        self.detectors: Dict[str, Any] = {}
+        self.batch_encoding = True  # dlib com compute_face_descriptor em lote
+        self.backend: Optional[str] = None
+        self.load_ms: Optional[float] = None
+        self.warmup_ms: Optional[float] = None
+
+    def load(self) -> 'RecognitionEngine':
+        t0 = time.perf_counter()
+        import cv2
+        import numpy as np
+        self.cv2, self.np = cv2, np
+        try:
+            import dlib
+            import face_recognition
+            from face_recognition import api
+            self.fr, self.dlib, self.api = face_recognition, dlib, api
+        except Exception as e:
+            print('inference worker: face_recognition indisponível:', e)
+            self.fr = self.dlib = self.api = None
+        self.backend = 'dlib' if self.fr is not None else 'haar'
+        self.detector(DEFAULT_DETECTOR)
+        self.load_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+        return self
+
+    def warm_up(self):
+        """Passa um frame sintético pelo caminho real (JPEG -> detecção -> encoding)."""
+        t0 = time.perf_counter()
+        np, cv2 = self.np, self.cv2
+        img = np.tile(np.linspace(0, 255, 160, dtype=np.uint8), (120, 1))
+        _, jpg = cv2.imencode('.jpg', cv2.cvtColor(img, cv2.COLOR_GRAY2BGR))
+        recognize_batch([jpg.tobytes()])
+        if self.fr is not None:
+            # sem rosto no frame sintético: força uma caixa para carregar landmarks/ResNet
+            rgb = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+            encode_faces([rgb], [[(20, 120, 100, 40)]])
+        self.warmup_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+
+    def detector(self, spec: Optional[str] = None):
+        """Detector da especificação, carregado uma vez; sem dlib/modelo cai no Haar."""
+        key = spec or DEFAULT_DETECTOR
+        det = self.detectors.get(key)
+        if det is None:
+            try:
+                name = normalize_spec(key)
+                if name.startswith('hog') and self.fr is None:
+                    name = 'haar'
+                det = self.detectors.get(name) or make_detector(name)
+            except Exception as e:
+                print(f'detector {key} indisponível ({e}); usando haar')
+                name = 'haar'
+                det = self.detectors.get(name) or make_detector(name)
+            self.detectors.setdefault(name, det)
+            self.detectors[key] = det
+        return det
+
+    def info(self) -> Dict[str, Any]:
+        return {'pid': os.getpid(), 'backend': self.backend, 'face_recognition': self.fr is not None,
+                'detectors': sorted(self.detectors), 'load_ms': self.load_ms, 'warmup_ms': self.warmup_ms}
+
+
+# Motor do processo (um por worker; também usado em processo pelo nó/CLIs)
+_engine: Optional[RecognitionEngine] = None
+
+
+def init_engine() -> RecognitionEngine:
+    """Carrega e aquece o motor deste processo (idempotente)."""
+    global _engine
+    if _engine is None:
+        engine = RecognitionEngine().load()
+        _engine = engine
+        engine.warm_up()
+    return _engine
+
+
+def _init_worker():
+    init_engine()
+
+
+def _ping():
+    return _engine.info()
+
+
+def _decode(img_bytes: bytes):
+    if isinstance(img_bytes, _engine.np.ndarray):
+        return img_bytes  # frame já decodificado (nó multi-câmera)
+    # frombuffer não copia: o imdecode lê direto do buffer recebido
+    arr = _engine.np.frombuffer(img_bytes, dtype=_engine.np.uint8)
+    return _engine.cv2.imdecode(arr, _engine.cv2.IMREAD_COLOR)
+
+
+def encode_faces(images: List[Any], boxes_per_image: List[List[tuple]]) -> List[List[List[float]]]:
+    """Encodings de todos os rostos de vários frames RGB numa chamada só.
+
+    Usa a API em lote do dlib (`compute_face_descriptor(imagens, shapes)`),
+    com os mesmos landmarks de 5 pontos que `face_recognition.face_encodings`.
+    """
+    out: List[List[List[float]]] = [[] for _ in images]
+    idx = [i for i, boxes in enumerate(boxes_per_image) if boxes]
+    if not idx:
+        return out
+    eng = _engine
+    if eng.batch_encoding:
+        try:
+            dlib, api = eng.dlib, eng.api
+            batch_imgs, batch_shapes = [], []
+            for i in idx:
+                shapes = dlib.full_object_detections()
+                for (top, right, bottom, left) in boxes_per_image[i]:
+                    shapes.append(api.pose_predictor_5_point(images[i], dlib.rectangle(left, top, right, bottom)))
+                batch_imgs.append(images[i])
+                batch_shapes.append(shapes)
+            descs = api.face_encoder.compute_face_descriptor(batch_imgs, batch_shapes, 1)
+            for i, per_img in zip(idx, descs):
+                out[i] = [list(d) for d in per_img]
+            return out
+        except (AttributeError, TypeError):
+            # dlib sem API em lote: não tenta de novo neste processo
+            eng.batch_encoding = False
+    # uma chamada por frame com todas as caixas
+    for i in idx:
+        out[i] = [e.tolist() for e in eng.fr.face_encodings(images[i], boxes_per_image[i])]
+    return out
+
+
+def _detect(img, spec: Optional[str] = None):
+    """Detecção na imagem já reduzida/recortada; devolve (rgb ou None, caixas, segundos).
+
+    rgb é None sem face_recognition (só detecção, sem reconhecimento).
+    """
+    t0 = time.perf_counter()
+    rgb = _engine.cv2.cvtColor(img, _engine.cv2.COLOR_BGR2RGB) if _engine.fr is not None else None
+    boxes = _engine.detector(spec).detect(img, rgb)
+    return rgb, boxes, time.perf_counter() - t0
+
+
+def _clip(boxes: List[Tuple[int, int, int, int]], w: int, h: int) -> List[Tuple[int, int, int, int]]:
+    return [(max(0, t), min(w, r), min(h, b), max(0, l)) for (t, r, b, l) in boxes]
+
+
+def recognize_batch(frames: List[Any]) -> List[Optional[Dict[str, Any]]]:
+    """Decodifica e detecta cada frame; codifica todos os rostos em lote.
+
+    Cada item é o JPEG ou `(JPEG, plano)`, com o plano de escala/ROI vindo de
+    um ResolutionController (e opcionalmente 'detector', ver detectors.py);
+    as caixas retornam nas coordenadas originais e o encoding usa o frame
+    original (não o reduzido). `decode_s`/`detect_s` são do frame; `encode_s`
+    é o encoding do lote rateado entre os frames com rosto.
+    """
+    results: List[Optional[Dict[str, Any]]] = []
+    rgbs, boxes_list, slots = [], [], []
+    for item in frames:
+        img_bytes, plan = item if isinstance(item, tuple) else (item, None)
+        t0 = time.perf_counter()
+        frame = _decode(img_bytes)
+        if frame is None:
+            results.append(None)
+            continue
+        decode_s = time.perf_counter() - t0
+        h, w = frame.shape[:2]
+        img, scale, offset = apply_plan(frame, plan)
+        rgb, boxes, detect_s = _detect(img, plan.get('detector') if plan else None)
+        source = _clip(to_source(boxes, scale, offset), w, h)
+        results.append({'w': w, 'h': h, 'boxes': source,
+                        'encodings': None if rgb is None else [], 'decode_s': decode_s,
+                        'detect_s': detect_s, 'encode_s': None})
+        if rgb is not None and boxes:
+            # encoding no frame original: a escala reduzida só serve para achar os rostos
+            full = rgb if img is frame else _engine.cv2.cvtColor(frame, _engine.cv2.COLOR_BGR2RGB)
+            rgbs.append(full); boxes_list.append(source); slots.append(len(results) - 1)
+    if rgbs:
+        t0 = time.perf_counter()
+        encoded = encode_faces(rgbs, boxes_list)
+        encode_s = (time.perf_counter() - t0) / len(rgbs)
+        for slot, encs in zip(slots, encoded):
+            results[slot]['encodings'] = encs
+            results[slot]['encode_s'] = encode_s
+    return results
+
+
+def recognize_tracked(img_bytes: bytes, tracker, plan: Optional[Dict[str, Any]] = None):
+    """Um passo do modo detectar-e-rastrear; devolve (resultado, tracker atualizado).
+
+    `pending` lista os ids das trilhas que precisam de matching (na mesma
+    ordem de `encodings`); as demais mantêm a identidade já atribuída.
+    """
+    t0 = time.perf_counter()
+    frame = _decode(img_bytes)
+    if frame is None:
+        return None, tracker
+    decode_s = time.perf_counter() - t0
+    h, w = frame.shape[:2]
+    gray = _engine.cv2.cvtColor(frame, _engine.cv2.COLOR_BGR2GRAY)
+    pending, encs, boxes, detect_s, encode_s = [], [], None, None, None
+    if tracker.needs_detection():
+        img, scale, offset = apply_plan(frame, plan)
+        _, local, detect_s = _detect(img, plan.get('detector') if plan else None)
+        boxes = to_source(local, scale, offset)
+        pending = tracker.update(gray, boxes)
+        if pending:
+            t0 = time.perf_counter()
+            rgb = _engine.cv2.cvtColor(frame, _engine.cv2.COLOR_BGR2RGB)
+            encs = encode_faces([rgb], [[t.box for t in pending]])[0]
+            encode_s = time.perf_counter() - t0
+    else:
+        tracker.propagate(gray)
+    return {'w': w, 'h': h, 'pending': [t.id for t in pending], 'encodings': encs,
+            'boxes': boxes, 'decode_s': decode_s, 'detect_s': detect_s, 'encode_s': encode_s}, tracker
+
+
+def recognize_frame(img_bytes: bytes) -> Optional[Dict[str, Any]]:
+    """Decodifica, detecta e codifica todos os rostos de um frame JPEG."""
+    return recognize_batch([img_bytes])[0]
+
+
+def _sharpness(gray) -> float:
+    """Variância do Laplaciano (quanto menor, mais borrado)."""
+    return float(_engine.cv2.Laplacian(gray, _engine.cv2.CV_64F).var())
+
+
+def assess_sample(img_bytes: bytes, min_face_px: int = 80, min_sharpness: float = 40.0) -> Dict[str, Any]:
+    """Filtra a amostra de cadastro antes do encoding (a etapa cara).
+
+    Ordem do mais barato ao mais caro: nitidez do frame, detecção, número e
+    tamanho dos rostos, nitidez do rosto e só então o encoding. Retorna
+    {'ok', 'reason', 'encoding', 'sharpness', 'face_px', 'box'}.
+    """
+    if _engine.fr is None:
+        raise RuntimeError('face_recognition não disponível')
+    out: Dict[str, Any] = {'ok': False, 'reason': None, 'encoding': None, 'sharpness': None, 'face_px': None,
+                           'box': None}
+    frame = _decode(img_bytes)
+    if frame is None:
+        out['reason'] = 'invalid_image'
+        return out
+    gray = _engine.cv2.cvtColor(frame, _engine.cv2.COLOR_BGR2GRAY)
+    # frame inteiro muito borrado (movimento/foco): nem vale detectar
+    if _sharpness(gray) < min_sharpness / 4:
+        out['reason'] = 'blurry'
+        return out
+    rgb = _engine.cv2.cvtColor(frame, _engine.cv2.COLOR_BGR2RGB)
+    boxes = _engine.fr.face_locations(rgb, model='hog')
+    if not boxes:
+        out['reason'] = 'no_face'
+        return out
+    if len(boxes) > 1:
+        out['reason'] = 'multiple_faces'
+        return out
+    top, right, bottom, left = out['box'] = tuple(int(v) for v in boxes[0])
+    out['face_px'] = int(min(right - left, bottom - top))
+    if out['face_px'] < min_face_px:
+        out['reason'] = 'face_too_small'
+        return out
+    out['sharpness'] = round(_sharpness(gray[max(0, top):bottom, max(0, left):right]), 2)
+    if out['sharpness'] < min_sharpness:
+        out['reason'] = 'blurry'
+        return out
+    out['encoding'] = _engine.fr.face_encodings(rgb, boxes)[0].tolist()
+    out['ok'] = True
+    return out
+
+
+class LatencyStats:
+    """Contador simples: média móvel exponencial e máximo (em ms)."""
+
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha
+        self.count = 0
+        self.avg_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+
+    def record(self, seconds: float):
+        ms = seconds * 1000.0
+        self.count += 1
+        self.last_ms = ms
+        self.avg_ms = ms if self.count == 1 else (1 - self.alpha) * self.avg_ms + self.alpha * ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {'count': self.count, 'avg_ms': round(self.avg_ms, 3),
+                'max_ms': round(self.max_ms, 3), 'last_ms': round(self.last_ms, 3)}
+
+
+class InferencePool:
+    """ProcessPoolExecutor com limite de tarefas em voo.
+
+    `waiter` bloqueia até o resultado de um Future; no servidor use
+    `eventlet.tpool.execute` para que a espera não trave o hub (e `sleep`
+    cooperativo, usado quando a fila está cheia).
+    `state`: 'stopped' -> 'starting' -> 'ready' (ou 'failed'); `start()` só
+    retorna depois que todos os workers carregaram e aqueceram o motor.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: int = 16,
+                 waiter: Optional[Callable] = None, sleep: Callable[[float], Any] = time.sleep):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.max_queue = max_queue
+        self._waiter = waiter
+        self._sleep = sleep
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = Lock()
+        self.have_face_recognition = False
+        self.state = 'stopped'
+        self.error: Optional[str] = None
+        self.startup_ms: Optional[float] = None
+        self.engines: List[Dict[str, Any]] = []
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.task_latency = LatencyStats()
+        self.hub_lag = LatencyStats()
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None or self.state == 'starting':
+                return
+            self.state = 'starting'
+        t0 = time.perf_counter()
+        ctx = multiprocessing.get_context('spawn')
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_init_worker)
+        try:
+            # força a criação (e o warm-up) de todos os workers agora
+            infos = [self._wait(f) for f in [executor.submit(_ping) for _ in range(self.workers)]]
+        except Exception as e:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.state = 'failed'
+            self.error = str(e)
+            raise
+        self._executor = executor
+        self.engines = infos
+        self.have_face_recognition = all(i['face_recognition'] for i in infos)
+        self.startup_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+        self.error = None
+        self.state = 'ready'
+
+    @property
+    def ready(self) -> bool:
+        return self.state == 'ready'
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self.state = 'stopped'
+
+    def _wait(self, fut: Future):
+        return self._waiter(fut.result) if self._waiter else fut.result()
+
+    def submit(self, fn: Callable, *args) -> Optional[Future]:
+        """Enfileira uma tarefa; retorna None se a fila estiver cheia (ou o motor ainda subindo)."""
+        if self._executor is None:
+            if self.state == 'starting':
+                with self._lock:
+                    self.rejected += 1
+                return None
+            self.start()
+            if self._executor is None:
+                return None
+        with self._lock:
+            if self.in_flight >= self.max_queue:
+                self.rejected += 1
+                return None
+            self.in_flight += 1
+            self.submitted += 1
+        start = time.perf_counter()
+        fut = self._executor.submit(fn, *args)
+
+        def _done(f: Future):
+            with self._lock:
+                self.in_flight -= 1
+                if f.exception() is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            self.task_latency.record(time.perf_counter() - start)
+
+        fut.add_done_callback(_done)
+        return fut
+
+    def run(self, fn: Callable, *args):
+        """Executa e espera; retorna None se a tarefa foi rejeitada."""
+        fut = self.submit(fn, *args)
+        if fut is None:
+            return None
+        return self._wait(fut)
+
+    def imap(self, fn: Callable, items: List[Any], *args, window: Optional[int] = None):
+        """Como `map`, mas entrega cada resultado (em ordem) assim que fica pronto.
+
+        No máximo `window` tarefas em voo (padrão: metade da fila, até o número
+        de workers), todas pela admissão de `submit`, para sobrar fila aos frames ao vivo.
+        """
+        window = window or max(1, min(self.workers, self.max_queue // 2))
+        pending: deque = deque()
+
+        def drain():
+            try:
+                return self._wait(pending.popleft())
+            except Exception as e:
+                print('inference task error:', e)
+                return None
+
+        for it in items:
+            while len(pending) >= window:
+                yield drain()
+            fut = self.submit(fn, it, *args)
+            while fut is None:
+                # fila cheia: entrega o mais antigo ou espera alguém liberar espaço
+                if pending:
+                    yield drain()
+                else:
+                    self._sleep(0.01)
+                fut = self.submit(fn, it, *args)
+            pending.append(fut)
+        while pending:
+            yield drain()
+
+    def map(self, fn: Callable, items: List[Any]) -> List[Any]:
+        """Executa em paralelo respeitando a fila; resultados em ordem."""
+        return list(self.imap(fn, items))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.workers,
+            'state': self.state,
+            'error': self.error,
+            'startup_ms': self.startup_ms,
+            'backend': self.engines[0]['backend'] if self.engines else None,
+            'warmup_ms': max((i['warmup_ms'] or 0.0 for i in self.engines), default=None),
+            'face_recognition': self.have_face_recognition,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'task_latency': self.task_latency.to_dict(),
+            'hub_lag': self.hub_lag.to_dict(),
+        }
+
+
+class MicroBatcher:
+    """Junta frames de várias sessões/câmeras numa tarefa só.
+
+    O primeiro frame de um lote espera até `window` segundos (via `sleep`,
+    que no servidor é `socketio.sleep`) por outros; o lote sai antes se
+    atingir `max_batch`. Cada chamador recebe só o seu resultado.
+    """
+
+    def __init__(self, pool: InferencePool, batch_fn: Callable, window: float = 0.015,
+                 max_batch: int = 8, sleep: Callable = time.sleep):
+        self.pool = pool
+        self.batch_fn = batch_fn
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._sleep = sleep
+        self._lock = Lock()
+        self._items: Optional[List[Any]] = None
+        self._outer: Optional[Future] = None
+        self.batches = 0
+        self.items = 0
+
+    def _dispatch(self, items: List[Any], outer: Future):
+        self.batches += 1
+        self.items += len(items)
+        inner = self.pool.submit(self.batch_fn, items)
+        if inner is None:  # fila cheia: todo o lote é descartado
+            outer.set_result([None] * len(items))
+            return
+
+        def _chain(f: Future):
+            if f.exception() is not None:
+                outer.set_exception(f.exception())
+            else:
+                outer.set_result(f.result())
+
+        inner.add_done_callback(_chain)
+
+    def run(self, item: Any):
+        if self.window <= 0 or self.max_batch == 1:
+            out = self.pool.run(self.batch_fn, [item])
+            return None if out is None else out[0]
+        with self._lock:
+            leader = self._items is None
+            if leader:
+                self._items, self._outer = [], Future()
+            items, outer = self._items, self._outer
+            pos = len(items)
+            items.append(item)
+            full = len(items) >= self.max_batch
+            if full:
+                self._items = self._outer = None
+        if full:
+            self._dispatch(items, outer)
+        elif leader:
+            self._sleep(self.window)
+            with self._lock:
+                pending = self._items is items
+                if pending:
+                    self._items = self._outer = None
+            if pending:
+                self._dispatch(items, outer)
+        return self.pool._wait(outer)[pos]
+
+    def stats(self) -> Dict[str, Any]:
+        return {'window_ms': round(self.window * 1000.0, 3), 'max_batch': self.max_batch,
+                'batches': self.batches, 'items': self.items,
+                'avg_batch': round(self.items / self.batches, 3) if self.batches else 0.0}
+
+
+def bench_batching(paths: List[str], batch_sizes: List[int], rounds: int = 3) -> Dict[str, Any]:
+    """Rostos/s codificando por rosto vs. em lotes de N frames (no processo atual)."""
+    init_engine()
+    frames = []
+    for p in paths:
+        img = _engine.cv2.imread(p)
+        if img is not None:
+            frames.append(_engine.cv2.cvtColor(img, _engine.cv2.COLOR_BGR2RGB))
+    boxes = [_engine.fr.face_locations(f, model='hog') for f in frames]
+    faces = sum(len(b) for b in boxes)
+    if not faces:
+        raise SystemExit('nenhum rosto nas imagens de teste')
+
+    def per_face():
+        for f, bs in zip(frames, boxes):
+            for b in bs:
+                _engine.fr.face_encodings(f, [b])
+
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        per_face()
+    base = faces * rounds / (time.perf_counter() - t0)
+    report = {'frames': len(frames), 'faces': faces, 'per_face_faces_per_s': round(base, 2), 'batched': []}
+    for bs in batch_sizes:
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            for i in range(0, len(frames), bs):
+                encode_faces(frames[i:i + bs], boxes[i:i + bs])
+        fps = faces * rounds / (time.perf_counter() - t0)
+        report['batched'].append({'batch_size': bs, 'faces_per_s': round(fps, 2), 'gain': round(fps / base, 3)})
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    import glob
+    import json
+
+    parser = argparse.ArgumentParser(description='Throughput do encoding em lote')
+    parser.add_argument('images', help='diretório com JPEGs contendo rostos')
+    parser.add_argument('--batch_sizes', default='1,2,4,8,16')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    paths = sorted(glob.glob(os.path.join(args.images, '*.jp*g')))
+    sizes = [int(x) for x in args.batch_sizes.split(',') if x]
+    print(json.dumps(bench_batching(paths, sizes, args.rounds), indent=2))
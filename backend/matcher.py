@@ -0,0 +1,144 @@
+from threading import RLock
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+ENCODING_DIM = 128
+DEFAULT_THRESHOLD = 0.6  # mesma tolerância padrão do face_recognition
+UNKNOWN_LABEL = 'Desconhecido'
+
+
+class FaceMatcher:
+    """Galeria de encodings numa matriz float32 (N x 128) contígua.
+
+    A matriz é pré-alocada com folga e cresce por dobra; as normas ao quadrado
+    ficam guardadas para calcular as distâncias euclidianas de todos os rostos
+    de um frame com um único produto de matrizes.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, capacity: int = 64):
+        self.threshold = threshold
+        self._lock = RLock()
+        self._matrix = np.zeros((max(1, capacity), ENCODING_DIM), dtype=np.float32)
+        self._sq_norms = np.zeros(max(1, capacity), dtype=np.float32)
+        self._names: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    @classmethod
+    def from_dict(cls, encodings: Dict[str, Sequence[float]], threshold: float = DEFAULT_THRESHOLD):
+        m = cls(threshold=threshold, capacity=max(64, len(encodings)))
+        m.load(encodings)
+        return m
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._names)
+
+    def _reserve(self, n: int):
+        cap = self._matrix.shape[0]
+        if n <= cap:
+            return
+        while cap < n:
+            cap *= 2
+        matrix = np.zeros((cap, ENCODING_DIM), dtype=np.float32)
+        sq_norms = np.zeros(cap, dtype=np.float32)
+        size = len(self._names)
+        matrix[:size] = self._matrix[:size]
+        sq_norms[:size] = self._sq_norms[:size]
+        self._matrix, self._sq_norms = matrix, sq_norms
+
+    def load(self, encodings: Dict[str, Sequence[float]]):
+        """Substitui todo o conteúdo (usado na carga inicial)."""
+        with self._lock:
+            names = list(encodings.keys())
+            self._names = []
+            self._index = {}
+            self._reserve(len(names))
+            if names:
+                block = np.asarray([encodings[n] for n in names], dtype=np.float32)
+                self._matrix[:len(names)] = block
+                self._sq_norms[:len(names)] = np.einsum('ij,ij->i', block, block)
+            self._names = names
+            self._index = {n: i for i, n in enumerate(names)}
+
+    def load_matrix(self, names: List[str], matrix: np.ndarray):
+        """Carga direta de uma matriz (N x 128), ex.: arquivo de galeria mmap."""
+        with self._lock:
+            n = len(names)
+            self._names = []
+            self._index = {}
+            self._reserve(n)
+            if n:
+                self._matrix[:n] = matrix
+                self._sq_norms[:n] = np.einsum('ij,ij->i', self._matrix[:n], self._matrix[:n])
+            self._names = list(names)
+            self._index = {name: i for i, name in enumerate(self._names)}
+
+    def add(self, name: str, enc: Sequence[float]):
+        """Insere ou substitui uma identidade sem reconstruir a matriz."""
+        vec = np.asarray(enc, dtype=np.float32).reshape(ENCODING_DIM)
+        with self._lock:
+            row = self._index.get(name)
+            if row is None:
+                row = len(self._names)
+                self._reserve(row + 1)
+                self._names.append(name)
+                self._index[name] = row
+            self._matrix[row] = vec
+            self._sq_norms[row] = float(vec @ vec)
+
+    def remove(self, name: str) -> bool:
+        """Remove trocando a linha pela última (O(1))."""
+        with self._lock:
+            row = self._index.pop(name, None)
+            if row is None:
+                return False
+            last = len(self._names) - 1
+            if row != last:
+                moved = self._names[last]
+                self._matrix[row] = self._matrix[last]
+                self._sq_norms[row] = self._sq_norms[last]
+                self._names[row] = moved
+                self._index[moved] = row
+            self._names.pop()
+            return True
+
+    def distances(self, encs: Iterable[Sequence[float]]) -> np.ndarray:
+        """Matriz (F x N) de distâncias euclidianas entre rostos e galeria."""
+        q = np.asarray(encs, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        with self._lock:
+            n = len(self._names)
+            if n == 0 or q.shape[0] == 0:
+                return np.zeros((q.shape[0], n), dtype=np.float32)
+            g = self._matrix[:n]
+            d2 = np.einsum('ij,ij->i', q, q)[:, None] + self._sq_norms[:n][None, :] - 2.0 * (q @ g.T)
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def match(self, encs: Iterable[Sequence[float]], k: int = 1,
+              threshold: Optional[float] = None) -> List[List[Tuple[str, float]]]:
+        """Top-k (nome, distância) por rosto, só com distâncias abaixo do limiar."""
+        thr = self.threshold if threshold is None else threshold
+        with self._lock:
+            dists = self.distances(encs)
+            names = self._names
+            out: List[List[Tuple[str, float]]] = []
+            n = dists.shape[1]
+            if n == 0:
+                return [[] for _ in range(dists.shape[0])]
+            k = max(1, min(k, n))
+            if k < n:
+                top = np.argpartition(dists, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(n), (dists.shape[0], 1))
+            for i in range(dists.shape[0]):
+                row = top[i][np.argsort(dists[i, top[i]])]
+                out.append([(names[j], float(dists[i, j])) for j in row if dists[i, j] < thr])
+            return out
+
+    def labels(self, encs: Iterable[Sequence[float]], threshold: Optional[float] = None) -> List[str]:
+        """Melhor nome por rosto ou UNKNOWN_LABEL."""
+        return [m[0][0] if m else UNKNOWN_LABEL for m in self.match(encs, k=1, threshold=threshold)]
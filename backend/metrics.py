@@ -0,0 +1,224 @@
+"""Métricas em memória (histogramas, contadores e gauges) no texto do Prometheus.
+
+Cada observação custa um bisect e alguns incrementos sob um Lock; com
+METRICS=0 `observe`/`inc`/`set` retornam na hora e o /metrics fica desligado.
+Gauges que só fazem sentido na hora da coleta (profundidade de filas etc.)
+vêm de coletores registrados com `add_collector`.
+
+Os nós usam um Registry próprio e mandam `export()` no `stats` do
+`node_result`; o servidor guarda a última cópia de cada câmera
+(`load_remote`) e a publica junto com as suas.
+"""
+import os
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+ENABLED = os.environ.get('METRICS', '1') == '1'
+# segundos: de 1 ms (decode/match) a 5 s (pool lotado, MySQL travado)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+METRIC_NAME_RE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$')
+LABEL_NAME_RE = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, Any], float]  # (nome, labels, valor) vindo de um coletor
+
+
+def _key(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    esc = (lambda v: v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in items) + '}'
+
+
+def _fmt_value(v: float) -> str:
+    if v != v:
+        return 'NaN'
+    if v in (float('inf'), float('-inf')):
+        return '+Inf' if v > 0 else '-Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # último = acima do maior bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Histogram':
+        """Levanta ValueError/KeyError/TypeError se o dict não for um histograma coerente."""
+        h = cls(float(b) for b in data['buckets'])
+        if list(h.buckets) != sorted(h.buckets):
+            raise ValueError('buckets fora de ordem')
+        h.counts = [int(c) for c in data['counts']]
+        if len(h.counts) != len(h.buckets) + 1:
+            raise ValueError('counts não bate com buckets')
+        h.sum = float(data['sum'])
+        h.count = int(data['count'])
+        return h
+
+
+class Registry:
+    def __init__(self, enabled: bool = ENABLED, prefix: str = 'privateafter_'):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._lock = Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}  # nome -> (tipo, ajuda)
+        self._hist: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._collectors: List[Tuple[Callable[[], Iterable[Sample]], str]] = []
+        self._remote: Dict[str, Tuple[Labels, Dict[str, Any]]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[name] = (kind, help_text)
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, _key(labels))
+        with self._lock:
+            h = self._hist.get(key)
+            if h is None:
+                h = self._hist[key] = Histogram()
+            h.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, _key(labels))] = value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def add_collector(self, fn: Callable[[], Iterable[Sample]], kind: str = 'gauge'):
+        """`fn()` devolve (nome, labels, valor) na hora da coleta."""
+        self._collectors.append((fn, kind))
+
+    def export(self, **match) -> Dict[str, Any]:
+        """Cópia serializável (só as séries com os labels dados), para mandar pela rede."""
+        want = set(_key(match))
+
+        def sel(d):
+            return [[name, dict(labels), v] for (name, labels), v in d.items() if want <= set(labels)]
+        with self._lock:
+            return {'histograms': [[n, l, h.to_dict()] for n, l, h in sel(self._hist)],
+                    'counters': sel(self._counters), 'gauges': sel(self._gauges)}
+
+    def load_remote(self, source: str, data: Dict[str, Any], **labels):
+        """Substitui a última cópia recebida de `source` (ex.: um nó)."""
+        if self.enabled and isinstance(data, dict):
+            with self._lock:
+                self._remote[source] = (_key(labels), data)
+
+    def drop_remote(self, source: str):
+        with self._lock:
+            self._remote.pop(source, None)
+
+    def render(self) -> str:
+        """Texto de exposição do Prometheus (version 0.0.4).
+
+        Séries com nome/label fora do charset do Prometheus, ou com um tipo
+        diferente do já visto para o mesmo nome, são descartadas uma a uma
+        (contadas em `metrics_rejected_series`); nunca derrubam a coleta.
+        """
+        series: Dict[str, List[Tuple[str, Any]]] = {}  # nome -> [(tipo, (labels, valor))]
+        rejected = 0
+
+        def add(name, kind, labels, value) -> bool:
+            if not isinstance(name, str) or not METRIC_NAME_RE.match(self.prefix + name):
+                return False
+            if any(not LABEL_NAME_RE.match(k) or k.startswith('__') for k, _ in labels):
+                return False
+            if kind == 'histogram' and any(k == 'le' for k, _ in labels):
+                return False
+            got = series.setdefault(name, [])
+            if got and got[0][0] != kind:
+                return False
+            got.append((kind, (labels, value)))
+            return True
+
+        with self._lock:
+            for (name, labels), h in self._hist.items():
+                add(name, 'histogram', labels, h)
+            for (name, labels), v in self._counters.items():
+                add(name, 'counter', labels, v)
+            for (name, labels), v in self._gauges.items():
+                add(name, 'gauge', labels, v)
+            remote = list(self._remote.values())
+        for extra, data in remote:
+            for kind, key in (('histogram', 'histograms'), ('counter', 'counters'), ('gauge', 'gauges')):
+                items = data.get(key)
+                for item in items if isinstance(items, list) else []:
+                    try:
+                        name, labels, v = item
+                        value = Histogram.from_dict(v) if kind == 'histogram' else float(v)
+                        ok = add(name, kind, _key({**labels, **dict(extra)}), value)
+                    except (AttributeError, KeyError, TypeError, ValueError):
+                        ok = False
+                    rejected += not ok
+        for fn, kind in self._collectors:
+            try:
+                for name, labels, v in fn():
+                    rejected += not add(name, kind, _key(labels), v)
+            except Exception as e:
+                print("metrics collector error:", e)
+        if rejected:
+            add('metrics_rejected_series', 'gauge', (), rejected)
+
+        lines: List[str] = []
+        for name in sorted(series):
+            full = self.prefix + name
+            kind = series[name][0][0]
+            help_text = self._help.get(name, (kind, name))[1]
+            lines.append(f'# HELP {full} {help_text}')
+            lines.append(f'# TYPE {full} {kind}')
+            for _, (labels, value) in series[name]:
+                if kind != 'histogram':
+                    lines.append(f'{full}{_fmt_labels(labels)} {_fmt_value(value)}')
+                    continue
+                cumulative = 0
+                for le, c in zip(list(value.buckets) + [float('inf')], value.counts):
+                    cumulative += c
+                    lines.append(f'{full}_bucket{_fmt_labels(labels, ("le", _fmt_value(float(le))))} {cumulative}')
+                lines.append(f'{full}_sum{_fmt_labels(labels)} {_fmt_value(value.sum)}')
+                lines.append(f'{full}_count{_fmt_labels(labels)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,111 @@
+"""Portão de movimento: pula a detecção quando a cena não mudou.
+
+Compara uma cópia pequena em cinza do frame com a do último frame processado;
+se a fração de pixels alterados ficar abaixo de `motion_threshold` o frame é
+"gated" e o chamador reaproveita os últimos resultados. Um frame é processado
+de qualquer forma a cada `motion_max_skip` frames parados.
+
+O frame que passou só vira referência com `commit()`, chamado depois que o
+reconhecimento dele deu certo; se falhar, o próximo frame é comparado com a
+referência antiga e passa de novo.
+"""
+from typing import Any, Dict, Optional
+
+import cv2
+import numpy as np
+
+from stream_settings import clean
+
+SETTINGS_SCHEMA = {
+    'motion_gate': (bool, None, None),
+    'motion_threshold': (float, 0.0, 1.0),      # fração de pixels alterados
+    'motion_pixel_delta': (int, 1, 255),
+    'motion_max_skip': (int, 1, 10000),
+}
+SETTINGS_KEYS = tuple(SETTINGS_SCHEMA)
+
+GATE_WIDTH = 160
+
+
+def small_gray(frame) -> Optional[np.ndarray]:
+    """Cinza reduzido a partir de um frame BGR ou de um JPEG (decodificado já reduzido)."""
+    if isinstance(frame, (bytes, bytearray, memoryview)):
+        arr = np.frombuffer(frame, dtype=np.uint8)
+        gray = cv2.imdecode(arr, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if gray is None:
+            return None
+    else:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    h, w = gray.shape[:2]
+    if w > GATE_WIDTH:
+        gray = cv2.resize(gray, (GATE_WIDTH, max(1, int(round(h * GATE_WIDTH / float(w))))),
+                          interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(gray, (5, 5), 0)
+
+
+class MotionGate:
+    def __init__(self, motion_gate: bool = True, motion_threshold: float = 0.01,
+                 motion_pixel_delta: int = 20, motion_max_skip: int = 100):
+        self.motion_gate = motion_gate
+        self.motion_threshold = motion_threshold
+        self.motion_pixel_delta = motion_pixel_delta
+        self.motion_max_skip = motion_max_skip
+        self._ref: Optional[np.ndarray] = None
+        self._pending: Optional[np.ndarray] = None  # frame que passou, aguardando commit()
+        self._skipped = 0
+        self.last_change = 0.0
+        # métricas
+        self.gated = 0
+        self.processed = 0
+
+    @classmethod
+    def from_settings(cls, settings: Optional[Dict[str, Any]], **defaults):
+        gate = cls(**defaults)
+        gate.update_settings(settings)
+        return gate
+
+    def update_settings(self, settings: Optional[Dict[str, Any]]):
+        """Aplica só valores válidos (ver SETTINGS_SCHEMA); 'false'/'0' desligam o portão."""
+        for k, v in clean(settings, SETTINGS_SCHEMA).items():
+            setattr(self, k, v)
+
+    def settings(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in SETTINGS_KEYS}
+
+    def reset(self):
+        """Força o próximo frame a ser processado (ex.: galeria mudou)."""
+        self._ref = None
+        self._pending = None
+
+    def check(self, frame) -> bool:
+        """True se o frame deve passar pela detecção."""
+        if not self.motion_gate:
+            self.processed += 1
+            return True
+        gray = small_gray(frame)
+        if gray is None:
+            # JPEG inválido: deixa o pipeline normal tratar
+            self.processed += 1
+            return True
+        if self._ref is not None and self._ref.shape == gray.shape and self._skipped < self.motion_max_skip:
+            diff = cv2.absdiff(gray, self._ref)
+            self.last_change = float(np.count_nonzero(diff > self.motion_pixel_delta)) / diff.size
+            if self.last_change < self.motion_threshold:
+                self._skipped += 1
+                self.gated += 1
+                return False
+        self._pending = gray
+        self.processed += 1
+        return True
+
+    def commit(self):
+        """O último frame que passou foi reconhecido: vira a referência."""
+        # referência = último frame processado (mudanças lentas acumulam até passar)
+        if self._pending is not None:
+            self._ref = self._pending
+            self._pending = None
+            self._skipped = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {'gated': self.gated, 'processed': self.processed,
+                'last_change': round(self.last_change, 4), **self.settings()}
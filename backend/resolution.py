@@ -0,0 +1,137 @@
+"""Controle adaptativo da resolução de detecção por stream.
+
+A escala segue duas regras: (1) basta que o menor rosto visto fique com
+`target_face_px` de altura na imagem de detecção; (2) se a detecção passar
+do orçamento de latência a escala cai, mesmo abaixo do ideal, para o stream
+não ficar para trás. Opcionalmente a detecção roda só num recorte (ROI) em
+volta dos rostos já vistos, com um frame completo a cada `full_frame_every`.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+
+from stream_settings import clean
+
+Box = Tuple[int, int, int, int]  # (top, right, bottom, left)
+Rect = Tuple[int, int, int, int]  # (x0, y0, x1, y1)
+
+SETTINGS_SCHEMA = {
+    'latency_budget_ms': (float, 1.0, 10000.0),
+    'min_scale': (float, 0.05, 1.0),
+    'max_scale': (float, 0.05, 1.0),
+    'target_face_px': (int, 8, 2048),
+    'roi': (bool, None, None),
+    'full_frame_every': (int, 1, 1000),
+}
+SETTINGS_KEYS = tuple(SETTINGS_SCHEMA)
+
+
+class ResolutionController:
+    def __init__(self, latency_budget_ms: float = 80.0, min_scale: float = 0.25, max_scale: float = 1.0,
+                 target_face_px: int = 80, roi: bool = False, full_frame_every: int = 10,
+                 step: float = 0.05, alpha: float = 0.3):
+        self.latency_budget_ms = latency_budget_ms
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.target_face_px = target_face_px
+        self.roi = roi
+        self.full_frame_every = max(1, full_frame_every)
+        self.step = step
+        self.alpha = alpha
+        self.scale = max_scale
+        self._load_cap = max_scale       # teto imposto pela latência
+        self._latency_ms: Optional[float] = None
+        self._smallest_face: Optional[float] = None  # altura em px do frame original
+        self._faces: List[Box] = []
+        self._frames = 0
+
+    @classmethod
+    def from_settings(cls, settings: Optional[Dict[str, Any]], **defaults):
+        """Cria a partir de `cameras.settings`/`stream_settings` (chaves em SETTINGS_KEYS)."""
+        ctrl = cls(**defaults)
+        ctrl.update_settings(settings)
+        return ctrl
+
+    def update_settings(self, settings: Optional[Dict[str, Any]]):
+        """Aplica só valores válidos (ver SETTINGS_SCHEMA); os demais são ignorados."""
+        for k, v in clean(settings, SETTINGS_SCHEMA).items():
+            setattr(self, k, v)
+        self.min_scale = min(self.min_scale, self.max_scale)
+        self._load_cap = min(max(self._load_cap, self.min_scale), self.max_scale)
+        self._recompute()
+
+    def settings(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in SETTINGS_KEYS}
+
+    def _quantize(self, s: float) -> float:
+        s = round(s / self.step) * self.step
+        return float(min(self.max_scale, max(self.min_scale, s)))
+
+    def _recompute(self):
+        desired = self.max_scale
+        if self._smallest_face:
+            desired = self.target_face_px / self._smallest_face
+        self.scale = self._quantize(min(desired, self._load_cap))
+
+    def observe(self, detect_seconds: float, boxes: Sequence[Box]):
+        """Realimenta com o tempo da detecção e as caixas (coordenadas originais)."""
+        ms = detect_seconds * 1000.0
+        self._latency_ms = ms if self._latency_ms is None else (1 - self.alpha) * self._latency_ms + self.alpha * ms
+        if self._latency_ms > self.latency_budget_ms:
+            self._load_cap = max(self.min_scale, self._load_cap * 0.85)
+        elif self._latency_ms < 0.6 * self.latency_budget_ms:
+            self._load_cap = min(self.max_scale, self._load_cap * 1.1)
+        heights = [b[2] - b[0] for b in boxes if b[2] > b[0]]
+        if heights:
+            h = float(min(heights))
+            self._smallest_face = h if self._smallest_face is None else 0.7 * self._smallest_face + 0.3 * h
+        self._faces = [tuple(b) for b in boxes]
+        self._recompute()
+
+    def plan(self) -> Dict[str, Any]:
+        """Escala e ROI para o próximo frame (serializável para os workers)."""
+        self._frames += 1
+        roi = None
+        if self.roi and self._faces and self._frames % self.full_frame_every != 0:
+            roi = self._roi_rect()
+        return {'scale': self.scale, 'roi': roi}
+
+    def _roi_rect(self, margin: float = 0.6) -> Rect:
+        top = min(b[0] for b in self._faces)
+        right = max(b[1] for b in self._faces)
+        bottom = max(b[2] for b in self._faces)
+        left = min(b[3] for b in self._faces)
+        mx, my = (right - left) * margin, (bottom - top) * margin
+        # limites do frame são aplicados em apply_plan
+        return (int(max(0, left - mx)), int(max(0, top - my)), int(right + mx), int(bottom + my))
+
+    def stats(self) -> Dict[str, Any]:
+        return {'scale': self.scale, 'load_cap': round(self._load_cap, 3),
+                'detect_ms': round(self._latency_ms, 3) if self._latency_ms is not None else None,
+                'smallest_face_px': round(self._smallest_face, 1) if self._smallest_face else None,
+                **self.settings()}
+
+
+def apply_plan(frame, plan: Optional[Dict[str, Any]]):
+    """Recorta/reduz o frame; devolve (imagem, escala, (x0, y0)) para mapear de volta."""
+    x0 = y0 = 0
+    img = frame
+    if plan and plan.get('roi'):
+        h, w = frame.shape[:2]
+        x0, y0, x1, y1 = plan['roi']
+        x0, y0, x1, y1 = min(x0, w - 1), min(y0, h - 1), min(x1, w), min(y1, h)
+        img = frame[y0:y1, x0:x1]
+    scale = plan.get('scale', 1.0) if plan else 1.0
+    if scale != 1.0:
+        h, w = img.shape[:2]
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img, scale, (x0, y0)
+
+
+def to_source(boxes: Sequence[Box], scale: float, offset: Tuple[int, int] = (0, 0)) -> List[Box]:
+    """Caixas da imagem de detecção -> coordenadas do frame original."""
+    x0, y0 = offset
+    inv = 1.0 / scale
+    return [(int(t * inv) + y0, int(r * inv) + x0, int(b * inv) + y0, int(l * inv) + x0)
+            for (t, r, b, l) in boxes]
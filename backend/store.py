@@ -0,0 +1,204 @@
+"""Configuração do MySQL, schema e helpers de dados sem Flask/SocketIO.
+
+O servidor (app.py) e as ferramentas offline (bulk_import, thumbnails,
+encoding_format, ann_index, bench) importam daqui, então uma CLI não sobe o
+app, o pool de inferência nem o supervisor só para falar com o banco.
+"""
+import os
+import queue
+import re
+import secrets
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import mysql.connector
+import numpy as np
+from mysql.connector import Error
+
+from db import ConnectionPool
+from encoding_format import row_encoding
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = BASE_DIR / 'data'
+NODE_TOKEN_FILE = DATA_DIR / 'node_token'
+
+DB_CONFIG = {
+    'user': 'ari',
+    'password': 'ari',
+    'host': '127.0.0.1',
+    'port': '3307',
+    'database': 'privateafter_db'  # não usar raise_on_warnings aqui
+}
+
+
+def make_pool(size: Optional[int] = None, queue_factory: Callable = queue.Queue,
+              observer: Optional[Callable] = None) -> ConnectionPool:
+    """Pool com os limites de DB_POOL_*; no servidor passe `eventlet.queue.LightQueue`."""
+    return ConnectionPool(DB_CONFIG,
+                          size=size or int(os.environ.get('DB_POOL_SIZE', '8')),
+                          timeout=float(os.environ.get('DB_POOL_TIMEOUT', '5')),
+                          health_check_interval=float(os.environ.get('DB_POOL_HEALTHCHECK', '30')),
+                          queue_factory=queue_factory,
+                          observer=observer)
+
+
+def node_token(create: bool = False) -> Optional[str]:
+    """NODE_TOKEN do ambiente ou de data/node_token; com `create`, gera e grava (0600) se não houver.
+
+    O arquivo deixa nós iniciados à mão na mesma máquina usarem o token que o
+    servidor gerou para os supervisionados (em outra máquina: NODE_TOKEN=<conteúdo>).
+    """
+    token = os.environ.get('NODE_TOKEN')
+    if token:
+        return token
+    try:
+        token = NODE_TOKEN_FILE.read_text().strip()
+    except OSError:
+        token = ''
+    if token or not create:
+        return token or None
+    token = secrets.token_hex(16)
+    NODE_TOKEN_FILE.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(NODE_TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    return token
+
+
+def slugify_filename(name: str) -> str:
+    base = re.sub(r'[^a-zA-Z0-9._-]+', '_', name.strip())
+    return base.strip('_') or 'face'
+
+
+def ensure_schema():
+    # Conecta suprimindo warnings
+    try:
+        conn = mysql.connector.connect(**dict(DB_CONFIG, raise_on_warnings=False))
+    except Error:
+        cfg = dict(DB_CONFIG); cfg.pop('database', None)
+        cfg['raise_on_warnings'] = False
+        conn0 = mysql.connector.connect(**cfg)
+        cur0 = conn0.cursor()
+        cur0.execute("CREATE DATABASE IF NOT EXISTS privateafter_db")
+        conn0.commit(); cur0.close(); conn0.close()
+        conn = mysql.connector.connect(**dict(DB_CONFIG, raise_on_warnings=False))
+
+    cur = conn.cursor()
+    try:
+        cur.execute("SET sql_notes = 0")
+    except Exception:
+        pass
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(191) NOT NULL,
+        email VARCHAR(191) UNIQUE NOT NULL,
+        password_hash VARCHAR(255) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS encodings (
+        name VARCHAR(191) PRIMARY KEY,
+        encoding JSON NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )""")
+
+    cur.execute("SHOW COLUMNS FROM encodings LIKE 'owner_user_id'")
+    if not cur.fetchone():
+        try:
+            cur.execute("ALTER TABLE encodings ADD COLUMN owner_user_id INT NULL")
+        except Error:
+            pass
+
+    # Formato binário (float32) dos encodings; JSON antigo vira opcional
+    cur.execute("SHOW COLUMNS FROM encodings LIKE 'encoding_bin'")
+    if not cur.fetchone():
+        try:
+            cur.execute("ALTER TABLE encodings ADD COLUMN encoding_bin VARBINARY(513) NULL")
+        except Error:
+            pass
+
+    cur.execute("SHOW COLUMNS FROM encodings LIKE 'encoding'")
+    col = cur.fetchone()
+    if col and col[2] == 'NO':
+        try:
+            cur.execute("ALTER TABLE encodings MODIFY encoding JSON NULL")
+        except Error:
+            pass
+
+    cur.execute("SHOW COLUMNS FROM encodings LIKE 'photo_filename'")
+    if not cur.fetchone():
+        try:
+            cur.execute("ALTER TABLE encodings ADD COLUMN photo_filename VARCHAR(255) NULL")
+        except Error:
+            pass
+
+    # Listagem paginada (/api/faces): filtro por dono em ordem de nome e
+    # MAX(updated_at) sem varrer a tabela (resumo e refresh da galeria)
+    for index, columns in (('idx_enc_owner_name', 'owner_user_id, name'), ('idx_enc_updated', 'updated_at')):
+        cur.execute("SHOW INDEX FROM encodings WHERE Key_name = %s", (index,))
+        if not cur.fetchall():
+            try:
+                cur.execute(f"CREATE INDEX {index} ON encodings ({columns})")
+            except Error:
+                pass
+
+    # Tentar adicionar a FK (ignora se já existir)
+    try:
+        cur.execute("""ALTER TABLE encodings
+                       ADD CONSTRAINT fk_enc_user
+                       FOREIGN KEY (owner_user_id) REFERENCES users(id)
+                       ON DELETE SET NULL""")
+    except Error:
+        pass
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS cameras (
+        camera_id VARCHAR(191) PRIMARY KEY,
+        url TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )""")
+
+    # Ajustes por câmera (ex.: {"detect_every": 5}) lidos pelos nós
+    cur.execute("SHOW COLUMNS FROM cameras LIKE 'settings'")
+    if not cur.fetchone():
+        try:
+            cur.execute("ALTER TABLE cameras ADD COLUMN settings JSON NULL")
+        except Error:
+            pass
+
+    conn.commit()
+    try:
+        cur.execute("SET sql_notes = 1")
+    except Exception:
+        pass
+    cur.close(); conn.close()
+
+
+def get_user_by_id(connection: Callable, user_id: int):
+    try:
+        with connection('get_user_by_id') as conn:
+            c = conn.cursor(dictionary=True)
+            c.execute("SELECT id, name, email FROM users WHERE id=%s", (user_id,))
+            row = c.fetchone()
+            c.close()
+        return row
+    except Error as e:
+        print("get_user_by_id error:", e)
+        return None
+
+
+def load_encodings(connection: Callable) -> Dict[str, np.ndarray]:
+    encodings: Dict[str, np.ndarray] = {}
+    try:
+        with connection('load_encodings') as conn:
+            c = conn.cursor()
+            c.execute("SELECT name, encoding_bin, encoding FROM encodings")
+            for name, enc_bin, enc_json in c:
+                try:
+                    encodings[name] = row_encoding(enc_bin, enc_json)
+                except Exception:
+                    pass
+            c.close()
+    except Error as e:
+        print("load_encodings error:", e)
+    return encodings
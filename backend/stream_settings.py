@@ -0,0 +1,62 @@
+"""Validação dos ajustes por stream (`stream_settings` do navegador, `cameras.settings`).
+
+Cada chave tem tipo e faixa: números fora da faixa são presos aos limites e
+valores que não dá para interpretar são ignorados, nunca levantam exceção.
+"""
+import math
+from typing import Any, Dict, Optional, Tuple
+
+Spec = Tuple[type, Optional[float], Optional[float]]  # (tipo, mínimo, máximo)
+
+_TRUE = ('1', 'true', 'yes', 'on', 'sim')
+_FALSE = ('0', 'false', 'no', 'off', 'nao', 'não')
+
+
+def parse_bool(value: Any) -> Optional[bool]:
+    """True/False a partir de bool, número ou texto ('false' -> False); None se inválido."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    if isinstance(value, str):
+        v = value.strip().lower()
+        if v in _TRUE:
+            return True
+        if v in _FALSE:
+            return False
+    return None
+
+
+def coerce(value: Any, spec: Spec) -> Optional[Any]:
+    kind, lo, hi = spec
+    if kind is bool:
+        return parse_bool(value)
+    if isinstance(value, bool):
+        return None
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(v):
+        return None
+    if lo is not None:
+        v = max(lo, v)
+    if hi is not None:
+        v = min(hi, v)
+    if math.isinf(v):
+        return None
+    return int(round(v)) if kind is int else v
+
+
+def clean(settings: Any, schema: Dict[str, Spec]) -> Dict[str, Any]:
+    """Só as chaves do `schema` com valores válidos, já convertidos e limitados."""
+    if not isinstance(settings, dict):
+        return {}
+    out = {}
+    for k, spec in schema.items():
+        if settings.get(k) is None:
+            continue
+        v = coerce(settings[k], spec)
+        if v is not None:
+            out[k] = v
+    return out
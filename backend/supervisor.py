@@ -0,0 +1,188 @@
+"""Supervisor dos nós de processamento (um `node.py` por câmera).
+
+`set_cameras` define quais câmeras devem ter nó; `poll` (chamado
+periodicamente) inicia os que faltam até o limite de processos, reinicia os
+que caíram com backoff exponencial e mata os que não pararam no prazo.
+Não bloqueia: pode rodar numa tarefa de fundo do eventlet.
+"""
+import os
+import re
+import subprocess
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def _cpu_seconds(pid: int) -> Optional[float]:
+    """utime+stime do processo via /proc (Linux); None se indisponível."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class NodeState:
+    def __init__(self, camera_id: str, url: str):
+        self.camera_id = camera_id
+        self.url = url
+        self.started_at: Optional[float] = None
+        self.next_start = 0.0
+        self.failures = 0      # quedas seguidas (zera após rodar estável)
+        self.restarts = 0
+        self.last_exit: Optional[int] = None
+        self.stop_deadline: Optional[float] = None
+        self.cpu_percent: Optional[float] = None
+        self._cpu_mark = None  # (cpu_s, wall_s)
+
+
+class NodeSupervisor:
+    def __init__(self, command: Callable[[str, str], List[str]], max_nodes: Optional[int] = None,
+                 procs: Optional[Dict[str, subprocess.Popen]] = None, lock: Optional[Lock] = None,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0, stable_after: float = 60.0,
+                 stop_grace: float = 5.0, log_dir=None, popen=subprocess.Popen,
+                 clock: Callable[[], float] = time.monotonic):
+        # command(camera_id, url) -> argv do node.py
+        self._command = command
+        self.max_nodes = max(1, max_nodes or os.cpu_count() or 1)
+        self.procs = procs if procs is not None else {}
+        self._lock = lock if lock is not None else Lock()
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.stop_grace = stop_grace
+        self.log_dir = log_dir
+        self._popen = popen
+        self._clock = clock
+        self.nodes: Dict[str, NodeState] = {}
+        # (camera_id, proc, prazo para kill); lista porque a mesma câmera pode ter
+        # um nó antigo ainda parando enquanto o novo já subiu
+        self._stopping: List[Tuple[str, subprocess.Popen, float]] = []
+        self._closed = False  # stop_all chamado: nada mais é iniciado (nunca volta a False)
+
+    def set_cameras(self, cameras: Dict[str, str]):
+        """Câmeras que devem ter nó (camera_id -> url); as demais são paradas."""
+        with self._lock:
+            if self._closed:
+                return
+            for cid in list(self.nodes):
+                if cid not in cameras or self.nodes[cid].url != cameras[cid]:
+                    self._stop_locked(cid)
+            for cid, url in cameras.items():
+                if cid not in self.nodes:
+                    self.nodes[cid] = NodeState(cid, url)
+        self.poll()
+
+    def add(self, camera_id: str, url: str):
+        with self._lock:
+            if self._closed:
+                return
+            node = self.nodes.get(camera_id)
+            if node is not None and node.url == url:
+                return
+            if node is not None:
+                self._stop_locked(camera_id)
+            self.nodes[camera_id] = NodeState(camera_id, url)
+        self.poll()
+
+    def remove(self, camera_id: str):
+        with self._lock:
+            self._stop_locked(camera_id)
+
+    def stop_all(self):
+        """Para todos os nós de vez: depois disso set_cameras/add/poll não iniciam mais nada."""
+        with self._lock:
+            self._closed = True
+            for cid in list(self.nodes):
+                self._stop_locked(cid)
+
+    def _stop_locked(self, camera_id: str):
+        self.nodes.pop(camera_id, None)
+        proc = self.procs.pop(camera_id, None)
+        if proc is not None and proc.poll() is None:
+            proc.terminate()
+            self._stopping.append((camera_id, proc, self._clock() + self.stop_grace))
+
+    def _spawn(self, node: NodeState, now: float):
+        out = subprocess.DEVNULL
+        if self.log_dir is not None:
+            safe = re.sub(r'[^A-Za-z0-9_.-]', '_', node.camera_id)
+            out = open(os.path.join(str(self.log_dir), f'node_{safe}.log'), 'ab')
+        try:
+            self.procs[node.camera_id] = self._popen(self._command(node.camera_id, node.url),
+                                                     stdout=out, stderr=subprocess.STDOUT)
+            node.started_at = now
+            node._cpu_mark = None
+        except OSError as e:
+            print("node spawn error:", e)
+            self._schedule_restart(node, now)
+        finally:
+            if out is not subprocess.DEVNULL:
+                out.close()  # o filho já herdou o descritor
+
+    def _schedule_restart(self, node: NodeState, now: float):
+        node.failures += 1
+        node.next_start = now + min(self.backoff_max, self.backoff_base * (2 ** (node.failures - 1)))
+
+    def poll(self):
+        """Reaproveita vagas, reinicia quedas e atualiza CPU; não bloqueia."""
+        now = self._clock()
+        with self._lock:
+            still = []
+            for cid, proc, deadline in self._stopping:
+                if proc.poll() is not None:
+                    continue
+                if now >= deadline:
+                    proc.kill()
+                still.append((cid, proc, deadline))
+            self._stopping = still
+            if self._closed:
+                return
+            for cid, node in self.nodes.items():
+                proc = self.procs.get(cid)
+                if proc is None:
+                    continue
+                code = proc.poll()
+                if code is None:
+                    self._sample_cpu(node, proc.pid, now)
+                    if node.failures and now - node.started_at >= self.stable_after:
+                        node.failures = 0
+                    continue
+                # nó caiu: agenda reinício com backoff
+                del self.procs[cid]
+                node.last_exit = code
+                node.restarts += 1
+                node.cpu_percent = None
+                self._schedule_restart(node, now)
+                print(f"node {cid} saiu com código {code}; reinício em {node.next_start - now:.1f}s")
+            running = len(self.procs) + len(self._stopping)
+            for cid, node in self.nodes.items():
+                if running >= self.max_nodes:
+                    break
+                if cid not in self.procs and now >= node.next_start:
+                    self._spawn(node, now)
+                    running += 1
+
+    def _sample_cpu(self, node: NodeState, pid: int, now: float):
+        cpu = _cpu_seconds(pid)
+        if cpu is None:
+            return
+        if node._cpu_mark is not None and now > node._cpu_mark[1]:
+            node.cpu_percent = round(100.0 * (cpu - node._cpu_mark[0]) / (now - node._cpu_mark[1]), 1)
+        node._cpu_mark = (cpu, now)
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        with self._lock:
+            nodes = {}
+            for cid, node in self.nodes.items():
+                proc = self.procs.get(cid)
+                state = 'running' if proc is not None else ('backoff' if now < node.next_start else 'waiting')
+                nodes[cid] = {'state': state, 'pid': proc.pid if proc is not None else None,
+                              'uptime_s': round(now - node.started_at, 1) if proc is not None else None,
+                              'cpu_percent': node.cpu_percent, 'restarts': node.restarts,
+                              'last_exit': node.last_exit,
+                              'retry_in_s': round(node.next_start - now, 1) if state == 'backoff' else None}
+            return {'max_nodes': self.max_nodes, 'running': len(self.procs),
+                    'stopping': len(self._stopping), 'closed': self._closed, 'nodes': nodes}
@@ -0,0 +1,157 @@
+"""Fotos dos rostos com nome pelo conteúdo e miniaturas em tamanhos fixos.
+
+A foto original vira `data/faces/<slug>.<hash>.jpg` (16 hex do SHA-256) e as
+miniaturas `data/faces/thumbs/<slug>.<hash>.<tamanho>.jpg`; como o nome muda
+junto com o conteúdo, o /faces serve esses arquivos com cache imutável.
+
+Fotos antigas (`<slug>.jpg`) ganham nome com hash e miniaturas com:
+    python backend/thumbnails.py backfill
+"""
+import argparse
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+THUMB_SIZES = {'sm': 96, 'md': 256}  # lado maior, em px
+THUMB_DIR = 'thumbs'
+HASH_LEN = 16
+HASHED_RE = re.compile(r'^(?P<stem>.+\.(?P<hash>[0-9a-f]{%d}))(?:\.(?P<size>%s))?\.jpg$'
+                       % (HASH_LEN, '|'.join(THUMB_SIZES)))
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LEN]
+
+
+def parse_name(filename: str) -> Optional[Tuple[str, str, Optional[str]]]:
+    """'ana.<hash>.md.jpg' -> ('ana.<hash>', hash, 'md'); None se não tem hash."""
+    m = HASHED_RE.match(filename)
+    return (m.group('stem'), m.group('hash'), m.group('size')) if m else None
+
+
+def thumb_name(photo_filename: str, size: str) -> Optional[str]:
+    parsed = parse_name(photo_filename)
+    return f'{THUMB_DIR}/{parsed[0]}.{size}.jpg' if parsed and parsed[2] is None else None
+
+
+def thumb_urls(photo_filename: Optional[str], prefix: str = '/faces/') -> Dict[str, str]:
+    """URLs das miniaturas de uma foto com hash (vazio para fotos antigas, ainda sem backfill)."""
+    if not photo_filename:
+        return {}
+    urls = {}
+    for size in THUMB_SIZES:
+        name = thumb_name(photo_filename, size)
+        if name:
+            urls[size] = prefix + name
+    return urls
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def make_thumbnails(photo_bytes: bytes, stem: str, faces_dir: Path, quality: int = 82) -> Dict[str, str]:
+    """Gera as miniaturas que ainda não existem; devolve tamanho -> caminho relativo."""
+    out: Dict[str, str] = {}
+    thumbs_dir = faces_dir / THUMB_DIR
+    thumbs_dir.mkdir(parents=True, exist_ok=True)
+    img = None
+    for size, px in THUMB_SIZES.items():
+        rel = f'{THUMB_DIR}/{stem}.{size}.jpg'
+        out[size] = rel
+        if (faces_dir / rel).exists():
+            continue
+        if img is None:
+            img = cv2.imdecode(np.frombuffer(photo_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                raise ValueError('foto inválida')
+        scale = px / float(max(img.shape[:2]))
+        thumb = cv2.resize(img, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else img
+        ok, jpg = cv2.imencode('.jpg', thumb, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            raise ValueError('falha ao gerar miniatura')
+        _write_atomic(faces_dir / rel, jpg.tobytes())
+    return out
+
+
+def store_photo(photo_bytes: bytes, slug: str, faces_dir: Path) -> str:
+    """Grava a foto (se ainda não existe) e as miniaturas; devolve o nome com hash."""
+    faces_dir.mkdir(parents=True, exist_ok=True)
+    stem = f'{slug}.{content_hash(photo_bytes)}'
+    filename = f'{stem}.jpg'
+    if not (faces_dir / filename).exists():
+        _write_atomic(faces_dir / filename, photo_bytes)
+    make_thumbnails(photo_bytes, stem, faces_dir)
+    return filename
+
+
+def remove_photo(photo_filename: str, faces_dir: Path):
+    """Apaga a foto e as miniaturas dela."""
+    paths = [faces_dir / photo_filename]
+    paths += [faces_dir / n for n in (thumb_name(photo_filename, s) for s in THUMB_SIZES) if n]
+    for path in paths:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def backfill(connection: Callable, faces_dir: Path) -> Dict[str, int]:
+    """Renomeia fotos antigas para o nome com hash e gera miniaturas que faltam."""
+    stats = {'photos': 0, 'renamed': 0, 'thumbnails': 0, 'missing': 0, 'errors': 0}
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name, photo_filename FROM encodings WHERE photo_filename IS NOT NULL")
+        rows = cur.fetchall()
+        cur.close()
+    for name, filename in rows:
+        stats['photos'] += 1
+        path = faces_dir / filename
+        if not path.exists():
+            stats['missing'] += 1
+            continue
+        try:
+            data = path.read_bytes()
+            parsed = parse_name(filename)
+            if parsed is None:
+                new_name = store_photo(data, Path(filename).stem, faces_dir)
+                with connection() as conn:
+                    cur = conn.cursor()
+                    cur.execute("UPDATE encodings SET photo_filename = %s WHERE name = %s AND photo_filename = %s",
+                                (new_name, name, filename))
+                    conn.commit()
+                    cur.close()
+                path.unlink()
+                stats['renamed'] += 1
+            else:
+                missing = [s for s in THUMB_SIZES if not (faces_dir / thumb_name(filename, s)).exists()]
+                if missing:
+                    make_thumbnails(data, parsed[0], faces_dir)
+                    stats['thumbnails'] += len(missing)
+        except (OSError, ValueError) as e:
+            stats['errors'] += 1
+            print(f"backfill error ({filename}):", e)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['backfill'])
+    args = parser.parse_args()
+
+    from store import DATA_DIR, ensure_schema, make_pool
+    ensure_schema()
+    db_pool = make_pool(size=2)
+    if args.command == 'backfill':
+        print(backfill(db_pool.connection, DATA_DIR / 'faces'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""Modo detectar-e-rastrear: HOG só a cada N frames, fluxo óptico entre eles.
+
+Cada trilha guarda a identidade já atribuída; encoding/matching só rodam
+de novo para trilhas novas ou cuja confiança decaiu abaixo do mínimo.
+
+Comparação com "detectar sempre" (fps e concordância de caixas/nomes):
+    python backend/tracking.py video.mp4 --detect_every 1,3,5,10 [--gallery_file data/gallery.bin]
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from matcher import UNKNOWN_LABEL
+
+Box = Tuple[int, int, int, int]  # (top, right, bottom, left), como no face_recognition
+
+FLOW_WIDTH = 320  # fluxo óptico roda numa cópia reduzida (estado pequeno para serializar)
+
+
+def iou(a: Box, b: Box) -> float:
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    __slots__ = ('id', 'box', 'name', 'distance', 'confidence', 'age')
+
+    def __init__(self, track_id: int, box: Box):
+        self.id = track_id
+        self.box = box
+        self.name: Optional[str] = None
+        self.distance: Optional[float] = None
+        self.confidence = 0.0
+        self.age = 0
+
+
+class FaceTracker:
+    """Estado de rastreamento de um stream (uma câmera ou sessão)."""
+
+    def __init__(self, detect_every: int = 5, confidence_decay: float = 0.95,
+                 min_confidence: float = 0.6, iou_threshold: float = 0.3):
+        self.detect_every = max(1, int(detect_every))
+        self.confidence_decay = confidence_decay
+        self.min_confidence = min_confidence
+        self.iou_threshold = iou_threshold
+        self.tracks: List[Track] = []
+        self.frame_index = 0
+        self._next_id = 1
+        self._prev: Optional[np.ndarray] = None
+        self._prev_scale = 1.0
+        self._lost_since_detection = False
+        # métricas
+        self.detected_frames = 0
+        self.tracked_frames = 0
+        self.encodes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.detect_every > 1
+
+    def needs_detection(self) -> bool:
+        if not self.enabled or self._prev is None or self._lost_since_detection:
+            return True
+        return self.frame_index % self.detect_every == 0
+
+    def _prep(self, gray: np.ndarray) -> Tuple[np.ndarray, float]:
+        h, w = gray.shape[:2]
+        if w <= FLOW_WIDTH:
+            return gray, 1.0
+        scale = FLOW_WIDTH / float(w)
+        return cv2.resize(gray, (FLOW_WIDTH, int(round(h * scale))), interpolation=cv2.INTER_AREA), scale
+
+    def _advance(self, small: np.ndarray, scale: float):
+        self._prev, self._prev_scale = small, scale
+        self.frame_index += 1
+
+    def propagate(self, gray: np.ndarray) -> bool:
+        """Move as caixas pelo fluxo óptico; retorna False se alguma trilha se perdeu."""
+        small, scale = self._prep(gray)
+        self.tracked_frames += 1
+        if not self.tracks or self._prev is None or self._prev.shape != small.shape:
+            self._advance(small, scale)
+            return True
+        pts_all, owners = [], []
+        for i, t in enumerate(self.tracks):
+            top, right, bottom, left = [int(v * scale) for v in t.box]
+            mask = np.zeros_like(self._prev)
+            mask[max(0, top):max(0, bottom), max(0, left):max(0, right)] = 255
+            pts = cv2.goodFeaturesToTrack(self._prev, maxCorners=30, qualityLevel=0.01, minDistance=3, mask=mask)
+            if pts is not None:
+                pts_all.append(pts.reshape(-1, 2))
+                owners.extend([i] * len(pts))
+        alive: List[Track] = []
+        if pts_all:
+            p0 = np.concatenate(pts_all).astype(np.float32).reshape(-1, 1, 2)
+            p1, status, _ = cv2.calcOpticalFlowPyrLK(self._prev, small, p0, None, winSize=(15, 15), maxLevel=2)
+            owners_arr = np.asarray(owners)
+            ok = status.reshape(-1) == 1
+            p0, p1 = p0.reshape(-1, 2), p1.reshape(-1, 2)
+            h, w = gray.shape[:2]
+            for i, t in enumerate(self.tracks):
+                sel = ok & (owners_arr == i)
+                if sel.sum() < 4:
+                    continue
+                a, b = p0[sel], p1[sel]
+                dx, dy = np.median(b - a, axis=0) / scale
+                spread_a = np.median(np.abs(a - np.median(a, axis=0)))
+                spread_b = np.median(np.abs(b - np.median(b, axis=0)))
+                s = float(np.clip(spread_b / spread_a, 0.8, 1.25)) if spread_a > 0 else 1.0
+                top, right, bottom, left = t.box
+                cx, cy = (left + right) / 2.0 + dx, (top + bottom) / 2.0 + dy
+                hw, hh = (right - left) * s / 2.0, (bottom - top) * s / 2.0
+                t.box = (int(max(0, cy - hh)), int(min(w, cx + hw)), int(min(h, cy + hh)), int(max(0, cx - hw)))
+                if t.box[1] - t.box[3] < 8 or t.box[2] - t.box[0] < 8:
+                    continue
+                t.confidence *= self.confidence_decay
+                t.age += 1
+                alive.append(t)
+        lost = len(alive) < len(self.tracks)
+        self.tracks = alive
+        self._lost_since_detection = self._lost_since_detection or lost
+        self._advance(small, scale)
+        return not lost
+
+    def update(self, gray: np.ndarray, boxes: Sequence[Box]) -> List[Track]:
+        """Associa detecções às trilhas; retorna as trilhas que precisam de encoding."""
+        small, scale = self._prep(gray)
+        self.detected_frames += 1
+        pending: List[Track] = []
+        unmatched = list(self.tracks)
+        matched: List[Track] = []
+        for box in boxes:
+            box = tuple(int(v) for v in box)
+            best, best_iou = None, self.iou_threshold
+            for t in unmatched:
+                v = iou(t.box, box)
+                if v >= best_iou:
+                    best, best_iou = t, v
+            if best is None:
+                best = Track(self._next_id, box)
+                self._next_id += 1
+            else:
+                unmatched.remove(best)
+                best.box = box
+            matched.append(best)
+            if best.name is None or best.confidence < self.min_confidence:
+                pending.append(best)
+        self.tracks = matched
+        self._lost_since_detection = False
+        self.encodes += len(pending)
+        self._advance(small, scale)
+        return pending
+
+    def assign(self, track_id: int, name: Optional[str], distance: Optional[float] = None):
+        for t in self.tracks:
+            if t.id == track_id:
+                t.name, t.distance, t.confidence = name, distance, 1.0
+                return
+
+    def results(self, scale: float = 1.0) -> List[Dict[str, Any]]:
+        """Caixas no formato do protocolo ([x, y, w, h]); `scale` volta ao frame original."""
+        out = []
+        for t in self.tracks:
+            top, right, bottom, left = t.box
+            out.append({'name': t.name or UNKNOWN_LABEL,
+                        'box': [int(left * scale), int(top * scale),
+                                int((right - left) * scale), int((bottom - top) * scale)],
+                        'track_id': t.id})
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {'detect_every': self.detect_every, 'tracks': len(self.tracks),
+                'detected_frames': self.detected_frames, 'tracked_frames': self.tracked_frames,
+                'encodes': self.encodes}
+
+
+def evaluate(video_path: str, detect_every_values: Sequence[int], max_frames: int = 300,
+             matcher=None) -> Dict[str, Any]:
+    """fps e concordância com o modo "detectar sempre" no mesmo vídeo."""
+    import face_recognition
+
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < max_frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+
+    def label(encs):
+        if matcher is None or not encs:
+            return [UNKNOWN_LABEL] * len(encs)
+        return matcher.labels(encs)
+
+    def run(detect_every):
+        tracker = FaceTracker(detect_every=detect_every)
+        per_frame = []
+        t0 = time.perf_counter()
+        for frame in frames:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if tracker.needs_detection():
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                pending = tracker.update(gray, face_recognition.face_locations(rgb, model='hog'))
+                if pending:
+                    encs = face_recognition.face_encodings(rgb, [t.box for t in pending])
+                    for t, name in zip(pending, label(encs)):
+                        tracker.assign(t.id, name)
+            else:
+                tracker.propagate(gray)
+            per_frame.append([(t.box, t.name or UNKNOWN_LABEL) for t in tracker.tracks])
+        return per_frame, len(frames) / max(1e-9, time.perf_counter() - t0)
+
+    baseline, base_fps = run(1)
+    report = {'frames': len(frames), 'always_detect_fps': round(base_fps, 2), 'modes': []}
+    for n in detect_every_values:
+        if n <= 1:
+            continue
+        tracked, fps = run(n)
+        total = hit = same = 0
+        for ref, got in zip(baseline, tracked):
+            for box, name in ref:
+                total += 1
+                best = max(got, key=lambda g: iou(box, g[0]), default=None)
+                if best is not None and iou(box, best[0]) >= 0.5:
+                    hit += 1
+                    same += int(best[1] == name)
+        report['modes'].append({'detect_every': n, 'fps': round(fps, 2),
+                                'speedup': round(fps / base_fps, 2) if base_fps else None,
+                                'box_recall': round(hit / total, 4) if total else None,
+                                'label_agreement': round(same / hit, 4) if hit else None})
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('video')
+    parser.add_argument('--detect_every', default='1,3,5,10')
+    parser.add_argument('--max_frames', type=int, default=300)
+    parser.add_argument('--gallery_file', default=None)
+    args = parser.parse_args()
+    matcher = None
+    if args.gallery_file:
+        from encoding_format import load_gallery_file
+        from matcher import FaceMatcher
+        names, matrix = load_gallery_file(args.gallery_file)
+        matcher = FaceMatcher(capacity=max(64, len(names)))
+        matcher.load_matrix(names, matrix)
+    values = [int(x) for x in args.detect_every.split(',') if x]
+    print(json.dumps(evaluate(args.video, values, args.max_frames, matcher), indent=2))
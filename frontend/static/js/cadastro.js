@@ -34,14 +34,17 @@ function stopLocalCamera() {
   }
 }
 
-function drawFrameToCanvas() {
+async function drawFrameToCanvas() {
   if (!hiddenCanvas.width || !hiddenCanvas.height) {
     hiddenCanvas.width = preview.videoWidth;
     hiddenCanvas.height = preview.videoHeight;
   }
   const ctx = hiddenCanvas.getContext('2d');
   ctx.drawImage(preview, 0, 0, hiddenCanvas.width, hiddenCanvas.height);
-  return hiddenCanvas.toDataURL('image/jpeg', 0.8);
+  // JPEG binário (ArrayBuffer); data URL só se toBlob não existir
+  if (!hiddenCanvas.toBlob) return hiddenCanvas.toDataURL('image/jpeg', 0.8);
+  const blob = await new Promise(r => hiddenCanvas.toBlob(r, 'image/jpeg', 0.8));
+  return blob ? blob.arrayBuffer() : hiddenCanvas.toDataURL('image/jpeg', 0.8);
 }
 
 captureBtn.addEventListener('click', async () => {
@@ -50,7 +53,7 @@ captureBtn.addEventListener('click', async () => {
 
   const samples = [];
   for (let i = 0; i < 5; i++) {
-    samples.push(drawFrameToCanvas());
+    samples.push(await drawFrameToCanvas());
     await new Promise(r => setTimeout(r, 200));
   }
   socket.emit('submit_face_samples', { name, samples });
@@ -63,7 +66,17 @@ saveIpCamBtn.addEventListener('click', () => {
   socket.emit('register_camera', { camera_id: lastIpCamId, url });
 });
 
+// Cadastro roda em segundo plano no servidor: progresso amostra a amostra
+const captureLabel = captureBtn.textContent;
+socket.on('enrollment_progress', (p) => {
+  const running = p.status !== 'done' && p.status !== 'failed';
+  captureBtn.disabled = running;
+  captureBtn.textContent = running ? `Processando ${p.done}/${p.total}...` : captureLabel;
+});
+
 socket.on('submit_result', (data) => {
+  captureBtn.disabled = false;
+  captureBtn.textContent = captureLabel;
   alert(data.msg || (data.ok ? 'Sucesso.' : 'Falha.'));
 });
 
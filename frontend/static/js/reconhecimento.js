@@ -1,25 +1,13 @@
-const socket = io();
-
-const mainVideo = document.getElementById('mainVideo');
-const mainOverlay = document.getElementById('mainOverlay');
+// Grade multicâmera: usa o socket criado pelo script da página (reconhecimento.html),
+// que chama initMultiCam(socket) logo depois de criá-lo. O envio dos frames da
+// câmera principal e o frame_ack ficam só com o script da página.
+(function () {
 const grid = document.getElementById('grid');
 const multiCamToggle = document.getElementById('multiCamToggle');
+const activeCamerasEl = document.getElementById('activeCameras');
 
-let localStream;
-const cameraFeeds = new Map(); // camera_id -> { video, canvas, ctx }
-const hidden = document.createElement('canvas');
-let sendTimer;
-
-async function startMainCamera() {
-  try {
-    localStream = await navigator.mediaDevices.getUserMedia({ video: true, audio: false });
-    mainVideo.srcObject = localStream;
-    fitOverlayToVideo(mainVideo, mainOverlay);
-  } catch (e) {
-    console.error(e);
-    alert('Erro ao acessar a webcam: ' + e.message);
-  }
-}
+let socket = null;
+const cameraFeeds = new Map(); // camera_id -> { video, canvas, last }
 
 function fitOverlayToVideo(videoEl, canvasEl) {
   function resize() {
@@ -92,57 +80,94 @@ function ensureGridCamera(cameraId) {
   wrap.appendChild(canvas);
 
   grid.appendChild(wrap);
+  grid.classList.remove('hidden');
   fitOverlayToVideo(video, canvas);
-  const obj = { video, canvas };
+  const obj = { video, canvas, last: null }; // last: último frame decodificado
   cameraFeeds.set(cameraId, obj);
+  updateActiveCameras();
   return obj;
 }
 
-multiCamToggle.addEventListener('change', () => {
-  if (multiCamToggle.checked) {
-    socket.emit('enable_multicam', {});
-  } else {
-    socket.emit('disable_multicam', {});
-    cameraFeeds.clear();
-    grid.innerHTML = '';
-  }
-});
-
-socket.on('recognition_update', (data) => {
-  const { camera_id, results, frame_b64, frame_w, frame_h } = data;
-  if (!camera_id) return;
-  if (camera_id === 'main') {
-    drawBoxes(mainOverlay, results || [], frame_w, frame_h);
-    return;
-  }
-  const { video, canvas } = ensureGridCamera(camera_id);
-  if (frame_b64) {
+function multiCamEnabled() {
+  return !multiCamToggle || multiCamToggle.checked;
+}
+
+function clearGrid() {
+  cameraFeeds.forEach((feed) => setLastFrame(feed, null));
+  cameraFeeds.clear();
+  grid.innerHTML = '';
+  grid.classList.add('hidden');
+  updateActiveCameras();
+}
+
+function updateActiveCameras() {
+  if (activeCamerasEl) activeCamerasEl.textContent = 1 + cameraFeeds.size;
+}
+
+// a inscrição vale por conexão: refeita a cada (re)connect
+function subscribe() {
+  if (socket && socket.connected && multiCamEnabled()) socket.emit('enable_multicam', {});
+}
+
+if (multiCamToggle) {
+  multiCamToggle.addEventListener('change', () => {
+    if (!socket) return;
+    if (multiCamToggle.checked) {
+      subscribe();
+    } else {
+      socket.emit('disable_multicam', {});
+      clearGrid();
+    }
+  });
+}
+
+function drawFrame(canvas, source, results) {
+  const ctx = canvas.getContext('2d');
+  canvas.width = source.width; canvas.height = source.height;
+  ctx.drawImage(source, 0, 0);
+  drawBoxes(canvas, results || [], source.width, source.height);
+}
+
+function setLastFrame(feed, source) {
+  if (feed.last && feed.last.close) feed.last.close();
+  feed.last = source;
+}
+
+function onRecognitionUpdate(data, ack) {
+  const { camera_id, results, frame, frame_b64 } = data || {};
+  // a câmera principal é desenhada pelo script da página
+  if (!camera_id || camera_id === 'main') { if (ack) ack(); return; }
+  if (!multiCamEnabled()) { if (ack) ack(); return; }
+  const feed = ensureGridCamera(camera_id);
+  const { canvas } = feed;
+  // ack após desenhar: o servidor só manda a próxima atualização (a mais nova) depois dele
+  const done = () => { if (ack) ack(); };
+  if (frame) {
+    // JPEG binário: decodifica direto do ArrayBuffer recebido
+    createImageBitmap(new Blob([frame], { type: 'image/jpeg' }))
+      .then((bmp) => { drawFrame(canvas, bmp, results); setLastFrame(feed, bmp); })
+      .catch((e) => console.error('Erro ao decodificar frame:', e))
+      .finally(done);
+  } else if (frame_b64) {
     const img = new Image();
-    img.onload = () => {
-      const ctx = canvas.getContext('2d');
-      canvas.width = img.width; canvas.height = img.height;
-      ctx.drawImage(img, 0, 0);
-      drawBoxes(canvas, results || [], img.width, img.height);
-    };
+    img.onload = () => { drawFrame(canvas, img, results); setLastFrame(feed, img); done(); };
+    img.onerror = done;
     img.src = frame_b64;
+  } else if (feed.last) {
+    // miniatura limitada por taxa: redesenha o último frame com as caixas novas
+    drawFrame(canvas, feed.last, results);
+    done();
   } else {
     drawBoxes(canvas, results || []); // sem frame, assume 1:1
+    done();
   }
-});
-
-startMainCamera();
-
-function captureAndSend() {
-  if (!mainVideo.videoWidth) return;
-  if (!hidden.width || !hidden.height) {
-    hidden.width = mainVideo.videoWidth;
-    hidden.height = mainVideo.videoHeight;
-  }
-  const ctx = hidden.getContext('2d');
-  ctx.drawImage(mainVideo, 0, 0, hidden.width, hidden.height);
-  const dataURL = hidden.toDataURL('image/jpeg', 0.6);
-  socket.emit('client_frame', { dataURL });
 }
 
-// Envie frames do main a cada ~150ms
-sendTimer = setInterval(captureAndSend, 150);
+window.initMultiCam = function (pageSocket) {
+  socket = pageSocket;
+  socket.on('connect', subscribe);
+  socket.on('disconnect', clearGrid);
+  socket.on('recognition_update', onRecognitionUpdate);
+  subscribe();
+};
+})();
@@ -5,6 +5,7 @@ import os
 import sys
 import time
 from pathlib import Path
+from threading import Lock
 
 import cv2
 import numpy as np
@@ -12,115 +13,424 @@ import socketio
 import face_recognition
 
 BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_DIR = BASE_DIR / 'data'
-ENCODINGS_FILE = DATA_DIR / 'encodings.pkl'
 
-import mysql.connector
+# Módulos compartilhados com o servidor (matcher etc.)
+sys.path.insert(0, str(BASE_DIR / 'backend'))
+from detectors import CALIBRATION_CANDIDATES, calibrate, normalize_spec
+from encoding_format import load_gallery_file, row_encoding
+from gallery_sync import GalleryReplica
+from inference import InferencePool, init_engine, recognize_batch, recognize_tracked
+from matcher import DEFAULT_THRESHOLD, FaceMatcher, UNKNOWN_LABEL
+from metrics import registry as metrics
+from motion import MotionGate
+from resolution import ResolutionController, apply_plan, to_source
+from store import make_pool, node_token
+from tracking import FaceTracker
+
+from pipeline import NodePipeline
+
 from mysql.connector import Error
-import json
 
-DB_CONFIG = {
-    'user': 'ari',
-    'password': 'ari',
-    'host': 'localhost',
-    'port': '3307',  # Porta mapeada no docker-compose.yml
-    'database': 'privateafter_db',
-    'raise_on_warnings': True
-}
+# mesma configuração do servidor (store.DB_CONFIG)
+db_pool = make_pool(size=2)
 
 sio = socketio.Client()
 
+# Galeria local mantida em dia pelos deltas do servidor (criada em main)
+gallery_replica: GalleryReplica | None = None
+# NODE_TOKEN do ambiente ou o data/node_token gerado pelo servidor nesta máquina
+NODE_TOKEN = node_token()
+
+def request_gallery_sync():
+    sio.emit('gallery_sync', {**gallery_replica.sync_request(), 'token': NODE_TOKEN})
+
 def load_known():
     known = {}
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, encoding FROM encodings")
-        for name, enc_json in cursor:
-            known[name] = json.loads(enc_json)
-        cursor.close()
-        conn.close()
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name, encoding_bin, encoding FROM encodings")
+            for name, enc_bin, enc_json in cursor:
+                try:
+                    known[name] = row_encoding(enc_bin, enc_json)
+                except Exception:
+                    continue
+            cursor.close()
     except Error as e:
         print(f"Erro ao carregar known: {e}")
     return known
 
+def load_camera_settings(camera_id: str) -> dict:
+    """Ajustes da câmera gravados na coluna `cameras.settings` (JSON)."""
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT settings FROM cameras WHERE camera_id = %s", (camera_id,))
+            row = cursor.fetchone()
+            cursor.close()
+        if row and row[0]:
+            return json.loads(row[0])
+    except (Error, ValueError) as e:
+        print(f"Erro ao carregar ajustes da câmera: {e}")
+    return {}
+
+def save_camera_detector(camera_id: str, spec: str):
+    """Grava o detector escolhido na calibração em `cameras.settings`."""
+    settings = {**load_camera_settings(camera_id), 'detector': spec}
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE cameras SET settings = %s WHERE camera_id = %s",
+                           (json.dumps(settings), camera_id))
+            conn.commit()
+            cursor.close()
+    except Error as e:
+        print(f"Erro ao salvar detector da câmera: {e}")
+
+def observe_stage(camera_id: str, stage: str, seconds):
+    if seconds is not None:
+        metrics.observe('node_stage_seconds', seconds, camera_id=camera_id, stage=stage)
+
+def detect(frame, cam: 'CameraStream'):
+    """Detecção na escala/ROI escolhidas pelo controlador; devolve (rgb, caixas locais, escala, offset)."""
+    img, scale, offset = apply_plan(frame, cam.resolution.plan())
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    t0 = time.perf_counter()
+    boxes = init_engine().detector(cam.detector).detect(img, rgb)
+    detect_s = time.perf_counter() - t0
+    cam.resolution.observe(detect_s, to_source(boxes, scale, offset))
+    observe_stage(cam.camera_id, 'detect', detect_s)
+    return rgb, boxes, scale, offset
+
+def encode_and_match(cam: 'CameraStream', matcher: FaceMatcher, rgb, boxes):
+    t0 = time.perf_counter()
+    encs = face_recognition.face_encodings(rgb, boxes)
+    t1 = time.perf_counter()
+    matches = matcher.match(encs, k=1) if encs else []
+    observe_stage(cam.camera_id, 'encode', t1 - t0)
+    observe_stage(cam.camera_id, 'match', time.perf_counter() - t1)
+    return matches
+
+def recognize(frame, matcher: FaceMatcher, cam: 'CameraStream'):
+    """Detecta/rastreia e identifica; caixas voltam nas coordenadas do frame original."""
+    tracker = cam.tracker
+    if tracker.enabled:
+        # rastreador trabalha no frame original (reduz internamente para o fluxo óptico)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if tracker.needs_detection():
+            _, boxes, scale, offset = detect(frame, cam)
+            pending = tracker.update(gray, to_source(boxes, scale, offset))
+            if pending:
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                for t, m in zip(pending, encode_and_match(cam, matcher, rgb, [t.box for t in pending])):
+                    tracker.assign(t.id, m[0][0] if m else UNKNOWN_LABEL, m[0][1] if m else None)
+        else:
+            tracker.propagate(gray)
+        return tracker.results()
+
+    rgb, boxes, scale, offset = detect(frame, cam)
+    results = []
+    boxes = to_source(boxes, scale, offset)
+    if boxes and (scale != 1.0 or offset != (0, 0)):
+        # encoding no frame original: a escala reduzida só serve para achar os rostos
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    matches = encode_and_match(cam, matcher, rgb, boxes) if boxes else []
+    for box, m in zip(boxes, matches):
+        name = m[0][0] if m else UNKNOWN_LABEL
+        top, right, bottom, left = box
+        results.append({'name': name, 'box': [left, top, right - left, bottom - top]})
+    return results
+
 @sio.event
 def connect():
     print('Node connected to server')
+    # (re)conexão: pede só o que mudou desde a última versão aplicada
+    if gallery_replica is not None:
+        request_gallery_sync()
+
+@sio.on('gallery_delta')
+def on_gallery_delta(msg):
+    if gallery_replica is None:
+        return
+    if not gallery_replica.apply(msg):
+        request_gallery_sync()
+    elif msg.get('full'):
+        print('gallery synced:', json.dumps(gallery_replica.stats()))
 
 @sio.event
 def disconnect():
     print('Node disconnected from server')
 
+def recognize_in_pool(pool: InferencePool, cam: 'CameraStream', frame, matcher: FaceMatcher):
+    """Como `recognize`, mas detecção/encoding num processo do pool; o matching
+    fica aqui, na única matriz da galeria do nó."""
+    plan = {**cam.resolution.plan(), 'detector': cam.detector}
+    if cam.tracker.enabled:
+        out = pool.run(recognize_tracked, frame, cam.tracker, plan)
+        if out is None or out[0] is None:
+            return None
+        out, cam.tracker = out
+        for stage in ('decode', 'detect', 'encode'):
+            observe_stage(cam.camera_id, stage, out.get(f'{stage}_s'))
+        if out['detect_s'] is not None:
+            cam.resolution.observe(out['detect_s'], out['boxes'])
+        if out['pending']:
+            t0 = time.perf_counter()
+            matches = matcher.match(out['encodings'], k=1)
+            observe_stage(cam.camera_id, 'match', time.perf_counter() - t0)
+            for track_id, m in zip(out['pending'], matches):
+                cam.tracker.assign(track_id, m[0][0] if m else UNKNOWN_LABEL, m[0][1] if m else None)
+        return cam.tracker.results()
+    out = pool.run(recognize_batch, [(frame, plan)])
+    if out is None or out[0] is None:
+        return None
+    out = out[0]
+    for stage in ('decode', 'detect', 'encode'):
+        observe_stage(cam.camera_id, stage, out.get(f'{stage}_s'))
+    cam.resolution.observe(out['detect_s'], out['boxes'])
+    t0 = time.perf_counter()
+    matches = matcher.match(out['encodings'], k=1) if out['encodings'] else []
+    observe_stage(cam.camera_id, 'match', time.perf_counter() - t0)
+    results = []
+    for i, (top, right, bottom, left) in enumerate(out['boxes']):
+        m = matches[i] if i < len(matches) else None
+        results.append({'name': m[0][0] if m else UNKNOWN_LABEL, 'box': [left, top, right - left, bottom - top]})
+    return results
+
+class CameraStream:
+    """Estado por câmera: rastreador, resolução, portão de movimento e últimos resultados."""
+
+    def __init__(self, camera_id: str, url: str | None, args):
+        self.camera_id = camera_id
+        self.url = url
+        settings = load_camera_settings(camera_id)
+        self.tracker = FaceTracker(detect_every=args.detect_every or int(settings.get('detect_every', 1)))
+        # cameras.settings como base; CLI tem precedência
+        overrides = {'latency_budget_ms': args.latency_budget_ms, 'roi': True if args.roi else None}
+        if args.scale:
+            overrides['min_scale'] = overrides['max_scale'] = args.scale
+        self.resolution = ResolutionController.from_settings(
+            {**settings, **{k: v for k, v in overrides.items() if v is not None}})
+        try:
+            self.detector = normalize_spec(args.detector or settings.get('detector'))
+        except ValueError as e:
+            print(f'{camera_id}: {e}; usando o detector padrão')
+            self.detector = normalize_spec(None)
+        self.gate = MotionGate.from_settings(settings)
+        if args.motion_threshold is not None:
+            self.gate.update_settings({'motion_threshold': args.motion_threshold})
+        if args.no_motion_gate:
+            self.gate.motion_gate = False
+        self.lock = Lock()
+        self.results = []
+        self.stats_at = 0.0
+
+def load_cameras() -> dict:
+    cams = {}
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT camera_id, url FROM cameras")
+            for cid, url in cursor:
+                cams[cid] = url
+            cursor.close()
+    except Error as e:
+        print(f"Erro ao carregar câmeras: {e}")
+    return cams
+
 def open_capture(camera_url: str | None):
     if camera_url:
-        return cv2.VideoCapture(camera_url)
+        # "0", "1"...: índice de webcam local
+        return cv2.VideoCapture(int(camera_url) if camera_url.isdigit() else camera_url)
     # default webcam
     return cv2.VideoCapture(0)
 
+def calibrate_camera(cam: CameraStream, n_frames: int, recall_target: float, step: int = 5) -> dict:
+    """Mede os detectores em `n_frames` frames da câmera (um a cada `step`, para variar a cena)."""
+    cap = open_capture(cam.url)
+    frames, read = [], 0
+    while cap.isOpened() and len(frames) < n_frames and read < n_frames * step * 4:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        read += 1
+        if read % step == 0:
+            frames.append(frame)
+    cap.release()
+    if not frames:
+        return {'camera_id': cam.camera_id, 'error': 'sem frames'}
+    report = calibrate(frames, CALIBRATION_CANDIDATES, recall_target=recall_target,
+                       detectors=init_engine().detectors)
+    return {'camera_id': cam.camera_id, **report}
+
 def main():
+    global gallery_replica
     parser = argparse.ArgumentParser()
-    parser.add_argument('--camera_id', required=True)
+    parser.add_argument('--camera_id', default=None)
     parser.add_argument('--camera_url', default=None)
+    parser.add_argument('--cameras', default=None,
+                        help='várias câmeras num processo: ids separados por vírgula (urls da tabela cameras)')
+    parser.add_argument('--all_cameras', action='store_true',
+                        help='processa todas as câmeras da tabela cameras')
     parser.add_argument('--server_url', default='http://localhost:5000')
     parser.add_argument('--send_frame', action='store_true')
+    parser.add_argument('--frame_format', choices=['binary', 'dataurl'], default='binary',
+                        help='binary: JPEG como anexo do Socket.IO; dataurl: frame_b64 (compatibilidade)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--gallery_file', default=None,
+                        help='arquivo gerado por encoding_format.py export (evita ler o MySQL)')
+    parser.add_argument('--detect_every', type=int, default=None,
+                        help='HOG a cada N frames, rastreando entre eles (1 = sempre detectar); '
+                             'padrão: cameras.settings.detect_every')
+    parser.add_argument('--detector', default=None,
+                        help='hog (1 upsample), hog:0, haar ou dnn[:confiança]; padrão: cameras.settings.detector')
+    parser.add_argument('--calibrate', type=int, default=0, metavar='N',
+                        help='mede os detectores em N frames de cada câmera, imprime o relatório e sai')
+    parser.add_argument('--recall_target', type=float, default=0.9,
+                        help='recall mínimo (contra hog) para a calibração escolher um detector mais rápido')
+    parser.add_argument('--save_detector', action='store_true',
+                        help='com --calibrate: grava o detector escolhido em cameras.settings')
+    parser.add_argument('--latency_budget_ms', type=float, default=None,
+                        help='orçamento da detecção; a escala cai quando é excedido')
+    parser.add_argument('--scale', type=float, default=None,
+                        help='escala fixa de detecção (desliga o ajuste adaptativo)')
+    parser.add_argument('--roi', action='store_true',
+                        help='detecta só em volta dos rostos já vistos (frame inteiro periodicamente)')
+    parser.add_argument('--motion_threshold', type=float, default=None,
+                        help='fração de pixels alterados para rodar a detecção; padrão: cameras.settings ou 0.01')
+    parser.add_argument('--no_motion_gate', action='store_true',
+                        help='processa todos os frames mesmo sem movimento')
+    parser.add_argument('--fps', type=float, default=10.0, help='fps alvo da inferência (por câmera)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='threads de inferência compartilhadas entre as câmeras')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='detecção/encoding em N processos (modelos carregados uma vez por processo); '
+                             '0 = nas próprias threads')
+    parser.add_argument('--emit_queue', type=int, default=2,
+                        help='resultados aguardando envio por câmera; o mais antigo é descartado se a rede travar')
+    parser.add_argument('--no_metrics', action='store_true',
+                        help='desliga os histogramas por estágio (e o envio deles no node_result)')
+    parser.add_argument('--stats_interval', type=float, default=5.0,
+                        help='intervalo (s) do relatório de tempos por estágio')
     args = parser.parse_args()
+    if args.no_metrics:
+        metrics.enabled = False
 
-    known_dict = load_known()
-    known_names = list(known_dict.keys())
-    known_encs = [np.array(known_dict[n]) for n in known_names]
+    if args.all_cameras:
+        urls = load_cameras()
+    elif args.cameras:
+        known = load_cameras()
+        urls = {cid: known.get(cid) for cid in (c.strip() for c in args.cameras.split(',')) if cid}
+    elif args.camera_id:
+        urls = {args.camera_id: args.camera_url}
+    else:
+        parser.error('informe --camera_id, --cameras ou --all_cameras')
+    cams = {cid: CameraStream(cid, url, args) for cid, url in urls.items()}
+
+    if args.calibrate:
+        for cid, cam in cams.items():
+            report = calibrate_camera(cam, args.calibrate, args.recall_target)
+            print(json.dumps(report, indent=2))
+            if args.save_detector and report.get('chosen'):
+                save_camera_detector(cid, report['chosen'])
+                print(f'{cid}: detector {report["chosen"]} salvo em cameras.settings')
+        return
+
+    # uma única galeria (e matriz) para todas as câmeras do processo
+    if args.gallery_file:
+        names, matrix = load_gallery_file(Path(args.gallery_file))
+        matcher = FaceMatcher(threshold=args.threshold, capacity=max(64, len(names)))
+        matcher.load_matrix(names, matrix)
+    else:
+        matcher = FaceMatcher.from_dict(load_known(), threshold=args.threshold)
+
+    def reset_gates():
+        # a galeria muda sem reiniciar: o portão de movimento libera o próximo frame
+        for cam in cams.values():
+            cam.gate.reset()
+
+    gallery_replica = GalleryReplica(matcher, on_change=reset_gates)
+
+    pool = None
+    if args.processes > 0:
+        pool = InferencePool(workers=args.processes, max_queue=args.processes * 2)
+        pool.start()
+    else:
+        # mesmos modelos do dlib usados em `recognize`: aquece antes da primeira câmera
+        engine = init_engine()
+        print('engine ready:', json.dumps(engine.info()))
 
     sio.connect(args.server_url, transports=['websocket', 'polling'])
 
-    cap = open_capture(args.camera_url)
-    if not cap.isOpened():
-        print('Failed to open camera', args.camera_url)
+    caps = {}
+    for cid, cam in cams.items():
+        cap = open_capture(cam.url)
+        if not cap.isOpened():
+            print('Failed to open camera', cid, cam.url)
+            continue
+        caps[cid] = cap
+    if not caps:
+        sio.disconnect()
         return
 
-    try:
-        while True:
-            ok, frame = cap.read()
-            if not ok:
-                time.sleep(0.05)
-                continue
-
-            small = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-            rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
-            boxes = face_recognition.face_locations(rgb, model='hog')
-            encs = face_recognition.face_encodings(rgb, boxes)
-
-            results = []
-            for box, enc in zip(boxes, encs):
-                name = 'Desconhecido'
-                if known_encs:
-                    dists = face_recognition.face_distance(known_encs, enc)
-                    idx = int(np.argmin(dists))
-                    if dists[idx] < 0.5:
-                        name = known_names[idx]
-                top, right, bottom, left = box
-                # Scale back to original frame size
-                x = int(left * 2)
-                y = int(top * 2)
-                w = int((right - left) * 2)
-                h = int((bottom - top) * 2)
-                results.append({'name': name, 'box': [x, y, w, h]})
-
-            payload = {
-                'camera_id': args.camera_id,
-                'results': results,
-            }
-
-            if args.send_frame:
-                _, jpg = cv2.imencode('.jpg', frame)
+    def process(camera_id, frame):
+        cam = cams[camera_id]
+        # cena parada: reenvia os últimos resultados sem detectar
+        with cam.lock:
+            changed = cam.gate.check(frame)
+        if not changed:
+            metrics.inc('node_frames_gated_total', camera_id=camera_id)
+        else:
+            if pool is not None:
+                results = recognize_in_pool(pool, cam, frame, matcher)
+            else:
+                results = recognize(frame, matcher, cam)
+            if results is not None:
+                with cam.lock:
+                    cam.results = results
+                    cam.gate.commit()
+        return {'camera_id': camera_id, 'results': cam.results}
+
+    def send(camera_id, payload, frame):
+        cam = cams[camera_id]
+        if args.send_frame:
+            _, jpg = cv2.imencode('.jpg', frame)
+            if args.frame_format == 'binary':
+                payload['frame'] = jpg.tobytes()
+            else:
                 b64 = base64.b64encode(jpg.tobytes()).decode('ascii')
                 payload['frame_b64'] = 'data:image/jpeg;base64,' + b64
+        now = time.monotonic()
+        if now - cam.stats_at >= args.stats_interval:
+            cam.stats_at = now
+            payload['stats'] = {'detector': cam.detector,
+                                'motion': {'gated': cam.gate.gated, 'processed': cam.gate.processed},
+                                'pipeline': pipeline.stream_stats(camera_id),
+                                'gallery': gallery_replica.stats()}
+            if metrics.enabled:
+                # histogramas acumulados desta câmera; o servidor guarda a última cópia
+                payload['stats']['metrics'] = metrics.export(camera_id=camera_id)
+        sio.emit('node_result', payload)
 
-            sio.emit('node_result', payload)
-            # modest frame rate
-            time.sleep(0.05)
+    # vários frames da mesma câmera em paralelo só sem rastreamento (a ordem importa)
+    single = len(caps) == 1 and not next(iter(cams.values())).tracker.enabled
+    # com --processes, uma thread por processo mantém o pool ocupado
+    workers = max(1, args.workers, args.processes)
+    pipeline = NodePipeline(caps, process, send, fps=args.fps, workers=workers,
+                            emit_queue=args.emit_queue, max_in_flight=workers if single else 1)
+    pipeline.start()
+    try:
+        while not pipeline.wait(args.stats_interval):
+            print(json.dumps(pipeline.stats()))
+    except KeyboardInterrupt:
+        pass
     finally:
-        cap.release()
+        pipeline.stop()
+        for cap in caps.values():
+            cap.release()
+        if pool is not None:
+            pool.shutdown()
         sio.disconnect()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
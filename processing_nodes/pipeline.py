@@ -0,0 +1,221 @@
+"""Pipeline do nó: captura -> inferência -> envio, cada estágio na sua thread.
+
+Cada câmera tem uma thread de captura que lê sem parar e guarda só o frame
+mais novo (FrameSlot), então o buffer do dispositivo nunca acumula frames
+velhos. Os workers de inferência são compartilhados: o escalonador entrega a
+próxima câmera com frame pronto e prazo vencido no seu fps alvo, servindo
+primeiro a que espera há mais tempo (nenhuma câmera monopoliza os workers).
+O envio (JPEG + emit) roda numa fila limitada que descarta o mais antigo se
+a rede travar. Os tempos por estágio também vão para os histogramas de
+`metrics.registry` (`node_stage_seconds`), que o nó manda ao servidor.
+"""
+import queue
+import time
+from threading import Condition, Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional
+
+from frame_slot import FrameSlot
+from inference import LatencyStats
+from metrics import registry as metrics
+
+STAGES = ('capture', 'queue', 'inference', 'emit')
+
+
+class Stream:
+    """Estado de escalonamento e métricas de uma câmera."""
+
+    def __init__(self, camera_id: str, cap, fps: float, max_in_flight: int = 1):
+        self.camera_id = camera_id
+        self.cap = cap
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.max_in_flight = max(1, max_in_flight)
+        self.slot = FrameSlot()
+        self.next_due = time.monotonic()
+        self.last_served = 0.0
+        self.in_flight = 0
+        self.last_emitted_seq = -1
+        self.stages = {name: LatencyStats() for name in STAGES}
+        self._last_emit_at: Optional[float] = None
+        self.emit_fps = 0.0
+        self.emitted = 0
+        self.stale = 0
+        self.capture_failures = 0
+
+    def ready(self, now: float) -> bool:
+        return self.slot.pending and self.in_flight < self.max_in_flight and now >= self.next_due
+
+    def mark_emitted(self, now: float):
+        self.emitted += 1
+        if self._last_emit_at is not None and now > self._last_emit_at:
+            inst = 1.0 / (now - self._last_emit_at)
+            self.emit_fps = inst if self.emitted == 2 else 0.9 * self.emit_fps + 0.1 * inst
+        self._last_emit_at = now
+
+    def stats(self) -> Dict[str, Any]:
+        return {'fps': round(self.emit_fps, 2), 'captured': self.slot.received,
+                'processed': self.slot.processed, 'dropped_capture': self.slot.dropped,
+                'emitted': self.emitted, 'stale': self.stale, 'capture_failures': self.capture_failures,
+                'stages': {name: s.to_dict() for name, s in self.stages.items()}}
+
+
+class NodePipeline:
+    """Uma ou várias câmeras (`caps`: camera_id -> VideoCapture) num único processo.
+
+    `process_fn(camera_id, frame) -> payload | None` roda nos workers;
+    `emit_fn(camera_id, payload, frame)` roda na thread de envio.
+    `max_in_flight` limita frames da mesma câmera em paralelo (1 preserva a
+    ordem, necessária para o rastreador).
+    """
+
+    def __init__(self, caps: Dict[str, Any], process_fn: Callable[[str, Any], Optional[Dict[str, Any]]],
+                 emit_fn: Callable[[str, Dict[str, Any], Any], None], fps: float = 10.0,
+                 workers: int = 1, emit_queue: int = 2, max_in_flight: int = 1):
+        self.process_fn = process_fn
+        self.emit_fn = emit_fn
+        self.fps = fps
+        self.workers = max(1, workers)
+        self.streams = {cid: Stream(cid, cap, fps, max_in_flight) for cid, cap in caps.items()}
+        self._emit_q: queue.Queue = queue.Queue(maxsize=max(1, emit_queue) * max(1, len(caps)))
+        self._stop = Event()
+        self._threads: List[Thread] = []
+        self._cond = Condition()  # escalonador: frame novo ou worker livre
+        self._lock = Lock()       # métricas
+        self.dropped_emit = 0
+        self.errors = 0
+
+    def start(self):
+        self._threads = [Thread(target=self._capture_loop, args=(s,), name=f'capture-{cid}', daemon=True)
+                         for cid, s in self.streams.items()]
+        self._threads.append(Thread(target=self._emit_loop, name='node-emit', daemon=True))
+        self._threads += [Thread(target=self._inference_loop, name=f'node-infer-{i}', daemon=True)
+                          for i in range(self.workers)]
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Bloqueia até stop() (ou timeout); retorna True se parou."""
+        return self._stop.wait(timeout)
+
+    def _record(self, stream: Stream, stage: str, seconds: float):
+        with self._lock:
+            stream.stages[stage].record(seconds)
+        metrics.observe('node_stage_seconds', seconds, camera_id=stream.camera_id, stage=stage)
+
+    def _capture_loop(self, stream: Stream):
+        seq = 0
+        while not self._stop.is_set():
+            t0 = time.perf_counter()
+            ok, frame = stream.cap.read()
+            if not ok:
+                stream.capture_failures += 1
+                self._stop.wait(0.05)
+                continue
+            self._record(stream, 'capture', time.perf_counter() - t0)
+            seq += 1
+            if stream.slot.put((seq, time.monotonic(), frame)):
+                metrics.inc('node_frames_dropped_total', camera_id=stream.camera_id, reason='superseded')
+            with self._cond:
+                self._cond.notify()
+
+    def _next(self):
+        """Próxima (câmera, frame): prazo vencido, frame pronto, servida há mais tempo."""
+        with self._cond:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                ready = [s for s in self.streams.values() if s.ready(now)]
+                if ready:
+                    stream = min(ready, key=lambda s: s.last_served)
+                    item = stream.slot.take()
+                    if item is not None:
+                        stream.in_flight += 1
+                        stream.last_served = now
+                        # sem rajadas para compensar atraso
+                        stream.next_due = max(stream.next_due, now) + stream.interval
+                        return stream, item
+                waits = [s.next_due - now for s in self.streams.values()
+                         if s.slot.pending and s.in_flight < s.max_in_flight and s.next_due > now]
+                self._cond.wait(min(waits) if waits else 0.5)
+        return None, None
+
+    def _inference_loop(self):
+        while not self._stop.is_set():
+            stream, item = self._next()
+            if stream is None:
+                return
+            seq, captured_at, frame = item
+            self._record(stream, 'queue', time.monotonic() - captured_at)
+            t0 = time.perf_counter()
+            try:
+                payload = self.process_fn(stream.camera_id, frame)
+            except Exception as e:
+                self.errors += 1
+                payload = None
+                print(f'node inference error ({stream.camera_id}):', e)
+            finally:
+                with self._cond:
+                    stream.in_flight -= 1
+                    self._cond.notify()
+            self._record(stream, 'inference', time.perf_counter() - t0)
+            if payload is None:
+                continue
+            self._enqueue_emit((stream, seq, payload, frame))
+
+    def _enqueue_emit(self, entry):
+        """Rede lenta: descarta o mais antigo, o mais novo sempre entra.
+
+        Com vários workers outro thread pode ocupar a vaga liberada; tenta de novo.
+        """
+        while True:
+            try:
+                self._emit_q.put_nowait(entry)
+                return
+            except queue.Full:
+                pass
+            try:
+                old = self._emit_q.get_nowait()
+            except queue.Empty:
+                continue
+            with self._lock:
+                self.dropped_emit += 1
+            metrics.inc('node_frames_dropped_total', camera_id=old[0].camera_id, reason='emit_queue')
+
+    def _emit_loop(self):
+        while not self._stop.is_set():
+            try:
+                stream, seq, payload, frame = self._emit_q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if seq <= stream.last_emitted_seq:
+                # com vários frames em paralelo um resultado pode chegar depois de um mais novo
+                stream.stale += 1
+                metrics.inc('node_frames_dropped_total', camera_id=stream.camera_id, reason='stale')
+                continue
+            t0 = time.perf_counter()
+            try:
+                self.emit_fn(stream.camera_id, payload, frame)
+            except Exception as e:
+                self.errors += 1
+                print(f'node emit error ({stream.camera_id}):', e)
+                continue
+            now = time.perf_counter()
+            self._record(stream, 'emit', now - t0)
+            stream.last_emitted_seq = seq
+            stream.mark_emitted(now)
+
+    def stream_stats(self, camera_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return self.streams[camera_id].stats()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            streams = {cid: s.stats() for cid, s in self.streams.items()}
+        return {'fps_target': self.fps, 'workers': self.workers,
+                'fps': round(sum(s['fps'] for s in streams.values()), 2),
+                'dropped_emit': self.dropped_emit, 'errors': self.errors, 'streams': streams}